@@ -1,11 +1,134 @@
+"""
+SQLite storage layer.
+
+Connections are pooled per thread (sqlite3 connections are cheap to keep and
+expensive to re-open with pragmas) and run in WAL mode, so readers never
+block behind an ingest transaction and vice versa. Writes go through
+transaction(), which takes the write lock up front (BEGIN IMMEDIATE), and
+bulk_insert(), which streams rows through executemany in batches inside that
+one transaction.
+
+The schema is versioned with PRAGMA user_version; init_db() applies any
+migrations newer than the database.
+"""
+import os
 import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence
 
 DB_NAME = "ingestion.db"
 
-def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("""
+# rows per executemany call in bulk_insert
+BULK_BATCH_SIZE = 1000
+
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",  # durable at checkpoints; safe with WAL
+    f"PRAGMA busy_timeout={int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))}",
+    f"PRAGMA cache_size=-{int(os.environ.get('SQLITE_CACHE_KB', '65536'))}",
+    f"PRAGMA mmap_size={int(os.environ.get('SQLITE_MMAP_BYTES', str(256 * 1024 * 1024)))}",
+    "PRAGMA temp_store=MEMORY",
+)
+
+_local = threading.local()
+_POOL_LOCK = threading.Lock()
+_POOL: List[sqlite3.Connection] = []
+_POOL_GENERATION = 0
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    # isolation_level=None: autocommit for reads, explicit BEGIN in transaction()
+    conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+    for pragma in _PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_connection(db_path: Optional[str] = None) -> sqlite3.Connection:
+    """This thread's pooled connection to db_path (defaults to DB_NAME)."""
+    db_path = db_path or DB_NAME
+    if getattr(_local, "generation", None) != _POOL_GENERATION:
+        _local.connections = {}
+        _local.generation = _POOL_GENERATION
+    conn = _local.connections.get(db_path)
+    if conn is None:
+        conn = _connect(db_path)
+        with _POOL_LOCK:
+            _POOL.append(conn)
+        _local.connections[db_path] = conn
+    return conn
+
+
+def close_connections():
+    """
+    Close every pooled connection in every thread; threads reconnect on next
+    use. Call before deleting or replacing the database file.
+    """
+    global _POOL_GENERATION
+    with _POOL_LOCK:
+        for conn in _POOL:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        _POOL.clear()
+        _POOL_GENERATION += 1
+
+
+@contextmanager
+def transaction(db_path: Optional[str] = None) -> Iterator[sqlite3.Connection]:
+    """
+    One write transaction on this thread's connection, committed on success
+    and rolled back on error. Nested use joins the outer transaction.
+    """
+    conn = get_connection(db_path)
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def bulk_insert(conn: sqlite3.Connection, sql: str, rows: Iterable[Sequence],
+                batch_size: int = BULK_BATCH_SIZE, on_batch: Optional[Callable[[int, int], None]] = None) -> int:
+    """
+    Stream rows into sql with executemany, batch_size rows at a time; call
+    inside transaction(). on_batch(first_rowid, count) is called per batch:
+    while the transaction holds the write lock, one executemany into an
+    AUTOINCREMENT table assigns consecutive rowids ending at last_insert_rowid().
+    Returns the number of rows inserted.
+    """
+    total = 0
+    batch: List[Sequence] = []
+
+    def flush():
+        conn.executemany(sql, batch)
+        if on_batch is not None:
+            last = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+            on_batch(last - len(batch) + 1, len(batch))
+
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            flush()
+            total += len(batch)
+            batch = []
+    if batch:
+        flush()
+        total += len(batch)
+    return total
+
+
+# --- schema ---------------------------------------------------------------------
+
+def _create_base_tables(conn: sqlite3.Connection):
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS files (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         filename TEXT,
@@ -13,7 +136,7 @@ def init_db():
         filepath TEXT
     )
     """)
-    cursor.execute("""
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS chunks (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         file_id INTEGER,
@@ -22,5 +145,61 @@ def init_db():
         FOREIGN KEY(file_id) REFERENCES files(id)
     )
     """)
-    conn.commit()
-    conn.close()
\ No newline at end of file
+
+
+def _add_chunk_provenance(conn: sqlite3.Connection):
+    # databases created before versioning may already have some of these
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(chunks)")}
+    for column in ("start_char", "end_char", "page_start", "page_end"):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE chunks ADD COLUMN {column} INTEGER")
+
+
+def _add_secondary_indexes(conn: sqlite3.Connection):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_file ON chunks(file_id, chunk_index)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_files_filename ON files(filename)")
+
+
+def _add_deduplication(conn: sqlite3.Connection):
+    # content hash of each upload (exact duplicates) and MinHash/LSH tables
+    # for near-duplicate chunks (see services/dedup.py)
+    conn.execute("ALTER TABLE files ADD COLUMN sha256 TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_files_sha256 ON files(sha256)")
+    conn.execute("ALTER TABLE chunks ADD COLUMN duplicate_of INTEGER")
+    conn.execute("CREATE TABLE IF NOT EXISTS chunk_minhash (chunk_id INTEGER PRIMARY KEY, signature BLOB)")
+    conn.execute("CREATE TABLE IF NOT EXISTS chunk_lsh (bucket INTEGER, chunk_id INTEGER)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chunk_lsh_bucket ON chunk_lsh(bucket)")
+
+
+def _add_unindexed_files(conn: sqlite3.Connection):
+    # stored files whose chunks failed to reach the index (see services/jobs.py)
+    conn.execute("CREATE TABLE IF NOT EXISTS unindexed_files (file_id INTEGER PRIMARY KEY)")
+
+
+# MIGRATIONS[i] upgrades a database from user_version i to i + 1
+MIGRATIONS: List[Callable[[sqlite3.Connection], None]] = [
+    _create_base_tables,
+    _add_chunk_provenance,
+    _add_secondary_indexes,
+    _add_deduplication,
+    _add_unindexed_files,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate(db_path: Optional[str] = None) -> int:
+    """Apply pending migrations, each in its own transaction. Returns the schema version."""
+    conn = get_connection(db_path)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target in range(version, SCHEMA_VERSION):
+        with transaction(db_path) as tx:
+            MIGRATIONS[target](tx)
+            tx.execute(f"PRAGMA user_version={target + 1}")
+    return max(version, SCHEMA_VERSION)
+
+
+def init_db():
+    # connections opened before (e.g. to a database file that has since been
+    # removed) must not be reused
+    close_connections()
+    migrate()
@@ -0,0 +1,183 @@
+"""
+Streaming file downloads with HTTP range and conditional request support.
+
+file_response() answers a GET or HEAD for a stored file without reading it
+into memory:
+
+  - ETag is the file's sha256 (strong); files stored before hashes were
+    recorded get a weak ETag from size and mtime. Last-Modified is the mtime.
+  - If-Match / If-Unmodified-Since fail with 412, If-None-Match /
+    If-Modified-Since answer 304, in the order RFC 9110 section 13.2.2 gives.
+  - A single "bytes=" range (a-b, a- or -n) is answered with 206 and
+    Content-Range, an unsatisfiable one with 416; If-Range falls back to the
+    whole file when the validator does not match. Requests for several
+    ranges get the whole file, which RFC 9110 allows.
+  - Content-Type is whatever the caller vouches for, never guessed from the
+    client-supplied filename (a ".html" name must not be served as HTML),
+    and X-Content-Type-Options: nosniff keeps browsers from guessing either.
+
+The body is sent with the server's zero-copy extension
+(http.response.zerocopysend, i.e. sendfile) when it offers one, else read
+with pread in DOWNLOAD_CHUNK_SIZE blocks off the event loop, and stops
+when the client disconnects.
+"""
+import os
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from starlette.requests import Request
+from starlette.responses import Response
+
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get("DOWNLOAD_CHUNK_SIZE", str(256 << 10)))
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    (first, last) byte positions, inclusive, of a single-range Range header.
+    None when the header should be ignored (other units, several ranges,
+    invalid syntax); raises RangeNotSatisfiable when no byte of it exists.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = spec.strip().partition("-")
+    if not dash or not (first.isdigit() or last.isdigit()) or \
+            (first and not first.isdigit()) or (last and not last.isdigit()):
+        return None
+    if not first:
+        # suffix: the last n bytes
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise RangeNotSatisfiable(header)
+        return max(size - suffix, 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def _etag_matches(header: str, etag: str, weak: bool) -> bool:
+    """header is "*" or a list of entity tags; weak comparison ignores W/ prefixes."""
+    if header.strip() == "*":
+        return True
+    tags = [t.strip() for t in header.split(",")]
+    if weak:
+        return etag.removeprefix("W/") in (t.removeprefix("W/") for t in tags)
+    return not etag.startswith("W/") and etag in tags
+
+
+def _not_modified_since(header: str, mtime: int) -> Optional[bool]:
+    """True if the file is unchanged since the HTTP date in header, None if it is not a date."""
+    try:
+        return mtime <= int(parsedate_to_datetime(header).timestamp())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def _content_disposition(filename: str) -> str:
+    fallback = filename.encode("ascii", "replace").decode("ascii").replace('"', "'").replace("?", "_")
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
+
+
+class _FileBody(Response):
+    """Bytes [start, start + length) of a file, sent with sendfile if the server supports it."""
+
+    def __init__(self, path: str, start: int, length: int, status_code: int, headers: dict, send_body: bool):
+        super().__init__(status_code=status_code, headers=headers)
+        # headers carry the content-length of the range; Response only fills one in when it is missing
+        self.path = path
+        self.start = start
+        self.length = length
+        self.send_body = send_body
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body or self.length == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        with open(self.path, "rb") as f:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopysend", "file": f, "offset": self.start,
+                            "count": self.length, "more_body": False})
+                return
+            async with anyio.create_task_group() as group:
+                async def stream():
+                    await self._stream(f.fileno(), send)
+                    group.cancel_scope.cancel()
+
+                group.start_soon(stream)
+                await self._wait_for_disconnect(receive)
+                group.cancel_scope.cancel()
+
+    async def _stream(self, fd: int, send):
+        offset, end = self.start, self.start + self.length
+        while offset < end:
+            block = await anyio.to_thread.run_sync(os.pread, fd, min(DOWNLOAD_CHUNK_SIZE, end - offset), offset)
+            if not block:
+                raise RuntimeError(f"{self.path} shrank while it was being sent")
+            offset += len(block)
+            await send({"type": "http.response.body", "body": block, "more_body": offset < end})
+
+    @staticmethod
+    async def _wait_for_disconnect(receive):
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+
+
+def file_response(request: Request, path: str, filename: str, sha256: Optional[str] = None,
+                  content_type: str = "application/octet-stream") -> Response:
+    """
+    GET/HEAD response for the file at path, downloaded as filename.
+    Raises FileNotFoundError if it is not on disk.
+    """
+    st = os.stat(path)
+    if not stat.S_ISREG(st.st_mode):
+        raise FileNotFoundError(path)
+    size, mtime = st.st_size, int(st.st_mtime)
+    etag = f'"{sha256}"' if sha256 else f'W/"{size:x}-{st.st_mtime_ns:x}"'
+    headers = {"etag": etag, "last-modified": formatdate(mtime, usegmt=True), "accept-ranges": "bytes",
+               "x-content-type-options": "nosniff"}
+    req = request.headers
+
+    if "if-match" in req:
+        if not _etag_matches(req["if-match"], etag, weak=False):
+            return Response(status_code=412, headers=headers)
+    elif "if-unmodified-since" in req and _not_modified_since(req["if-unmodified-since"], mtime) is False:
+        return Response(status_code=412, headers=headers)
+    if "if-none-match" in req:
+        if _etag_matches(req["if-none-match"], etag, weak=True):
+            return Response(status_code=304, headers=headers)
+    elif "if-modified-since" in req and _not_modified_since(req["if-modified-since"], mtime):
+        return Response(status_code=304, headers=headers)
+
+    headers["content-type"] = content_type
+    headers["content-disposition"] = _content_disposition(filename)
+    byte_range = None
+    if request.method == "GET" and "range" in req:
+        if_range = req.get("if-range")
+        if if_range is None or (
+                _etag_matches(if_range, etag, weak=False) if if_range.lstrip().startswith(("\"", "W/"))
+                else formatdate(mtime, usegmt=True) == if_range.strip()):
+            try:
+                byte_range = parse_range(req["range"], size)
+            except RangeNotSatisfiable:
+                return Response(status_code=416, headers={**headers, "content-range": f"bytes */{size}"})
+
+    if byte_range is None:
+        start, length, status_code = 0, size, 200
+    else:
+        start, length, status_code = byte_range[0], byte_range[1] - byte_range[0] + 1, 206
+        headers["content-range"] = f"bytes {byte_range[0]}-{byte_range[1]}/{size}"
+    headers["content-length"] = str(length)
+    return _FileBody(path, start, length, status_code, headers, send_body=request.method != "HEAD")
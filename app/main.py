@@ -1,15 +1,42 @@
+import logging
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
-from app.routes import ingestion, qa
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+from app.routes import admin, ingestion, qa
 from app.db import init_db
+from app.services.model_registry import MODEL_WARMUP, MODELS
+from app import tracing
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # MODEL_WARMUP: load models before serving, so the first queries do not pay for it
+    if MODEL_WARMUP:
+        results = await run_in_threadpool(MODELS.warm_up, MODEL_WARMUP)
+        logger.info("Model warm-up: %s", results)
+    yield
 
-app = FastAPI(title="Multimodal Knowledge Assistant")
+
+app = FastAPI(title="Multimodal Knowledge Assistant", lifespan=lifespan)
+app.add_middleware(tracing.TimingMiddleware)
 
 init_db()
 
 app.include_router(ingestion.router, prefix="/ingestion", tags=["Ingestion"])
 app.include_router(qa.router, tags=["qa"])
+app.include_router(admin.router, prefix="/admin", tags=["admin"])
 
 
 @app.get("/health")
 def health():
-    return {"status": "ok"}
\ No newline at end of file
+    return {"status": "ok"}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus metrics of this process (stage and request latency histograms, counters)."""
+    return PlainTextResponse(tracing.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,10 +1,12 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
 
 
 class QueryRequest(BaseModel):
     q: str
     top_k: int = 3  # default return 3 snippets
+    # latency budget for the whole request; the answer method is chosen to fit it
+    budget_ms: Optional[int] = Field(None, gt=0, le=600000)
 
 
 class Snippet(BaseModel):
@@ -15,4 +17,25 @@ class Snippet(BaseModel):
 class QueryResponse(BaseModel):
     query: str
     results: List[Snippet]
-    answer: Optional[str] = None
\ No newline at end of file
+    answer: Optional[str] = None
+    # "cache", "transformer", "textrank" or "lead" (see services/answer.py)
+    answer_method: Optional[str] = None
+
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=1000)
+    top_k: int = 3
+
+
+class BatchQueryResult(BaseModel):
+    query: str
+    results: List[Snippet]
+
+
+class BatchQueryResponse(BaseModel):
+    results: List[BatchQueryResult]
+
+
+class ModelWarmupRequest(BaseModel):
+    # registered model names ("embedder", "summarizer", "textrank"); None or ["all"] warms every one
+    models: Optional[List[str]] = None
@@ -0,0 +1,35 @@
+from fastapi import APIRouter, HTTPException
+
+from app.models import ModelWarmupRequest
+from app.services.model_registry import MODELS, UnknownModelError
+
+# the services register their models on import
+from app.services import embeddings, summarizer  # noqa: F401
+
+router = APIRouter()
+
+
+@router.get("/models")
+def list_models():
+    """Registered models, which are loaded in this process, their approximate size and last use."""
+    return MODELS.stats()
+
+
+@router.post("/models/warmup")
+def warm_up_models(request: ModelWarmupRequest):
+    """Load models now instead of on the first request that needs them."""
+    try:
+        results = MODELS.warm_up(request.models)
+    except UnknownModelError as e:
+        raise HTTPException(status_code=404, detail=f"Unknown model: {e.args[0]}")
+    return {"results": results, **MODELS.stats()}
+
+
+@router.delete("/models/{name}")
+def unload_model(name: str):
+    """Unload a model from this process; it is loaded again when next needed."""
+    try:
+        unloaded = MODELS.unload(name)
+    except UnknownModelError:
+        raise HTTPException(status_code=404, detail=f"Unknown model: {name}")
+    return {"model": name, "unloaded": unloaded}
@@ -1,83 +1,133 @@
-from fastapi import APIRouter, UploadFile
-import shutil, os
-import sqlite3
-from app.db import DB_NAME
-from app.services.pdf_parser import extract_text_from_pdf
-from app.services.chunker import chunk_text
+from fastapi import APIRouter, HTTPException, Request, Response
+from starlette.concurrency import run_in_threadpool
+import uuid, os
+from app.db import get_connection
+from app.downloads import file_response
+from app.uploads import UPLOAD_FIELD, receive_upload
+from app.services.ingest import is_unindexed, stored_file_id
+from app.services.jobs import QueueFullError, get_job_queue
+from app.tracing import span
 
 router = APIRouter()
 
 UPLOAD_DIR = "data/"
+# Content-Type of downloads by the sniffed files.filetype, never by the client's filename
+CONTENT_TYPES = {"pdf": "application/pdf", "txt": "text/plain; charset=utf-8"}
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-@router.post("/upload")
-async def upload_file(file: UploadFile):
-    filepath = os.path.join(UPLOAD_DIR, file.filename)
-    with open(filepath, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
 
-    filetype = "pdf" if file.filename.endswith(".pdf") else "txt"
+def _content_path(sha256: str, filetype: str) -> str:
+    # content-addressed, so uploads that share a name never overwrite each other;
+    # the extension is the sniffed type, not the client's
+    return os.path.join(UPLOAD_DIR, sha256[:2], f"{sha256}.{filetype}")
 
-    # Extract text
-    if filetype == "pdf":
-        text = extract_text_from_pdf(filepath)
-    else:
-        text = open(filepath, "r", encoding="utf-8").read()
 
-    # Chunk text
-    chunks = chunk_text(text)
+# the body is parsed by receive_upload, so describe it for the OpenAPI docs by hand
+UPLOAD_OPENAPI = {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+    "type": "object", "required": [UPLOAD_FIELD],
+    "properties": {UPLOAD_FIELD: {"type": "string", "format": "binary"}},
+}}}}}
 
-    # Store metadata + chunks in DB
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO files (filename, filetype, filepath) VALUES (?, ?, ?)", 
-                   (file.filename, filetype, filepath))
-    file_id = cursor.lastrowid
 
-    for idx, chunk in enumerate(chunks):
-        cursor.execute("INSERT INTO chunks (file_id, chunk_index, content) VALUES (?, ?, ?)", 
-                       (file_id, idx, chunk))
+def _place_upload(tmp_path: str, filepath: str):
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    os.replace(tmp_path, filepath)
 
-    conn.commit()
-    conn.close()
 
-    #build/update BM25 index from all chunks in DB
-    from app.services.indexer import Indexer
-    indexer = Indexer(method="bm25")
+def _queue_full() -> HTTPException:
+    return HTTPException(status_code=429, detail="Ingestion queue is full, retry later",
+                         headers={"Retry-After": "1"})
 
-    # fetch all chunks (not just this file’s, so multiple docs are indexed)
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT content FROM chunks")
-    all_chunks = [row[0] for row in cursor.fetchall()]
-    conn.close()
 
-    indexer.build_index(all_chunks)
+@router.post("/upload", status_code=202, openapi_extra=UPLOAD_OPENAPI)
+async def upload_file(request: Request, response: Response):
+    """
+    Stream the upload (multipart field "file", a PDF or UTF-8 text) to disk
+    and queue it for parsing, chunking, storage and indexing. Returns a job
+    id immediately; poll /ingestion/jobs/{job_id} for progress.
+
+    Oversized, unsupported or malformed uploads are rejected while the body
+    is still arriving (413, 415, 400; see app/uploads.py). Content that is
+    already stored is not ingested again: the response is a 200 with status
+    "duplicate" and the stored file's id. If that content never made it into
+    the index, a job is queued to index it instead.
+    """
+    jobs = get_job_queue()
+    if jobs.full():
+        raise _queue_full()
+
+    tmp_path = os.path.join(UPLOAD_DIR, f".upload-{uuid.uuid4().hex}")
+    try:
+        with span("upload.save"):
+            upload = await receive_upload(request, tmp_path)
+        with span("upload.lookup"):
+            existing = await run_in_threadpool(stored_file_id, upload.sha256)
+            if existing is not None and await run_in_threadpool(is_unindexed, existing):
+                existing = None  # stored but never indexed: the job's index pass retries it
+        if existing is not None:
+            response.status_code = 200
+            return {"job_id": None, "filename": upload.filename, "status": "duplicate",
+                    "file_id": existing, "sha256": upload.sha256}
+        filepath = _content_path(upload.sha256, upload.filetype)
+        await run_in_threadpool(_place_upload, tmp_path, filepath)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    try:
+        job = jobs.submit(upload.filename, filepath, sha256=upload.sha256)
+    except QueueFullError:
+        raise _queue_full()
 
     return {
-        "file_id": file_id,
-        "filename": file.filename,
-        "chunks": len(chunks),
-        "status": "ingested + indexed"
+        "job_id": job.id,
+        "filename": upload.filename,
+        "status": job.status,
+        "sha256": upload.sha256,
     }
 
+
+@router.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
 @router.get("/list")
 def list_files():
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM files")
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
-
-@router.get("/download/{file_id}")
-def download_file(file_id: int):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT filepath FROM files WHERE id=?", (file_id,))
-    row = cursor.fetchone()
-    conn.close()
+    return get_connection().execute("SELECT * FROM files").fetchall()
+
+@router.api_route("/download/{file_id}", methods=["GET", "HEAD"])
+def download_file(file_id: int, request: Request):
+    """
+    The stored file, streamed from disk. Supports Range (resumable and
+    partial downloads) and conditional requests on its sha256 ETag. The
+    Content-Type follows the stored content type, not the upload's name.
+    """
+    row = get_connection().execute("SELECT filename, filepath, sha256, filetype FROM files WHERE id=?",
+                                   (file_id,)).fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail="File not found")
+    filename, filepath, sha256, filetype = row
+    try:
+        return file_response(request, filepath, filename or os.path.basename(filepath), sha256,
+                             content_type=CONTENT_TYPES.get(filetype, "application/octet-stream"))
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File is missing from storage")
+
+
+@router.get("/chunks/{chunk_id}")
+def get_chunk(chunk_id: int):
+    """A stored chunk with its provenance: source file, page range and character offsets."""
+    row = get_connection().execute(
+        "SELECT c.id, c.file_id, f.filename, c.chunk_index, c.page_start, c.page_end, "
+        "c.start_char, c.end_char, c.content "
+        "FROM chunks c JOIN files f ON f.id = c.file_id WHERE c.id=?",
+        (chunk_id,),
+    ).fetchone()
     if not row:
-        return {"error": "File not found"}
-    filepath = row[0]
-    return {"filepath": filepath}
\ No newline at end of file
+        raise HTTPException(status_code=404, detail="Chunk not found")
+    keys = ("chunk_id", "file_id", "filename", "chunk_index", "page_start", "page_end",
+            "start_char", "end_char", "content")
+    return dict(zip(keys, row))
@@ -1,36 +1,157 @@
-from fastapi import APIRouter, HTTPException
-from app.models import QueryRequest, QueryResponse, Snippet
-from app.services.retriever import Retriever
-from app.services.summarizer import summarize
+import json
+import time
+from typing import Iterator, List, Optional, Tuple
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from app.models import (
+    BatchQueryRequest,
+    BatchQueryResponse,
+    BatchQueryResult,
+    QueryRequest,
+    QueryResponse,
+    Snippet,
+)
+from app.services.retriever import get_retriever
+from app.services.answer import ANSWER_BUDGET_MS, AnswerStream, generate_answer
+from app.services.cache import QUERY_CACHE, normalize_query
+from app.tracing import span
 import logging
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
+def _query_key(retriever, q: str, top_k: int) -> Tuple[str, int, int]:
+    return normalize_query(q, getattr(retriever, "method", None)), top_k, retriever.generation
+
+
+def _retrieve(request: QueryRequest) -> Tuple[List[Snippet], Optional[int]]:
+    """Ranked snippets (from QUERY_CACHE when possible) and the index generation they come from."""
+    with span("retriever.load"):
+        retriever = get_retriever()
+    generation = getattr(retriever, "generation", None)
+    results = None
+    if generation is not None:
+        key = _query_key(retriever, request.q, request.top_k)
+        results = QUERY_CACHE.get(key, generation)
+    if results is None:
+        with span("retriever.query"):
+            results = retriever.query(request.q, request.top_k)
+        if generation is not None:
+            QUERY_CACHE.put(key, [(txt, float(score)) for txt, score in results], generation)
+    return [Snippet(text=txt, score=score) for txt, score in results], generation
+
+
+def _summary_input(snippets: List[Snippet]) -> str:
+    # combine top-k snippets, trimmed to a safe size for the summarizer
+    return " ".join([s.text for s in snippets])[:6000]
+
+
 @router.post("/query", response_model=QueryResponse)
 def query_docs(request: QueryRequest):
+    # the budget covers retrieval too
+    deadline = time.monotonic() + (request.budget_ms or ANSWER_BUDGET_MS) / 1000
+    try:
+        snippets, generation = _retrieve(request)
+        with span("answer"):
+            answer, method = generate_answer(_summary_input(snippets), deadline, generation)
+        return QueryResponse(query=request.q, results=snippets, answer=answer, answer_method=method)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Index not built yet. Please ingest docs first.")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _ndjson(event: str, data: dict) -> str:
+    return json.dumps({"event": event, **data}) + "\n"
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.post("/query/stream")
+def query_docs_stream(request: QueryRequest, http_request: Request):
+    """
+    /query as a stream of events, so clients can show snippets before the
+    summary is done:
+
+      results  {"query", "results"}  as soon as retrieval finishes
+      answer   {"text"}              summary pieces as they are generated
+      done     {"answer", "answer_method"[, "truncated"]}
+                                     the full summary, and how it was made
+      error    {"detail"}            if summarization fails midway
+
+    The answer is chosen under the same budget as /query (see
+    app.services.answer); "truncated" is set when a transformer summary was
+    cut off at the deadline.
+
+    Newline-delimited JSON ({"event": ..., ...} per line) by default;
+    Server-Sent Events when the client sends Accept: text/event-stream.
+    Retrieval errors are returned as plain HTTP errors, like /query.
+    """
+    # the budget covers retrieval too
+    deadline = time.monotonic() + (request.budget_ms or ANSWER_BUDGET_MS) / 1000
+    try:
+        snippets, generation = _retrieve(request)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Index not built yet. Please ingest docs first.")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    sse = "text/event-stream" in http_request.headers.get("accept", "")
+    encode = _sse if sse else _ndjson
+
+    def events() -> Iterator[str]:
+        yield encode("results", {"query": request.q, "results": [s.model_dump() for s in snippets]})
+        answer, pieces = AnswerStream(_summary_input(snippets), deadline, generation), []
+        try:
+            with span("answer"):
+                for piece in answer:
+                    pieces.append(piece)
+                    yield encode("answer", {"text": piece})
+        except Exception as e:
+            logger.exception("Streaming summary failed")
+            yield encode("error", {"detail": str(e)})
+            return
+        done = {"answer": "".join(pieces), "answer_method": answer.method}
+        if answer.truncated:
+            done["truncated"] = True
+        yield encode("done", done)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+        # keep reverse proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/query/batch", response_model=BatchQueryResponse)
+def query_docs_batch(request: BatchQueryRequest):
+    """Retrieval only (no summarization) for many queries, scored in one sparse product."""
     try:
-        retriever = Retriever()
-        results = retriever.query(request.q, request.top_k)
-        snippets = [Snippet(text=txt, score=score) for txt, score in results]
-
-        # combine top-k snippets and run summarizer
-        combined_text = " ".join([s.text for s in snippets])
-        if not combined_text:
-            answer = ""
-        else:
-            # trim to safe size
-            combined_text = combined_text[:6000]
-            try:
-                answer = summarize(combined_text, method="transformer", max_length=200, min_length=50)
-            except Exception as e:
-                logger.exception("Transformer summarizer failed, falling back to TextRank")
-                # fallback
-                answer = summarize(combined_text, method="textrank", sentences_count=3)
-
-        return QueryResponse(query=request.q, results=snippets, answer=answer)
+        with span("retriever.load"):
+            retriever = get_retriever()
+        generation = getattr(retriever, "generation", None)
+        batch = [None] * len(request.queries)
+        if generation is not None:
+            batch = [QUERY_CACHE.get(_query_key(retriever, q, request.top_k), generation) for q in request.queries]
+        # only the queries that missed the cache are scored, still in one batch
+        missed = [i for i, results in enumerate(batch) if results is None]
+        if missed:
+            with span("retriever.query_batch"):
+                scored = retriever.query_batch([request.queries[i] for i in missed], request.top_k)
+            for i, results in zip(missed, scored):
+                batch[i] = [(txt, float(score)) for txt, score in results]
+                if generation is not None:
+                    QUERY_CACHE.put(_query_key(retriever, request.queries[i], request.top_k), batch[i], generation)
+        return BatchQueryResponse(results=[
+            BatchQueryResult(query=q, results=[Snippet(text=txt, score=score) for txt, score in results])
+            for q, results in zip(request.queries, batch)
+        ])
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Index not built yet. Please ingest docs first.")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,317 @@
+"""
+Deadline-aware answer generation for /query.
+
+Every query has a latency budget (QueryRequest.budget_ms, else
+ANSWER_BUDGET_MS) that starts when the request arrives, so retrieval time
+counts against it. Within what is left, generate_answer() picks the best
+answer it expects to finish in time:
+
+  1. "cache"        a transformer summary of the same snippets from ANSWER_CACHE
+  2. "transformer"  if its expected latency fits
+  3. "textrank"     if its expected latency fits
+  4. "lead"         the first sentences of the snippets (no model, instant)
+
+Expected latency comes from an EWMA of recent latencies per method and input
+length bucket; it also counts the requests already waiting in the summary
+pool, or the in-process runs still queued or running when there is no pool.
+A transformer summary that is still running when only the TextRank reserve
+is left is abandoned: its request is cancelled, and pool workers drop it
+unless they are already generating it. A method that fails falls through to
+the next one. Transformer runs that overrun still update the estimate, so a
+saturated pool is skipped outright; estimates expire after LATENCY_STALE_S,
+after which the next request probes the transformer again.
+
+AnswerStream makes the same choice for /query/stream and yields the answer
+in pieces. A streamed transformer summary must produce its first piece
+while TextRank still fits, or it is cancelled for TextRank; once pieces
+have been sent it can no longer be replaced, so it is cut off at the
+deadline instead (truncated). Streamed summaries decode greedily, so their
+latency is tracked separately ("transformer_stream").
+"""
+import os
+import re
+import time
+import logging
+import threading
+from bisect import bisect_left
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from app.services import summary_pool
+from app.services.cache import ANSWER_CACHE, text_key
+from app.services.summarizer import (
+    summarize,
+    summarize_stream,
+    transformer_summarize_batch,
+    transformer_summarize_stream,
+)
+from app.tracing import Counter, span
+
+logger = logging.getLogger(__name__)
+
+ANSWER_BUDGET_MS = int(os.environ.get("ANSWER_BUDGET_MS", "3000"))
+LATENCY_EWMA_ALPHA = float(os.environ.get("LATENCY_EWMA_ALPHA", "0.2"))
+# estimates not refreshed for this long are dropped, so a skipped method gets tried again
+LATENCY_STALE_S = float(os.environ.get("LATENCY_STALE_S", "30"))
+
+# input length buckets (characters) that latency is tracked in; /query trims to 6000
+LENGTH_BUCKETS = (500, 1500, 3000, 6000)
+# assumed TextRank latency before it has been measured
+DEFAULT_TEXTRANK_S = 0.05
+
+TRANSFORMER_ARGS = {"max_length": 200, "min_length": 50}
+TEXTRANK_SENTENCES = 3
+
+ANSWERS = Counter("answers_total", "Answers by the method that produced them.", ("method",))
+ANSWER_OVERRUNS = Counter("answer_overruns_total", "Summaries abandoned because they ran over the budget.",
+                          ("method",))
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+# in-process transformer runs when the summary pool is disabled
+_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="answer")
+# runs submitted to _EXECUTOR and not finished (queued or running); a running
+# one cannot be cancelled, so later requests wait behind it
+_local_runs = 0
+_LOCAL_RUNS_LOCK = threading.Lock()
+
+
+class LatencyModel:
+    """EWMA of summarizer latency (seconds) per method and input length bucket."""
+
+    def __init__(self, alpha: float = LATENCY_EWMA_ALPHA, stale_s: float = LATENCY_STALE_S):
+        self.alpha = alpha
+        self.stale_s = stale_s
+        self._lock = threading.Lock()
+        # (method, bucket) -> (ewma seconds, last observed at)
+        self._ewma: Dict[Tuple[str, int], Tuple[float, float]] = {}
+
+    @staticmethod
+    def _bucket(chars: int) -> int:
+        return min(bisect_left(LENGTH_BUCKETS, chars), len(LENGTH_BUCKETS) - 1)
+
+    def observe(self, method: str, chars: int, seconds: float):
+        key = (method, self._bucket(chars))
+        now = time.monotonic()
+        with self._lock:
+            old = self._ewma.get(key)
+            if old is None or now - old[1] > self.stale_s:
+                self._ewma[key] = (seconds, now)
+            else:
+                self._ewma[key] = (old[0] + self.alpha * (seconds - old[0]), now)
+
+    def estimate(self, method: str, chars: int) -> Optional[float]:
+        """Expected latency, scaled from the nearest measured bucket; None if not measured recently."""
+        bucket = self._bucket(chars)
+        now = time.monotonic()
+        with self._lock:
+            seen = {b: s for (m, b), (s, at) in self._ewma.items() if m == method and now - at <= self.stale_s}
+        if not seen:
+            return None
+        if bucket in seen:
+            return seen[bucket]
+        nearest = min(seen, key=lambda b: abs(b - bucket))
+        return seen[nearest] * LENGTH_BUCKETS[bucket] / LENGTH_BUCKETS[nearest]
+
+    def reset(self):
+        with self._lock:
+            self._ewma.clear()
+
+
+LATENCY = LatencyModel()
+
+def cached_answer(text: str, generation: Optional[int] = None) -> Optional[str]:
+    """Transformer summary of this snippet text cached for the index generation, if any."""
+    return ANSWER_CACHE.get(text_key(text, **TRANSFORMER_ARGS), generation)
+
+
+def lead(text: str, sentences_count: int = TEXTRANK_SENTENCES) -> str:
+    """First sentences of the text: the answer of last resort, it costs nothing."""
+    return " ".join(_SENTENCE_END.split(text.strip())[:sentences_count])
+
+
+def _local_run_finished(future: Future):
+    global _local_runs
+    with _LOCAL_RUNS_LOCK:
+        _local_runs -= 1
+
+
+def _submit_transformer(text: str) -> Future:
+    global _local_runs
+    pool = summary_pool.get_summary_pool()
+    if pool is not None:
+        return pool.submit(text, **TRANSFORMER_ARGS)
+    with _LOCAL_RUNS_LOCK:
+        _local_runs += 1
+    try:
+        future = _EXECUTOR.submit(lambda: transformer_summarize_batch([text], **TRANSFORMER_ARGS)[0])
+    except BaseException:
+        _local_run_finished(None)
+        raise
+    future.add_done_callback(_local_run_finished)
+    return future
+
+
+def _queue_wait(estimate: float) -> float:
+    """
+    Extra wait behind requests already in the summary pool (batched
+    SUMMARY_MAX_BATCH at a time), or behind the in-process runs, one at a time.
+    """
+    pool = summary_pool.get_summary_pool()
+    if pool is None:
+        with _LOCAL_RUNS_LOCK:
+            return _local_runs * estimate
+    workers = max(summary_pool.SUMMARY_WORKERS, 1) * max(summary_pool.SUMMARY_MAX_BATCH, 1)
+    return pool.pending() // workers * estimate
+
+
+def _transformer(text: str, deadline: float, reserve: float, generation: Optional[int]) -> Optional[str]:
+    """
+    Transformer summary if it finishes before deadline - reserve, else None.
+    A request that runs out of time is cancelled, so a queued one is never computed.
+    """
+    start = time.monotonic()
+    try:
+        future = _submit_transformer(text)
+    except Exception as e:
+        logger.warning("Transformer summarizer unavailable: %s", e)
+        return None
+    try:
+        with span("summarize.transformer"):
+            answer = future.result(timeout=max(deadline - reserve - time.monotonic(), 0))
+    except FutureTimeoutError:
+        future.cancel()
+        ANSWER_OVERRUNS.inc(method="transformer")
+        # it needed more than the time it had; counting it as twice that keeps a
+        # saturated pool from being picked again by requests with the same budget
+        LATENCY.observe("transformer", len(text), 2 * (time.monotonic() - start))
+        return None
+    except Exception:
+        logger.exception("Transformer summarizer failed, falling back")
+        return None
+    LATENCY.observe("transformer", len(text), time.monotonic() - start)
+    ANSWER_CACHE.put(text_key(text, **TRANSFORMER_ARGS), answer, generation)
+    return answer
+
+
+def _textrank(text: str) -> Optional[str]:
+    start = time.monotonic()
+    try:
+        answer = summarize(text, method="textrank", sentences_count=TEXTRANK_SENTENCES)
+    except Exception:
+        logger.exception("TextRank summarizer failed, falling back to lead sentences")
+        return None
+    LATENCY.observe("textrank", len(text), time.monotonic() - start)
+    return answer
+
+
+def _plan(text: str, deadline: float, transformer: str = "transformer") -> Tuple[float, bool, bool]:
+    """(TextRank estimate, whether TextRank fits, whether to try the transformer) in the time left."""
+    textrank_s = LATENCY.estimate("textrank", len(text)) or DEFAULT_TEXTRANK_S
+    # a transformer attempt keeps textrank_s in reserve, so TextRank still fits after it
+    textrank_fits = textrank_s <= deadline - time.monotonic()
+    transformer_s = LATENCY.estimate(transformer, len(text))
+    try_transformer = textrank_fits and (
+        transformer_s is None or transformer_s + _queue_wait(transformer_s) + textrank_s <= deadline - time.monotonic())
+    return textrank_s, textrank_fits, try_transformer
+
+
+def generate_answer(text: str, deadline: float, generation: Optional[int] = None) -> Tuple[str, Optional[str]]:
+    """
+    Best answer for the combined snippet text that is expected to be ready
+    by deadline (time.monotonic()). generation is the index generation the
+    snippets came from. Returns (answer, method).
+    """
+    if not text:
+        return "", None
+    method, answer = "cache", cached_answer(text, generation)
+    if answer is None:
+        textrank_s, textrank_fits, try_transformer = _plan(text, deadline)
+        if try_transformer:
+            method, answer = "transformer", _transformer(text, deadline, textrank_s, generation)
+        if answer is None and textrank_fits:
+            method, answer = "textrank", _textrank(text)
+        if answer is None:
+            method, answer = "lead", lead(text)
+    ANSWERS.inc(method=method)
+    return answer, method
+
+
+class AnswerStream:
+    """
+    generate_answer() as a stream of text pieces that concatenate to the
+    answer. Once iteration ends, method is the method that produced it and
+    truncated is True if a transformer summary was cut off at the deadline.
+    An error after pieces were sent is raised; before that, it falls through
+    to the next method like generate_answer().
+    """
+
+    def __init__(self, text: str, deadline: float, generation: Optional[int] = None):
+        self.text = text
+        self.deadline = deadline
+        self.generation = generation
+        self.method: Optional[str] = None
+        self.truncated = False
+
+    def __iter__(self) -> Iterator[str]:
+        text = self.text
+        if not text:
+            return
+        cached = cached_answer(text, self.generation)
+        if cached is not None:
+            yield from self._done("cache", [cached])
+            return
+        textrank_s, textrank_fits, try_transformer = _plan(text, self.deadline, "transformer_stream")
+        if try_transformer and (yield from self._transformer(textrank_s)):
+            self._done("transformer", [])
+            return
+        if textrank_fits:
+            start = time.monotonic()
+            try:
+                sentences = list(summarize_stream(text, method="textrank", sentences_count=TEXTRANK_SENTENCES))
+            except Exception:
+                logger.exception("TextRank summarizer failed, falling back to lead sentences")
+            else:
+                LATENCY.observe("textrank", len(text), time.monotonic() - start)
+                yield from self._done("textrank", sentences)
+                return
+        yield from self._done("lead", [lead(text)])
+
+    def _done(self, method: str, pieces: List[str]) -> Iterator[str]:
+        self.method = method
+        ANSWERS.inc(method=method)
+        return iter(pieces)
+
+    def _transformer(self, reserve: float):
+        """Yields transformer pieces; returns True if it produced the answer, False to fall back."""
+        text, start = self.text, time.monotonic()
+        try:
+            stream = transformer_summarize_stream(text, **TRANSFORMER_ARGS)
+        except Exception as e:
+            logger.warning("Transformer summarizer unavailable: %s", e)
+            return False
+        sent = False
+        try:
+            with span("summarize.transformer"):
+                while True:
+                    # before the first piece TextRank must still fit after it; then only the deadline counts
+                    until = self.deadline - (0 if sent else reserve)
+                    piece = stream.next(timeout=max(until - time.monotonic(), 0))
+                    if piece is None:
+                        break
+                    sent = True
+                    yield piece
+        except FutureTimeoutError:
+            ANSWER_OVERRUNS.inc(method="transformer")
+            LATENCY.observe("transformer_stream", len(text), 2 * (time.monotonic() - start))
+            self.truncated = sent
+            return sent
+        except Exception:
+            if sent:
+                raise
+            logger.exception("Transformer summarizer failed, falling back")
+            return False
+        finally:
+            stream.close()  # cancels it unless it finished
+        LATENCY.observe("transformer_stream", len(text), time.monotonic() - start)
+        return True
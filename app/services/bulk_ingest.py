@@ -0,0 +1,316 @@
+"""
+Offline bulk ingestion of a directory tree.
+
+    python -m app.services.bulk_ingest /path/to/docs --workers 8
+
+Uploading a backlog file by file through the API indexes every upload on
+its own. bulk_ingest() instead walks the directory for PDF and text files,
+parses, chunks and MinHashes them in a process pool (parse_file, the same
+streaming extraction and chunking the API uses), stores each file's rows
+from the main process (SQLite has one writer; near-duplicate detection
+needs the chunks stored before it) and appends all new chunks to the
+index once at the end, as one segment.
+
+Progress goes to stderr every --progress-interval seconds. Every finished
+file and the final index step are appended to a journal (JSON lines,
+default data/bulk-ingest/<hash of the resolved directory>.jsonl, so the
+input tree can be read-only), so an interrupted run started again skips the files it already stored or found duplicate, retries the
+ones that failed, and indexes the stored files that were never indexed.
+A file is journaled as "storing" before its rows are committed, so one
+whose commit landed just before an interrupt is still indexed on resume.
+Files are referenced in place (files.filepath is their absolute path), not
+copied into data/; content already stored, by the API or an earlier run,
+is not ingested twice. The index is merged down to INDEX_MAX_SEGMENTS
+before returning rather than in a background thread, which would die with
+the process.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional, Sequence, Set, TextIO, Tuple
+
+from app.db import get_connection, init_db
+from app.services import dedup
+from app.services.indexer import Indexer, read_index_generation
+from app.services.ingest import INDEX_METHOD, index_chunks, parse_file, store_parsed, stored_file_id
+
+logger = logging.getLogger(__name__)
+
+BULK_INGEST_EXTENSIONS = (".pdf", ".txt")
+JOURNAL_DIR = "data/bulk-ingest"
+# stay below SQLite's default host-parameter limit in IN (...) lookups
+_LOOKUP_BATCH = 500
+_HASH_BLOCK_SIZE = 1 << 20
+
+STORED, DUPLICATE, FAILED = "stored", "duplicate", "failed"
+# written before a file's rows are committed; replaced by its outcome
+STORING = "storing"
+
+
+def iter_files(directory: str, extensions: Sequence[str] = BULK_INGEST_EXTENSIONS) -> Iterator[str]:
+    """Paths relative to directory of the files to ingest, in a stable order; hidden entries are skipped."""
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for name in sorted(files):
+            if not name.startswith(".") and name.lower().endswith(tuple(extensions)):
+                yield os.path.relpath(os.path.join(root, name), directory)
+
+
+def default_journal_path(directory: str) -> str:
+    """Journal of runs over directory, outside it and shared by every spelling of its path."""
+    key = hashlib.sha256(os.path.realpath(directory).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(JOURNAL_DIR, f"{key}.jsonl")
+
+
+# --- worker processes ----------------------------------------------------------------
+
+def _init_worker():
+    # files are already spread over processes; a per-PDF page pool would only oversubscribe
+    from app.services import pdf_parser
+    pdf_parser.PDF_WORKERS = 1
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(_HASH_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _parse(path: str, dedup_mode: str):
+    """(sha256, existing file id) for stored content, else (sha256, None, filetype, chunks, signatures)."""
+    sha256 = _sha256(path)
+    existing = stored_file_id(sha256)
+    if existing is not None:
+        return sha256, existing
+    return (sha256, None) + parse_file(path, dedup_mode)
+
+
+# --- journal and progress ----------------------------------------------------------
+
+class Journal:
+    """Append-only JSON lines: one record per finished file, one per index build."""
+
+    def __init__(self, path: str):
+        self.path = path
+        # relative path -> last record for it
+        self.files: Dict[str, dict] = {}
+        self.unindexed: Set[int] = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._apply(json.loads(line))
+                    except ValueError:
+                        logger.warning("Ignoring a torn line in %s", path)
+        self._out: TextIO = open(path, "a", encoding="utf-8")
+
+    def _apply(self, record: dict):
+        if "indexed" in record:
+            self.unindexed.difference_update(record["indexed"])
+            return
+        self.files[record["path"]] = record
+        if record["status"] == STORED:
+            self.unindexed.add(record["file_id"])
+
+    def done(self, rel: str, st: os.stat_result) -> bool:
+        """Stored or found duplicate by an earlier run, and unchanged since."""
+        record = self.files.get(rel)
+        return record is not None and record["status"] in (STORED, DUPLICATE) and \
+            (record["size"], record["mtime_ns"]) == (st.st_size, st.st_mtime_ns)
+
+    def record(self, record: dict):
+        self._apply(record)
+        self._out.write(json.dumps(record) + "\n")
+        self._out.flush()
+        # a storing record must be on disk before the commit it announces
+        if "indexed" in record or record.get("status") == STORING:
+            os.fsync(self._out.fileno())
+
+    def recover(self):
+        """Files interrupted while storing: recorded as stored if their commit went through."""
+        for record in list(self.files.values()):
+            if record["status"] == STORING:
+                file_id = stored_file_id(record["sha256"])
+                if file_id is not None:
+                    logger.info("Recovered %s, stored by an interrupted run", record["path"])
+                    self.record({**record, "status": STORED, "file_id": file_id})
+
+    def close(self):
+        self._out.close()
+
+
+class Progress:
+    """Counts finished files and reports them to a stream at most every interval seconds."""
+
+    def __init__(self, total: int, interval: float = 5.0, stream: TextIO = sys.stderr):
+        self.total = total
+        self.interval = interval
+        self.stream = stream
+        self.counts = {STORED: 0, DUPLICATE: 0, FAILED: 0}
+        self.chunks = 0
+        self._start = self._last = time.monotonic()
+
+    @property
+    def finished(self) -> int:
+        return sum(self.counts.values())
+
+    def update(self, status: str, chunks: int = 0):
+        self.counts[status] += 1
+        self.chunks += chunks
+        if time.monotonic() - self._last >= self.interval:
+            self.report()
+
+    def report(self):
+        self._last = time.monotonic()
+        elapsed = self._last - self._start
+        rate = self.finished / elapsed if elapsed > 0 else 0.0
+        eta = f", ETA {(self.total - self.finished) / rate:.0f}s" if rate and self.finished < self.total else ""
+        percent = 100.0 * self.finished / self.total if self.total else 100.0
+        self.stream.write(
+            f"{self.finished}/{self.total} files ({percent:.1f}%): {self.counts[STORED]} stored, "
+            f"{self.counts[DUPLICATE]} duplicate, {self.counts[FAILED]} failed, {self.chunks} chunks, "
+            f"{rate:.1f} files/s{eta}\n")
+        self.stream.flush()
+
+
+# --- coordinator -------------------------------------------------------------------
+
+def _chunks_of_files(file_ids: Sequence[int]) -> Tuple[List[str], List[int]]:
+    texts, ids = [], []
+    conn = get_connection()
+    for start in range(0, len(file_ids), _LOOKUP_BATCH):
+        batch = list(file_ids[start:start + _LOOKUP_BATCH])
+        rows = conn.execute(f"SELECT id, content FROM chunks WHERE file_id IN ({','.join('?' * len(batch))}) "
+                            "ORDER BY id", batch).fetchall()
+        ids.extend(row[0] for row in rows)
+        texts.extend(row[1] for row in rows)
+    return texts, ids
+
+
+def _store(directory: str, rel: str, st: os.stat_result, result, dedup_mode: str, journal: Journal) -> dict:
+    sha256, existing = result[0], result[1]
+    record = {"path": rel, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": sha256}
+    # looked up again: an earlier file of this run may have had the same content
+    existing = existing if existing is not None else stored_file_id(sha256)
+    if existing is not None:
+        return {**record, "status": DUPLICATE, "file_id": existing}
+    _, _, filetype, chunks, signatures = result
+    path = os.path.abspath(os.path.join(directory, rel))
+    journal.record({**record, "status": STORING})
+    file_id, kept, _ = store_parsed(os.path.basename(rel), path, filetype, chunks, signatures,
+                                    sha256=sha256, dedup_mode=dedup_mode)
+    return {**record, "status": STORED, "file_id": file_id, "chunks": len(kept)}
+
+
+def bulk_ingest(directory: str, workers: Optional[int] = None, journal_path: Optional[str] = None,
+                method: str = INDEX_METHOD, dedup_mode: str = dedup.DEDUP_MODE,
+                extensions: Sequence[str] = BULK_INGEST_EXTENSIONS, progress_interval: float = 5.0,
+                progress_stream: TextIO = sys.stderr) -> dict:
+    """
+    Ingest every matching file under directory that the journal does not
+    list as done, then index all stored, not yet indexed files at once.
+    Returns counts per status, the chunks stored and the index generation.
+    """
+    init_db()
+    workers = workers or os.cpu_count() or 1
+    journal_path = journal_path or default_journal_path(directory)
+    os.makedirs(os.path.dirname(journal_path) or ".", exist_ok=True)
+    journal = Journal(journal_path)
+    try:
+        journal.recover()
+        todo, skipped = [], 0
+        for rel in iter_files(directory, extensions):
+            st = os.stat(os.path.join(directory, rel))
+            if journal.done(rel, st):
+                skipped += 1
+            else:
+                todo.append((rel, st))
+        logger.info("Bulk ingest of %s: %d files to do, %d already done", directory, len(todo), skipped)
+
+        progress = Progress(len(todo), progress_interval, progress_stream)
+        if todo:
+            _run_pool(directory, todo, workers, dedup_mode, journal, progress)
+        progress.report()
+
+        generation = None
+        if journal.unindexed:
+            file_ids = sorted(journal.unindexed)
+            texts, ids = _chunks_of_files(file_ids)
+            logger.info("Indexing %d chunks of %d files", len(ids), len(file_ids))
+            if ids:
+                generation = index_chunks(texts, ids, method=method, background_merge=False)
+            journal.record({"indexed": file_ids, "generation": generation})
+            if ids:
+                Indexer(method=method).merge()
+                generation = read_index_generation()
+        return {**progress.counts, "skipped": skipped, "chunks": progress.chunks, "generation": generation}
+    finally:
+        journal.close()
+
+
+def _run_pool(directory: str, todo: List[Tuple[str, os.stat_result]], workers: int, dedup_mode: str,
+              journal: Journal, progress: Progress):
+    # spawn, not fork, like the PDF page pool; at most 2 files per worker in flight keeps memory bounded
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_worker)
+    pending: Dict[Future, Tuple[str, os.stat_result]] = {}
+    queue = iter(todo)
+    try:
+        while True:
+            while len(pending) < 2 * workers:
+                item = next(queue, None)
+                if item is None:
+                    break
+                pending[pool.submit(_parse, os.path.join(directory, item[0]), dedup_mode)] = item
+            if not pending:
+                return
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                rel, st = pending.pop(future)
+                try:
+                    record = _store(directory, rel, st, future.result(), dedup_mode, journal)
+                except Exception as e:
+                    logger.warning("Failed to ingest %s: %s", rel, e)
+                    record = {"path": rel, "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                              "status": FAILED, "error": f"{type(e).__name__}: {e}"}
+                journal.record(record)
+                progress.update(record["status"], record.get("chunks", 0))
+    finally:
+        # on an interrupt, drop queued files; the journal already has every finished one
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest a directory of PDF and text files, indexing once at the end.")
+    parser.add_argument("directory")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="parsing processes")
+    parser.add_argument("--journal", help=f"resume journal (default: {JOURNAL_DIR}/<directory hash>.jsonl)")
+    parser.add_argument("--method", default=INDEX_METHOD, help="index method (bm25, tfidf, hybrid, fts5)")
+    parser.add_argument("--dedup", default=dedup.DEDUP_MODE, choices=("drop", "downweight", "off"),
+                        help="near-duplicate chunk handling")
+    parser.add_argument("--extensions", default=",".join(BULK_INGEST_EXTENSIONS),
+                        help="comma-separated file suffixes to ingest")
+    parser.add_argument("--progress-interval", type=float, default=5.0, help="seconds between progress lines")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    extensions = tuple(e if e.startswith(".") else "." + e for e in args.extensions.lower().split(",") if e)
+    try:
+        summary = bulk_ingest(args.directory, workers=args.workers, journal_path=args.journal,
+                              method=args.method, dedup_mode=args.dedup, extensions=extensions,
+                              progress_interval=args.progress_interval)
+    except KeyboardInterrupt:
+        sys.stderr.write("Interrupted; run the same command again to resume.\n")
+        sys.exit(130)
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+In-process query and answer caches.
+
+Two levels, each an LRU bounded by entry count and approximate bytes, with a
+TTL:
+
+  QUERY_CACHE   retrieval results, keyed by the query normalized as the
+                retrieval method would, top_k and the index generation
+                they were computed on
+  ANSWER_CACHE  transformer summaries, keyed by a hash of the combined snippet
+                text and the summarizer parameters
+
+Both are tagged with the index generation they hold entries for and are
+emptied as soon as they are asked about another one, so a rebuild, append,
+delete or merge invalidates them without any coordination with the Indexer.
+Hits and misses are counted per cache in /metrics
+(mka_cache_requests_total{cache, result}, mka_<cache>_cache_hit_ratio) and
+in stats().
+
+Caches are per process; with several uvicorn workers each warms its own.
+"""
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+from app.tracing import Counter, Gauge
+
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups by cache and result (hit/miss).", ("cache", "result"))
+CACHE_EVICTIONS = Counter("cache_evictions_total", "Cache entries evicted by cache and reason.", ("cache", "reason"))
+
+_MISSING = object()
+
+
+def approximate_size(value: Any) -> int:
+    """Rough bytes held by a value made of strings, numbers, lists, tuples and dicts."""
+    if isinstance(value, str):
+        return 49 + len(value.encode("utf-8", "surrogatepass"))
+    if isinstance(value, (list, tuple)):
+        return 56 + 8 * len(value) + sum(approximate_size(v) for v in value)
+    if isinstance(value, dict):
+        return 64 + sum(approximate_size(k) + approximate_size(v) + 16 for k, v in value.items())
+    return 32
+
+
+class LRUCache:
+    """Thread-safe LRU with entry, byte and TTL bounds that is cleared when the index generation moves on."""
+
+    def __init__(self, name: str, max_entries: int, max_bytes: int, ttl_s: float,
+                 size_of: Callable[[Any], int] = approximate_size):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self._size_of = size_of
+        self._lock = threading.Lock()
+        # key -> (value, bytes, expires at)
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int, float]]" = OrderedDict()
+        self._bytes = 0
+        self._generation: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        Gauge(f"{name}_cache_entries", f"Entries in the {name} cache.", lambda: len(self._entries))
+        Gauge(f"{name}_cache_bytes", f"Approximate bytes held by the {name} cache.", lambda: self._bytes)
+        Gauge(f"{name}_cache_hit_ratio", f"Hits per lookup of the {name} cache since start.",
+              lambda: self.stats()["hit_rate"])
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def _sync(self, generation: Optional[int]):
+        # caller holds the lock
+        # any change, not only an increase: a deleted and rebuilt index starts counting again
+        if generation is None or generation == self._generation:
+            return
+        if self._entries:
+            CACHE_EVICTIONS.inc(len(self._entries), cache=self.name, reason="generation")
+        self._entries.clear()
+        self._bytes = 0
+        self._generation = generation
+
+    def _drop(self, key: Hashable, reason: str):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+        CACHE_EVICTIONS.inc(cache=self.name, reason=reason)
+
+    def get(self, key: Hashable, generation: Optional[int] = None, default: Any = None) -> Any:
+        with self._lock:
+            self._sync(generation)
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING and entry[2] < time.monotonic():
+                self._drop(key, "ttl")
+                entry = _MISSING
+            if entry is _MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+        CACHE_REQUESTS.inc(cache=self.name, result="miss" if entry is _MISSING else "hit")
+        return default if entry is _MISSING else entry[0]
+
+    def put(self, key: Hashable, value: Any, generation: Optional[int] = None):
+        if not self.enabled:
+            return
+        size = self._size_of(key) + self._size_of(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if self._generation is None:
+                self._sync(generation)
+            elif generation is not None and generation != self._generation:
+                return  # computed on a snapshot that lookups have already moved past
+            if key in self._entries:
+                _, old, _ = self._entries.pop(key)
+                self._bytes -= old
+            self._entries[key] = (value, size, time.monotonic() + self.ttl_s)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)), "size")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._generation = None
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "generation": self._generation,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+            }
+
+
+# retrieval methods whose analyzer lowercases the query (sklearn's default analyzer)
+LOWERCASING_METHODS = frozenset({"tfidf"})
+
+
+def normalize_query(q: str, method: Optional[str] = None) -> str:
+    """
+    Form of a query used in cache keys: whitespace runs collapsed, and
+    lowercased only if the retrieval method lowercases too. Queries with
+    the same key must retrieve the same results; bm25 and hybrid tokens are
+    case-sensitive.
+    """
+    q = " ".join(q.split())
+    return q.lower() if method in LOWERCASING_METHODS else q
+
+
+def text_key(text: str, **params) -> str:
+    """sha256 of a text together with the parameters that shape its summary."""
+    spec = ",".join(f"{k}={params[k]}" for k in sorted(params))
+    return hashlib.sha256(f"{spec}\0{text}".encode("utf-8")).hexdigest()
+
+
+QUERY_CACHE = LRUCache(
+    "query",
+    max_entries=int(os.environ.get("QUERY_CACHE_ENTRIES", "10000")),
+    max_bytes=int(os.environ.get("QUERY_CACHE_BYTES", str(64 << 20))),
+    ttl_s=float(os.environ.get("QUERY_CACHE_TTL_S", "600")),
+)
+ANSWER_CACHE = LRUCache(
+    "answer",
+    max_entries=int(os.environ.get("ANSWER_CACHE_ENTRIES", "1024")),
+    max_bytes=int(os.environ.get("ANSWER_CACHE_BYTES", str(16 << 20))),
+    ttl_s=float(os.environ.get("ANSWER_CACHE_TTL_S", "3600")),
+)
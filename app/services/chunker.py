@@ -1,7 +1,182 @@
-def chunk_text(text: str, chunk_size: int = 500) -> list[str]:
-    words = text.split()
-    chunks = []
+"""
+Text chunking.
+
+chunk_text / iter_word_chunks split text into fixed-size word chunks.
+iter_chunks is the streaming, provenance-aware chunker used by ingestion:
+it consumes (page, text) pieces and yields Chunk records with token counts,
+character offsets into the source and the page range each chunk spans.
+"""
+import re
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+
+def iter_word_chunks(texts: Iterable[str], chunk_size: int = 500) -> Iterator[str]:
+    """
+    Streaming chunk_text: yields the same chunks as chunk_text("".join(texts))
+    while holding at most one chunk of words (plus one input piece) in memory.
+    A word split across two pieces is joined back together.
+    """
+    words = []
+    partial = ""
+    for text in texts:
+        if not text:
+            continue
+        pieces = text.split()
+        if partial:
+            if text[0].isspace():
+                words.append(partial)
+            elif pieces:
+                pieces[0] = partial + pieces[0]
+            else:
+                pieces = [partial]
+            partial = ""
+        # the last word may continue in the next piece
+        if pieces and not text[-1].isspace():
+            partial = pieces.pop()
+        words.extend(pieces)
+        while len(words) >= chunk_size:
+            yield " ".join(words[:chunk_size])
+            del words[:chunk_size]
+    if partial:
+        words.append(partial)
     for i in range(0, len(words), chunk_size):
-        chunk = " ".join(words[i:i + chunk_size])
-        chunks.append(chunk)
-    return chunks
\ No newline at end of file
+        yield " ".join(words[i:i + chunk_size])
+
+
+def chunk_text(text: str, chunk_size: int = 500) -> list[str]:
+    return list(iter_word_chunks([text], chunk_size))
+
+
+class Chunk(NamedTuple):
+    index: int
+    text: str
+    start_char: int  # offsets into the concatenated source text ("".join of all pieces)
+    end_char: int
+    page_start: Optional[int]
+    page_end: Optional[int]
+    num_tokens: int
+
+
+_WORD = re.compile(r"\S+")
+# a word that ends a sentence: terminal punctuation, optionally followed by closing quotes/brackets
+_SENTENCE_END = re.compile(r"[.!?][\"'”’)\]]*$")
+
+
+def _count_one(word: str) -> int:
+    return 1
+
+
+def iter_chunks(pages: Iterable[Tuple[Optional[int], str]], max_tokens: int = 500, overlap: int = 0,
+                align_sentences: bool = False,
+                count_tokens: Optional[Callable[[str], int]] = None) -> Iterator[Chunk]:
+    """
+    Chunk a stream of (page number, text) pieces into chunks of at most
+    max_tokens tokens (whitespace words by default; pass count_tokens to budget
+    by e.g. model word pieces). Consecutive chunks share about `overlap` tokens.
+
+    With align_sentences, a chunk ends after the last complete sentence that
+    fits in the budget, as long as that keeps it at least half full; overlaps
+    then start at a sentence boundary where possible.
+
+    Only about one chunk of words is buffered, so memory does not grow with
+    the document. Chunk texts are the words joined by single spaces.
+    """
+    if max_tokens <= 0:
+        raise ValueError("max_tokens must be positive")
+    if not 0 <= overlap < max_tokens:
+        raise ValueError("overlap must be in [0, max_tokens)")
+    count_tokens = count_tokens or _count_one
+
+    # buffered words: (word, start_char, end_char, page, tokens)
+    buf: List[Tuple[str, int, int, Optional[int], int]] = []
+    buf_tokens = 0
+    fresh = 0  # buf[fresh:] has not been emitted yet
+    index = 0
+    pos = 0  # offset of the current piece in the concatenated text
+    partial = None  # word cut off at the end of the previous piece
+
+    def is_end(i: int) -> bool:
+        return bool(_SENTENCE_END.search(buf[i][0]))
+
+    def emit(cut: int) -> Chunk:
+        words = buf[:cut]
+        pages_seen = [w[3] for w in words if w[3] is not None]
+        return Chunk(index, " ".join(w[0] for w in words), words[0][1], words[-1][2],
+                     min(pages_seen) if pages_seen else None, max(pages_seen) if pages_seen else None,
+                     sum(w[4] for w in words))
+
+    def next_cut() -> Tuple[int, int]:
+        """(words in the next chunk, index the following chunk starts at)."""
+        cut, total = 0, 0
+        while cut < len(buf) and total + buf[cut][4] <= max_tokens:
+            total += buf[cut][4]
+            cut += 1
+        cut = max(cut, 1)  # a single word over budget still becomes a chunk
+        if align_sentences:
+            half, acc = max_tokens / 2, total
+            # never cut back into the overlap: each chunk must add a new word
+            for c in range(cut, fresh, -1):
+                if acc < half:
+                    break
+                if is_end(c - 1):
+                    cut = c
+                    break
+                acc -= buf[c - 1][4]
+        # step back from the cut to cover `overlap` tokens, always moving forward
+        start, acc = cut, 0
+        while start > 1 and acc + buf[start - 1][4] <= overlap:
+            acc += buf[start - 1][4]
+            start -= 1
+        if align_sentences and start < cut:
+            for s in range(start, cut):
+                if is_end(s - 1):
+                    start = s
+                    break
+        return cut, start
+
+    def add(word: str, start: int, end: int, page: Optional[int]):
+        nonlocal buf_tokens
+        tokens = count_tokens(word)
+        buf.append((word, start, end, page, tokens))
+        buf_tokens += tokens
+
+    for page, text in pages:
+        if not text:
+            continue
+        matches = list(_WORD.finditer(text))
+        if partial is not None:
+            if matches and matches[0].start() == 0:
+                # the previous piece's last word continues here
+                first = matches.pop(0)
+                partial = (partial[0] + first.group(), partial[1], partial[2])
+                if first.end() < len(text):
+                    add(partial[0], partial[1], pos + first.end(), partial[2])
+                    partial = None
+            else:
+                add(partial[0], partial[1], partial[1] + len(partial[0]), partial[2])
+                partial = None
+        if matches and matches[-1].end() == len(text):
+            last = matches.pop()
+            partial = (last.group(), pos + last.start(), page)
+        for m in matches:
+            add(m.group(), pos + m.start(), pos + m.end(), page)
+        pos += len(text)
+
+        while buf_tokens > max_tokens:
+            cut, start = next_cut()
+            yield emit(cut)
+            index += 1
+            buf_tokens -= sum(w[4] for w in buf[:start])
+            del buf[:start]
+            fresh = cut - start
+
+    if partial is not None:
+        word, start, page0 = partial
+        add(word, start, start + len(word), page0)
+    while len(buf) > fresh:
+        cut, start = next_cut() if buf_tokens > max_tokens else (len(buf), len(buf))
+        yield emit(cut)
+        index += 1
+        buf_tokens -= sum(w[4] for w in buf[:start])
+        del buf[:start]
+        fresh = cut - start
@@ -0,0 +1,176 @@
+"""
+Near-duplicate chunk detection with MinHash and LSH.
+
+Each chunk is reduced to the set of its word shingles (SHINGLE_SIZE
+consecutive lowercased words) and summarized by a MinHash signature of
+NUM_PERM values: the fraction of positions at which two signatures agree
+estimates the Jaccard similarity of the shingle sets. Signatures are cut into
+LSH_BANDS bands and each band is hashed to a bucket; chunks sharing a bucket
+are candidates, and a candidate whose estimated similarity reaches
+DEDUP_THRESHOLD is a near-duplicate. With 16 bands of 8 rows, pairs at 0.9
+similarity become candidates with probability ~0.9999 and pairs at 0.5 with
+~0.06, so only a handful of signatures are compared per chunk.
+
+Signatures and buckets of stored chunks live in SQLite (chunk_minhash,
+chunk_lsh), so every upload is checked against everything ingested before it.
+Only original chunks are registered; a near-duplicate points at its original
+through chunks.duplicate_of.
+
+DEDUP_MODE decides what happens to near-duplicates at ingest:
+  - "drop"       : not stored or indexed at all
+  - "downweight" : stored and indexed, with ranking scores scaled by DEDUP_WEIGHT
+  - "off"        : no detection
+"""
+import os
+import zlib
+import hashlib
+import sqlite3
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Set
+
+import numpy as np
+
+from app.db import bulk_insert
+
+DEDUP_MODE = os.environ.get("DEDUP_MODE", "drop")
+DEDUP_MODES = ("drop", "downweight", "off")
+DEDUP_THRESHOLD = float(os.environ.get("DEDUP_THRESHOLD", "0.9"))
+DEDUP_WEIGHT = float(os.environ.get("DEDUP_WEIGHT", "0.5"))
+
+SHINGLE_SIZE = 5
+NUM_PERM = 128
+LSH_BANDS = 16
+_ROWS = NUM_PERM // LSH_BANDS
+
+# SQLite's default limit on bound parameters is 999 in older builds
+_MAX_PARAMS = 900
+
+# universal hashing h(x) = (a*x + b) mod p over 32-bit shingle hashes; with
+# a, b < 2^32 the products stay below 2^64 and fit uint64 arithmetic
+_PRIME = np.uint64((1 << 61) - 1)
+_rng = np.random.RandomState(1)
+_A = _rng.randint(1, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+_B = _rng.randint(0, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+
+
+class Duplicate(NamedTuple):
+    chunk_id: Optional[int]  # stored chunk this one duplicates, or
+    position: Optional[int]  # an earlier chunk of the same batch
+    similarity: float
+
+
+def minhash(text: str) -> Optional[np.ndarray]:
+    """uint32[NUM_PERM] signature of text, or None if it has fewer than SHINGLE_SIZE words."""
+    words = text.lower().split()
+    if len(words) < SHINGLE_SIZE:
+        return None
+    shingles = {zlib.crc32(" ".join(words[i:i + SHINGLE_SIZE]).encode("utf-8"))
+                for i in range(len(words) - SHINGLE_SIZE + 1)}
+    h = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+    return ((_A[:, None] * h[None, :] + _B[:, None]) % _PRIME).min(axis=1).astype(np.uint32)
+
+
+def band_buckets(signature: np.ndarray) -> List[int]:
+    """One signed 64-bit bucket key per band; the band number is part of the key."""
+    buckets = []
+    for band in range(LSH_BANDS):
+        rows = signature[band * _ROWS:(band + 1) * _ROWS].tobytes()
+        digest = hashlib.blake2b(bytes([band]) + rows, digest_size=8).digest()
+        buckets.append(int.from_bytes(digest, "little", signed=True))
+    return buckets
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return float(np.mean(a == b))
+
+
+def _chunked(values: Sequence, size: int = _MAX_PARAMS) -> Iterable[Sequence]:
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _stored_candidates(conn: sqlite3.Connection, buckets: Set[int]) -> Dict[int, List[int]]:
+    found: Dict[int, List[int]] = {}
+    for part in _chunked(sorted(buckets)):
+        rows = conn.execute(
+            f"SELECT bucket, chunk_id FROM chunk_lsh WHERE bucket IN ({','.join('?' * len(part))})", part
+        )
+        for bucket, chunk_id in rows:
+            found.setdefault(bucket, []).append(chunk_id)
+    return found
+
+
+def _stored_signatures(conn: sqlite3.Connection, chunk_ids: Set[int]) -> Dict[int, np.ndarray]:
+    found: Dict[int, np.ndarray] = {}
+    for part in _chunked(sorted(chunk_ids)):
+        rows = conn.execute(
+            f"SELECT chunk_id, signature FROM chunk_minhash WHERE chunk_id IN ({','.join('?' * len(part))})", part
+        )
+        for chunk_id, blob in rows:
+            found[chunk_id] = np.frombuffer(blob, dtype=np.uint32)
+    return found
+
+
+def find_duplicates(conn: sqlite3.Connection, signatures: Sequence[Optional[np.ndarray]],
+                    threshold: float = DEDUP_THRESHOLD) -> List[Optional[Duplicate]]:
+    """
+    For each signature (None = too short to compare), the most similar stored
+    chunk or earlier original in the batch at or above threshold, else None.
+    Run inside the transaction that stores the batch so concurrent uploads
+    cannot both register the same content as original.
+    """
+    buckets = [band_buckets(s) if s is not None else [] for s in signatures]
+    stored = _stored_candidates(conn, {b for keys in buckets for b in keys})
+    stored_sigs = _stored_signatures(conn, {i for ids in stored.values() for i in ids})
+
+    batch: Dict[int, List[int]] = {}  # bucket -> positions of originals in this batch
+    results: List[Optional[Duplicate]] = []
+    for pos, (signature, keys) in enumerate(zip(signatures, buckets)):
+        best: Optional[Duplicate] = None
+        if signature is not None:
+            seen_stored, seen_batch = set(), set()
+            for key in keys:
+                for chunk_id in stored.get(key, ()):
+                    if chunk_id not in seen_stored and chunk_id in stored_sigs:
+                        seen_stored.add(chunk_id)
+                        sim = similarity(signature, stored_sigs[chunk_id])
+                        if sim >= threshold and (best is None or sim > best.similarity):
+                            best = Duplicate(chunk_id, None, sim)
+                for other in batch.get(key, ()):
+                    if other not in seen_batch:
+                        seen_batch.add(other)
+                        sim = similarity(signature, signatures[other])
+                        if sim >= threshold and (best is None or sim > best.similarity):
+                            best = Duplicate(None, other, sim)
+            if best is None:
+                for key in keys:
+                    batch.setdefault(key, []).append(pos)
+        results.append(best)
+    return results
+
+
+def register(conn: sqlite3.Connection, chunk_ids: Sequence[int], signatures: Sequence[Optional[np.ndarray]]):
+    """Store signatures and LSH buckets of original chunks (None signatures are skipped)."""
+    pairs = [(i, s) for i, s in zip(chunk_ids, signatures) if s is not None]
+    bulk_insert(conn, "INSERT OR REPLACE INTO chunk_minhash (chunk_id, signature) VALUES (?, ?)",
+                ((i, s.tobytes()) for i, s in pairs))
+    bulk_insert(conn, "INSERT INTO chunk_lsh (bucket, chunk_id) VALUES (?, ?)",
+                ((bucket, i) for i, s in pairs for bucket in band_buckets(s)))
+
+
+def duplicate_ids(conn: sqlite3.Connection, chunk_ids: Sequence[int]) -> Set[int]:
+    """Those chunk_ids stored as near-duplicates (downweight mode)."""
+    found: Set[int] = set()
+    for part in _chunked(list(chunk_ids)):
+        rows = conn.execute(
+            f"SELECT id FROM chunks WHERE duplicate_of IS NOT NULL AND id IN ({','.join('?' * len(part))})", part
+        )
+        found.update(row[0] for row in rows)
+    return found
+
+
+def weights(chunk_ids: Sequence[int], duplicates: Set[int], weight: float = DEDUP_WEIGHT) -> Optional[List[float]]:
+    """Per-chunk ranking weights for the index, or None when nothing is down-weighted."""
+    if not duplicates:
+        return None
+    return [weight if i in duplicates else 1.0 for i in chunk_ids]
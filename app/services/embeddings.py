@@ -0,0 +1,142 @@
+"""
+Content-addressed embedding cache for hybrid indexing.
+
+Vectors are stored in SQLite keyed by (sha256 of the chunk text, model name),
+so a rebuild only encodes chunks it has never seen, and identical chunks across
+files are encoded once. Hit/miss counters are kept per process so the cache can
+be sized from real traffic.
+"""
+import os
+import hashlib
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.db import DB_NAME, bulk_insert, get_connection, transaction
+from app.services.model_registry import MODELS
+
+logger = logging.getLogger(__name__)
+
+SBERT_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_CACHE_DB = os.environ.get("EMBEDDING_CACHE_DB", DB_NAME)
+
+# stay below SQLite's default host-parameter limit in IN (...) lookups
+_LOOKUP_BATCH = 500
+
+_STATS_LOCK = threading.Lock()
+_STATS = {"hits": 0, "misses": 0}
+
+
+def _load_encoder():
+    # Import heavy libs here to avoid import-time errors for non-hybrid use
+    try:
+        from sentence_transformers import SentenceTransformer
+    except Exception as e:
+        raise RuntimeError("sentence-transformers is required for hybrid mode.") from e
+    return SentenceTransformer(SBERT_MODEL)
+
+
+MODELS.register("embedder", _load_encoder)
+
+
+def get_encoder():
+    """The process's shared SBERT encoder (documents and queries), loaded on first use."""
+    return MODELS.get("embedder")
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """SQLite-backed store of float32 vectors keyed by text hash and model name."""
+
+    def __init__(self, db_path: Optional[str] = None, model_name: str = SBERT_MODEL):
+        self.db_path = db_path or EMBEDDING_CACHE_DB
+        self.model_name = model_name
+        with transaction(self.db_path) as conn:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                text_hash TEXT,
+                model TEXT,
+                dim INTEGER,
+                vector BLOB,
+                PRIMARY KEY (text_hash, model)
+            )
+            """)
+
+    def get_many(self, hashes: Sequence[str]) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        cursor = get_connection(self.db_path).cursor()
+        for start in range(0, len(hashes), _LOOKUP_BATCH):
+            batch = list(hashes[start:start + _LOOKUP_BATCH])
+            placeholders = ",".join("?" * len(batch))
+            cursor.execute(
+                f"SELECT text_hash, dim, vector FROM embeddings WHERE model=? AND text_hash IN ({placeholders})",
+                [self.model_name] + batch,
+            )
+            for h, dim, blob in cursor.fetchall():
+                found[h] = np.frombuffer(blob, dtype="<f4", count=dim)
+        return found
+
+    def put_many(self, items: Dict[str, np.ndarray]):
+        with transaction(self.db_path) as conn:
+            bulk_insert(
+                conn,
+                "INSERT OR REPLACE INTO embeddings (text_hash, model, dim, vector) VALUES (?, ?, ?, ?)",
+                ((h, self.model_name, int(v.shape[0]), np.asarray(v, dtype="<f4").tobytes()) for h, v in items.items()),
+            )
+
+    def stats(self) -> dict:
+        """Process-wide hit/miss counters plus the size of this model's entries."""
+        entries, size = get_connection(self.db_path).execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings WHERE model=?",
+            (self.model_name,),
+        ).fetchone()
+        with _STATS_LOCK:
+            hits, misses = _STATS["hits"], _STATS["misses"]
+        lookups = hits + misses
+        return {
+            "model": self.model_name,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+
+def embed_texts(texts: Sequence[str], load_model: Callable[[], object],
+                cache: Optional[EmbeddingCache] = None) -> np.ndarray:
+    """
+    Encode texts, reusing cached vectors. load_model is only called if at
+    least one distinct text is missing from the cache.
+    """
+    cache = cache or EmbeddingCache()
+    hashes = [text_hash(t) for t in texts]
+    unique: Dict[str, str] = dict(zip(hashes, texts))
+    cached = cache.get_many(list(unique))
+    missing = [h for h in unique if h not in cached]
+
+    if missing:
+        model = load_model()
+        # encode texts in batches (SentenceTransformer handles batching)
+        encoded = model.encode([unique[h] for h in missing], show_progress_bar=False,
+                               convert_to_numpy=True, dtype="float32")
+        fresh = dict(zip(missing, np.asarray(encoded, dtype="float32")))
+        cache.put_many(fresh)
+        cached.update(fresh)
+
+    # hits/misses count chunks: duplicates of a freshly encoded text are hits
+    misses = len(missing)
+    hits = len(texts) - misses
+    with _STATS_LOCK:
+        _STATS["hits"] += hits
+        _STATS["misses"] += misses
+    logger.info("Embedding cache: %d hits, %d misses (%d distinct texts)", hits, misses, len(unique))
+
+    if not texts:
+        return np.zeros((0, 0), dtype="float32")
+    return np.vstack([cached[h] for h in hashes]).astype("float32")
@@ -0,0 +1,114 @@
+"""
+SQLite FTS5 lexical backend.
+
+chunks_fts is an external-content FTS5 table over chunks(content): it stores
+only the inverted index, not a second copy of the text, and triggers keep it
+in sync, so every chunk inserted by ingestion is searchable as soon as its
+transaction commits. The index lives in the database file and is shared by
+all worker processes through the OS page cache instead of being rebuilt in
+each worker's memory.
+
+Ranking uses FTS5's built-in bm25() (k1=1.2, b=0.75), which sorts best
+matches first with negative values; scores are negated so higher is better.
+Near-duplicate chunks (chunks.duplicate_of set) can be down-weighted at query
+time by passing duplicate_weight to search().
+"""
+import re
+from typing import List, Optional, Tuple
+
+from app.db import get_connection, transaction
+
+FTS_TABLE = "chunks_fts"
+
+_SCHEMA = (
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE}
+    USING fts5(content, content='chunks', content_rowid='id')
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON chunks BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON chunks BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF content ON chunks BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+)
+
+# FTS5 query syntax is not exposed to users: queries are reduced to bare terms
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+
+def fts_available(db_path: Optional[str] = None) -> bool:
+    row = get_connection(db_path).execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (FTS_TABLE,)
+    ).fetchone()
+    return row is not None
+
+
+def rebuild(db_path: Optional[str] = None) -> int:
+    """Create the FTS table and triggers if needed and reindex every chunk. Returns the chunk count."""
+    with transaction(db_path) as conn:
+        for statement in _SCHEMA:
+            conn.execute(statement)
+        conn.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        return conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+
+def drop(db_path: Optional[str] = None):
+    """Remove the FTS table and its triggers (ingestion stops paying for it)."""
+    with transaction(db_path) as conn:
+        for suffix in ("ai", "ad", "au"):
+            conn.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+        conn.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+def match_expression(q: str) -> str:
+    """OR of the query's terms, each quoted so FTS5 operators in user input are inert."""
+    terms = dict.fromkeys(t.lower() for t in _TERM.findall(q))
+    return " OR ".join(f'"{t}"' for t in terms)
+
+
+def search(q: str, top_k: int, db_path: Optional[str] = None,
+           duplicate_weight: Optional[float] = None) -> List[Tuple[int, str, float]]:
+    """
+    (chunk id, text, score) of the top_k chunks by FTS5 bm25, best first.
+    With duplicate_weight, scores of near-duplicate chunks are multiplied by it.
+    """
+    expression = match_expression(q)
+    if not expression or top_k <= 0:
+        return []
+    if duplicate_weight is not None and duplicate_weight != 1:
+        # ordering by an expression scores every match before LIMIT instead of
+        # stopping early on FTS5's rank order, so only pay for it when asked
+        rows = get_connection(db_path).execute(
+            f"""
+            SELECT c.id, c.content,
+                   -{FTS_TABLE}.rank * (CASE WHEN c.duplicate_of IS NULL THEN 1.0 ELSE ? END) AS score
+            FROM {FTS_TABLE} JOIN chunks c ON c.id = {FTS_TABLE}.rowid
+            WHERE {FTS_TABLE} MATCH ?
+            ORDER BY score DESC
+            LIMIT ?
+            """,
+            (duplicate_weight, expression, top_k),
+        ).fetchall()
+        return [(int(i), text, float(score)) for i, text, score in rows]
+    rows = get_connection(db_path).execute(
+        f"""
+        SELECT c.id, c.content, -{FTS_TABLE}.rank
+        FROM {FTS_TABLE} JOIN chunks c ON c.id = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH ?
+        ORDER BY {FTS_TABLE}.rank
+        LIMIT ?
+        """,
+        (expression, top_k),
+    ).fetchall()
+    return [(int(i), text, float(score)) for i, text, score in rows]
@@ -1,131 +1,198 @@
 import os
-import pickle
-from typing import List, Tuple, Optional
-
-INDEX_FILE = "data/index.pkl"
-FAISS_INDEX_FILE = "data/faiss.index"
-
-# lightweight optional imports for hybrid mode
-try:
-    from rank_bm25 import BM25Okapi
-except Exception:
-    BM25Okapi = None
-
-try:
-    from sklearn.feature_extraction.text import TfidfVectorizer
-except Exception:
-    TfidfVectorizer = None
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from . import fts
+from app.tracing import span
+from .embeddings import embed_texts, get_encoder
+from .segments import (
+    INDEX_DIR,
+    MANIFEST_FILE,
+    METHODS,
+    Segment,
+    manifest_lock,
+    merge_once,
+    read_manifest,
+    remove_segments,
+    schedule_merge,
+    write_manifest,
+)
+
+# the manifest is the published index; it lists the segments readers should load
+INDEX_FILE = MANIFEST_FILE
+
+# lexical index kept inside SQLite (see fts.py) instead of in segments
+FTS_METHOD = "fts5"
+INDEX_METHODS = METHODS + (FTS_METHOD,)
 
 # optional heavy deps for hybrid (import inside functions to avoid import-time failures)
 # sentence-transformers and faiss are only required if you choose method="hybrid"
 
 
+def read_index_generation() -> int:
+    """
+    Return the generation number of the current on-disk index.
+    Raises FileNotFoundError if no index has been built yet.
+    """
+    return int(read_manifest()["generation"])
+
+
 class Indexer:
     """
-    Backwards-compatible Indexer.
+    Segmented Indexer.
 
     Supported methods:
-      - "bm25"   : uses rank_bm25 (documents = list[str])
-      - "tfidf"  : uses sklearn TfidfVectorizer (documents = list[str])
-      - "hybrid" : BM25 + SentenceTransformer embeddings + FAISS index (documents = list[str])
-                   This will create a separate faiss index file (data/faiss.index)
+      - "bm25"   : Okapi BM25 (same scoring as rank_bm25.BM25Okapi)
+      - "tfidf"  : TF-IDF cosine (same scoring as sklearn TfidfVectorizer)
+      - "hybrid" : BM25 + SentenceTransformer embeddings in a per-segment FAISS index
+      - "fts5"   : SQLite FTS5 over the chunks table, ranked with its bm25()
+
+    build_index() replaces the whole index with a single segment.
+    add() appends a segment for the new chunks only; statistics such as IDF
+    and avgdl are computed across all segments at load time, and small
+    segments are merged in the background.
+
+    fts5 has no segments: its index is a table in the ingestion database that
+    triggers keep in sync with chunks, so the chunks passed to build_index()
+    and add() must already be rows of that table. The manifest still records
+    the method and a generation so readers pick up the switch and changes.
     """
 
     def __init__(self, method: str = "bm25"):
+        if method not in INDEX_METHODS:
+            raise ValueError("Unsupported method: choose 'bm25', 'tfidf', 'hybrid' or 'fts5'")
         self.method = method
-        self.index = None
         self.documents: List[str] = []
-        self.vectorizer = None
-        # for hybrid:
-        self.faiss_index_path = FAISS_INDEX_FILE
 
-    def build_index(self, chunks: List[str]):
+    def build_index(self, chunks: List[str], ids: Optional[Sequence[int]] = None,
+                    weights: Optional[Sequence[float]] = None):
         """
-        Build index from text chunks (list of strings).
-        This preserves your previous interface: pass a list[str] (chunks).
+        Build index from text chunks (list of strings), replacing any existing index.
+        ids are the global document ids (SQLite chunk ids); defaults to 0..n-1.
+        weights optionally scale each chunk's ranking scores (e.g. near-duplicates).
         """
         self.documents = chunks
-
-        os.makedirs("data", exist_ok=True)
-
-        if self.method == "bm25":
-            if BM25Okapi is None:
-                raise RuntimeError("rank_bm25 is not installed. Install it to use bm25.")
-            tokenized = [doc.split() for doc in chunks]
-            self.index = BM25Okapi(tokenized)
-
-        elif self.method == "tfidf":
-            if TfidfVectorizer is None:
-                raise RuntimeError("scikit-learn is not installed or TfidfVectorizer unavailable.")
-            self.vectorizer = TfidfVectorizer()
-            self.index = self.vectorizer.fit_transform(chunks)
-
-        elif self.method == "hybrid":
-            # Hybrid: BM25 + FAISS (sentence-transformers)
-            # Import heavy libs here to avoid import-time errors for non-hybrid use
-            try:
-                from rank_bm25 import BM25Okapi as _BM25
-            except Exception as e:
-                raise RuntimeError("rank_bm25 is required for hybrid mode.") from e
-
-            try:
-                from sentence_transformers import SentenceTransformer
-            except Exception as e:
-                raise RuntimeError("sentence-transformers is required for hybrid mode.") from e
-
-            try:
-                import faiss
-                import numpy as np
-            except Exception as e:
-                raise RuntimeError("faiss (faiss-cpu or faiss-gpu) is required for hybrid mode.") from e
-
-            # build BM25
-            tokenized = [doc.split() for doc in chunks]
-            self.index = _BM25(tokenized)  # reuse self.index to store bm25 object
-
-            # build sentence-transfomer embeddings -> FAISS index
-            model_name = "sentence-transformers/all-MiniLM-L6-v2"
-            model = SentenceTransformer(model_name)
-            # encode texts in batches (SentenceTransformer handles batching)
-            embeddings = model.encode(chunks, show_progress_bar=False, convert_to_numpy=True, dtype="float32")
-            # normalize for cosine with inner-product
-            faiss.normalize_L2(embeddings)
-            d = embeddings.shape[1]
-            faiss_index = faiss.IndexFlatIP(d)  # inner product on normalized vectors == cosine
-            faiss_index.add(embeddings)
-            # persist faiss index
-            faiss.write_index(faiss_index, self.faiss_index_path)
-
+        if ids is None:
+            ids = range(len(chunks))
+        if self.method == FTS_METHOD:
+            with span("index.fts_rebuild"):
+                fts.rebuild()
+            segments, next_id = [], int(max(ids, default=-1)) + 1
         else:
-            raise ValueError("Unsupported method: choose 'bm25', 'tfidf', or 'hybrid'")
+            segment = self._write_segment(chunks, ids, weights)
+            segments = [{"name": segment.name, "docs": len(segment)}]
+            next_id = int(segment.ids.max()) + 1 if len(segment) else 0
 
-        # save metadata and index (pickle). For hybrid, index holds BM25 instance; faiss saved separately.
-        with open(INDEX_FILE, "wb") as f:
-            pickle.dump({
-                "method": self.method,
-                "documents": self.documents,
-                # do not attempt to pickle faiss index here (we saved separately),
-                "index": self.index,
-                "vectorizer": getattr(self, "vectorizer", None),
-                "faiss_index_path": self.faiss_index_path if self.method == "hybrid" else None,
-            }, f)
-
-    def _save(self):
-        """Backward-compatible saver (kept for compatibility; build_index already saves)."""
-        with open(INDEX_FILE, "wb") as f:
-            pickle.dump({
+        with span("index.publish"), manifest_lock():
+            try:
+                previous = read_manifest()
+            except FileNotFoundError:
+                previous = {"generation": 0, "method": None, "segments": []}
+            write_manifest({
+                "generation": previous["generation"] + 1,
                 "method": self.method,
-                "documents": self.documents,
-                "index": self.index,
-                "vectorizer": getattr(self, "vectorizer", None),
-                "faiss_index_path": self.faiss_index_path if self.method == "hybrid" else None,
-            }, f)
-
-    def add(self, new_chunks: List[str]):
+                "next_id": next_id,
+                "segments": segments,
+            })
+        remove_segments([e["name"] for e in previous["segments"]])
+        if previous["method"] == FTS_METHOD and self.method != FTS_METHOD:
+            fts.drop()  # stop paying for trigger-maintained FTS on every insert
+
+    def can_append(self) -> bool:
+        """True if an index built with this method exists and add() can extend it."""
+        try:
+            return read_manifest()["method"] == self.method
+        except FileNotFoundError:
+            return False
+
+    def add(self, new_chunks: List[str], ids: Optional[Sequence[int]] = None, background_merge: bool = True,
+            weights: Optional[Sequence[float]] = None):
+        """
+        Append new_chunks as a new segment; existing segments are not touched.
+        ids default to consecutive ids after the highest id in the index.
+        """
+        if not new_chunks:
+            return
+        if not self.can_append():
+            raise ValueError(f"No '{self.method}' index to append to; call build_index first.")
+        if self.method == FTS_METHOD:
+            # the insert triggers already indexed these rows; just publish a new generation
+            with manifest_lock():
+                manifest = read_manifest()
+                if ids is None:
+                    ids = range(manifest["next_id"], manifest["next_id"] + len(new_chunks))
+                manifest["next_id"] = max(manifest["next_id"], int(max(ids)) + 1)
+                manifest["generation"] += 1
+                write_manifest(manifest)
+            self.documents = (self.documents or []) + list(new_chunks)
+            return
+        # explicit ids are written outside the lock; default ids are allocated under it,
+        # in the critical section that publishes them, so concurrent adds never share an id
+        segment = None if ids is None else self._write_segment(new_chunks, ids, weights)
+
+        with span("index.publish"), manifest_lock():
+            manifest = read_manifest()
+            if manifest["method"] != self.method:
+                if segment is not None:
+                    remove_segments([segment.name])
+                raise ValueError(f"Index was rebuilt with method '{manifest['method']}' during add.")
+            if segment is None:
+                start = manifest["next_id"]
+                segment = self._write_segment(new_chunks, range(start, start + len(new_chunks)), weights)
+            manifest["segments"].append({"name": segment.name, "docs": len(segment)})
+            manifest["next_id"] = max(manifest["next_id"], int(segment.ids.max()) + 1)
+            manifest["generation"] += 1
+            write_manifest(manifest)
+        self.documents = (self.documents or []) + list(new_chunks)
+
+        if background_merge:
+            schedule_merge()
+
+    def delete(self, ids: Sequence[int]) -> int:
         """
-        Simple append + rebuild strategy:
-        - Append new_chunks to self.documents and rebuild index from combined corpus.
-        This is safe and simple for v0.4. For large corpora, implement incremental addition.
+        Tombstone chunk ids. Readers stop returning them as soon as the new
+        generation is published; the next merge that covers their segment
+        drops them from postings, embeddings and the FAISS index.
+        Returns the number of ids newly deleted.
         """
-        combined = (self.documents or []) + new_chunks
-        self.build_index(combined)
\ No newline at end of file
+        if self.method == FTS_METHOD:
+            raise ValueError("fts5 follows the chunks table; delete the rows from chunks instead.")
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        if not ids.size:
+            return 0
+        deleted = 0
+        with manifest_lock():
+            manifest = read_manifest()
+            for entry in manifest["segments"]:
+                seg_ids = Segment.load(entry["name"]).ids
+                found = np.intersect1d(ids, seg_ids)
+                fresh = np.setdiff1d(found, np.asarray(entry.get("deleted", []), dtype=np.int64))
+                if fresh.size:
+                    entry["deleted"] = sorted(entry.get("deleted", []) + fresh.tolist())
+                    deleted += int(fresh.size)
+            if deleted:
+                manifest["generation"] += 1
+                write_manifest(manifest)
+        return deleted
+
+    def merge(self, max_segments: Optional[int] = None):
+        """Merge segments synchronously until at most max_segments remain."""
+        while merge_once(max_segments=max_segments):
+            pass
+
+    def _write_segment(self, chunks: Sequence[str], ids: Sequence[int],
+                       weights: Optional[Sequence[float]] = None) -> Segment:
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        with span("index.embed"):
+            embeddings = self._embed(chunks) if self.method == "hybrid" else None
+        with span("index.segment_build"):
+            segment = Segment.build(self.method, chunks, ids, embeddings=embeddings, weights=weights)
+        with span("index.segment_save"):
+            segment.save()
+        return segment
+
+    def _embed(self, chunks: Sequence[str]) -> np.ndarray:
+        # only chunks missing from the embedding cache are encoded; the model
+        # itself is not even loaded when every chunk is a cache hit
+        return embed_texts(chunks, load_model=get_encoder)
@@ -0,0 +1,219 @@
+"""
+Ingestion pipeline steps shared by the upload API and background jobs:
+parse a saved file, chunk it, store file + chunks in SQLite, and append the
+chunks to the search index.
+
+A file whose sha256 is already stored is not ingested again, and chunks that
+are near-duplicates of stored ones are dropped or down-weighted according to
+dedup.DEDUP_MODE. Stored files whose chunks failed to reach the index are
+kept in the unindexed_files table until an index pass picks them up again.
+"""
+import os
+import logging
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from app.db import bulk_insert, get_connection, transaction
+from app.services import dedup
+from app.services.pdf_parser import iter_pdf_pages
+from app.services.chunker import Chunk, iter_chunks
+from app.tracing import Counter, span
+
+logger = logging.getLogger(__name__)
+
+INGESTED_CHUNKS = Counter("ingested_chunks_total", "Chunks stored by ingestion.")
+DUPLICATE_CHUNKS = Counter("duplicate_chunks_total", "Near-duplicate chunks found at ingest, by dedup mode.",
+                           ("mode",))
+
+# index method used for uploaded files ("fts5" keeps the lexical index in SQLite)
+INDEX_METHOD = os.environ.get("INGEST_INDEX_METHOD", "bm25")
+
+# chunking: token budget per chunk, tokens shared by consecutive chunks, and
+# whether chunks end on sentence boundaries
+CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", "500"))
+CHUNK_OVERLAP = int(os.environ.get("CHUNK_OVERLAP", "50"))
+CHUNK_ALIGN_SENTENCES = os.environ.get("CHUNK_ALIGN_SENTENCES", "1") == "1"
+
+# text files are read in blocks of this many characters
+TEXT_BLOCK_SIZE = 1 << 20
+
+
+# leading bytes examined to tell PDFs from text
+SNIFF_BYTES = 8192
+
+
+def sniff_filetype(head: bytes, complete: bool = False) -> Optional[str]:
+    """
+    "pdf" or "txt" from a file's first bytes (complete: head is the whole
+    file), None if it is neither. PDF readers accept the %PDF- header
+    anywhere in the first KiB; text must be NUL-free UTF-8.
+    """
+    if b"%PDF-" in head[:1024]:
+        return "pdf"
+    if b"\x00" in head:
+        return None
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # a multi-byte character cut off by the end of the sample is fine
+        if complete or e.reason != "unexpected end of data":
+            return None
+    return "txt"
+
+
+def filetype_of(filepath: str) -> str:
+    """Type of a saved file from its content ("txt" unless it is a PDF), not its name."""
+    with open(filepath, "rb") as f:
+        return sniff_filetype(f.read(SNIFF_BYTES)) or "txt"
+
+
+def iter_file_text(filepath: str, filetype: str) -> Iterator[Tuple[Optional[int], str]]:
+    """
+    Stream a file's text as (page number, text) pieces: one per page for
+    PDFs, fixed blocks without a page number for text files.
+    """
+    if filetype == "pdf":
+        yield from iter_pdf_pages(filepath)
+        return
+    with open(filepath, "r", encoding="utf-8") as f:
+        while True:
+            block = f.read(TEXT_BLOCK_SIZE)
+            if not block:
+                return
+            yield None, block
+
+
+def stored_file_id(sha256: str) -> Optional[int]:
+    """Id of the stored file with this content hash, if any."""
+    row = get_connection().execute("SELECT id FROM files WHERE sha256=? LIMIT 1", (sha256,)).fetchone()
+    return row[0] if row else None
+
+
+def mark_unindexed(file_ids: Iterable[int]):
+    """Record stored files whose chunks did not make it into the index."""
+    with transaction() as conn:
+        conn.executemany("INSERT OR IGNORE INTO unindexed_files (file_id) VALUES (?)", [(i,) for i in file_ids])
+
+
+def is_unindexed(file_id: int) -> bool:
+    return get_connection().execute("SELECT 1 FROM unindexed_files WHERE file_id=?", (file_id,)).fetchone() is not None
+
+
+def claim_unindexed() -> Tuple[List[int], List[str], List[int]]:
+    """
+    Take the recorded unindexed files off the table, returning (file ids,
+    chunk texts, chunk ids) to index; mark_unindexed() them again if that
+    fails. Claiming in one transaction keeps two processes from indexing
+    the same chunks.
+    """
+    with transaction() as conn:
+        file_ids = [row[0] for row in conn.execute("SELECT file_id FROM unindexed_files ORDER BY file_id")]
+        if not file_ids:
+            return [], [], []
+        rows = conn.execute("SELECT id, content FROM chunks WHERE file_id IN (SELECT file_id FROM unindexed_files) "
+                            "ORDER BY id").fetchall()
+        conn.execute("DELETE FROM unindexed_files")
+    return file_ids, [row[1] for row in rows], [row[0] for row in rows]
+
+
+def parse_file(filepath: str, dedup_mode: str = dedup.DEDUP_MODE) -> Tuple[str, List[Chunk], list]:
+    """
+    Extract and chunk a saved file, with the MinHash signature of every
+    chunk (None when dedup is off). Returns (filetype, chunks, signatures).
+    Touches no database, so it can run in a worker process.
+    """
+    filetype = filetype_of(filepath)
+
+    # pages are extracted and chunked as a stream, so the full document text
+    # is never held in memory; only the chunk records are
+    with span("ingest.parse_chunk"):
+        chunks = list(iter_chunks(iter_file_text(filepath, filetype), max_tokens=CHUNK_MAX_TOKENS,
+                                  overlap=CHUNK_OVERLAP, align_sentences=CHUNK_ALIGN_SENTENCES))
+
+    with span("ingest.minhash"):
+        signatures = [dedup.minhash(c.text) for c in chunks] if dedup_mode != "off" else [None] * len(chunks)
+    return filetype, chunks, signatures
+
+
+def parse_and_store(filename: str, filepath: str, sha256: Optional[str] = None,
+                    dedup_mode: str = dedup.DEDUP_MODE) -> Tuple[int, List[str], List[int]]:
+    """
+    Extract and chunk a saved upload, then insert the file row and its
+    chunks. Returns (file_id, chunks, chunk_ids); the chunks are empty if a
+    file with the same sha256 is already stored (file_id is that file's).
+    """
+    if sha256 is not None and (existing := stored_file_id(sha256)) is not None:
+        return existing, [], []
+    filetype, chunks, signatures = parse_file(filepath, dedup_mode)
+    return store_parsed(filename, filepath, filetype, chunks, signatures, sha256, dedup_mode)
+
+
+def store_parsed(filename: str, filepath: str, filetype: str, chunks: Sequence[Chunk], signatures: Sequence,
+                 sha256: Optional[str] = None,
+                 dedup_mode: str = dedup.DEDUP_MODE) -> Tuple[int, List[str], List[int]]:
+    """Insert the file row and the chunks parse_file() returned for it; same result as parse_and_store."""
+    detect = dedup_mode != "off"
+    # Store metadata + chunks (with offsets and page ranges) in one short write
+    # transaction; parsing happens before it so workers do not serialize on the lock
+    chunk_ids: List[int] = []
+    with span("ingest.db_write"), transaction() as conn:
+        # checked again under the write lock: an identical upload may have
+        # been stored since the API looked
+        if sha256 is not None and (existing := stored_file_id(sha256)) is not None:
+            return existing, [], []
+        duplicates = dedup.find_duplicates(conn, signatures) if detect else [None] * len(chunks)
+        keep = [i for i, d in enumerate(duplicates) if d is None or dedup_mode == "downweight"]
+
+        cursor = conn.execute("INSERT INTO files (filename, filetype, filepath, sha256) VALUES (?, ?, ?, ?)",
+                              (filename, filetype, filepath, sha256))
+        file_id = cursor.lastrowid
+        bulk_insert(
+            conn,
+            "INSERT INTO chunks (file_id, chunk_index, content, start_char, end_char, page_start, page_end) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ((file_id, c.index, c.text, c.start_char, c.end_char, c.page_start, c.page_end)
+             for c in (chunks[i] for i in keep)),
+            on_batch=lambda first, count: chunk_ids.extend(range(first, first + count)),
+        )
+        if detect:
+            id_at = dict(zip(keep, chunk_ids))
+            conn.executemany("UPDATE chunks SET duplicate_of=? WHERE id=?", [
+                (d.chunk_id if d.chunk_id is not None else id_at[d.position], id_at[i])
+                for i, d in enumerate(duplicates) if d is not None and i in id_at
+            ])
+            originals = [i for i in keep if duplicates[i] is None]
+            dedup.register(conn, [id_at[i] for i in originals], [signatures[i] for i in originals])
+
+    INGESTED_CHUNKS.inc(len(chunk_ids))
+    skipped = sum(d is not None for d in duplicates) if detect else 0
+    if skipped:
+        DUPLICATE_CHUNKS.inc(skipped, mode=dedup_mode)
+        logger.info("%s: %d of %d chunks are near-duplicates (%s)", filename, skipped, len(chunks), dedup_mode)
+    return file_id, [chunks[i].text for i in keep], chunk_ids
+
+
+def index_chunks(chunks: Sequence[str], chunk_ids: Sequence[int], method: str = INDEX_METHOD,
+                 background_merge: bool = True) -> int:
+    """
+    Append chunks to the index as a new segment, or build the index from
+    every chunk in the DB if there is none for this method yet.
+    Returns the published index generation.
+    """
+    from app.services.indexer import Indexer, read_index_generation
+    indexer = Indexer(method=method)
+
+    with span("ingest.index"):
+        if indexer.can_append():
+            duplicates = dedup.duplicate_ids(get_connection(), chunk_ids)
+            indexer.add(list(chunks), ids=list(chunk_ids), weights=dedup.weights(chunk_ids, duplicates),
+                        background_merge=background_merge)
+        else:
+            # first upload (or index missing / built with another method):
+            # index all chunks in DB so multiple docs are indexed
+            rows = get_connection().execute("SELECT id, content, duplicate_of FROM chunks ORDER BY id").fetchall()
+            ids = [row[0] for row in rows]
+            duplicates = {row[0] for row in rows if row[2] is not None}
+            indexer.build_index([row[1] for row in rows], ids=ids, weights=dedup.weights(ids, duplicates))
+            # every stored chunk is in this build
+            with transaction() as conn:
+                conn.execute("DELETE FROM unindexed_files")
+    return read_index_generation()
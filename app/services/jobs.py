@@ -0,0 +1,254 @@
+"""
+Background ingestion jobs.
+
+Uploads are saved by the API and handed to a bounded JobQueue. A pool of
+worker threads parses, chunks and stores each file; a single index thread
+collects stored chunks and appends them to the index, coalescing every job
+that finished storing within INGEST_COALESCE_MS into one segment (and one
+index generation) instead of one segment per upload.
+
+Chunks are committed before they are indexed, so when indexing fails the
+batch's files are recorded as unindexed (ingest.mark_unindexed) and their
+jobs fail. Every index pass first claims the recorded files and indexes
+them along with its own batch; after a failure a pass also runs on its own
+every INGEST_RETRY_S seconds, and uploading the same content again queues
+one instead of answering "duplicate".
+
+When the queue already holds INGEST_QUEUE_SIZE pending jobs, submit() raises
+QueueFullError so the API can push back (HTTP 429) instead of buffering
+unbounded work. Submitting content (by sha256) that an unfinished job is
+already ingesting returns that job instead of queueing it twice.
+"""
+import os
+import time
+import uuid
+import queue
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+from app.services.ingest import INDEX_METHOD, claim_unindexed, index_chunks, mark_unindexed, parse_and_store
+from app.tracing import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "2"))
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", "64"))
+INGEST_COALESCE_MS = int(os.environ.get("INGEST_COALESCE_MS", "200"))
+# seconds before files left unindexed by a failed pass are retried without a new upload
+INGEST_RETRY_S = float(os.environ.get("INGEST_RETRY_S", "30"))
+
+# finished jobs kept for status lookups before the oldest are forgotten
+MAX_FINISHED_JOBS = 1000
+
+QUEUED, PROCESSING, INDEXING, DONE, FAILED = "queued", "processing", "indexing", "done", "failed"
+
+INGEST_JOBS = Counter("ingest_jobs_total", "Finished ingestion jobs by status.", ("status",))
+
+
+class QueueFullError(Exception):
+    """Raised by JobQueue.submit when the pending queue is at capacity."""
+
+
+class Job:
+    def __init__(self, filename: str, filepath: str, sha256: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.filepath = filepath
+        self.sha256 = sha256
+        self.status = QUEUED
+        self.file_id: Optional[int] = None
+        self.chunks: Optional[int] = None
+        self.index_generation: Optional[int] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "filename": self.filename,
+            "sha256": self.sha256,
+            "file_id": self.file_id,
+            "chunks": self.chunks,
+            "index_generation": self.index_generation,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    """
+    Bounded ingestion queue with worker threads and a coalescing index thread.
+
+    process(filename, filepath, sha256) -> (file_id, chunks, chunk_ids) and
+    index(chunks, chunk_ids) -> generation are injectable for tests; the
+    unindexed files are only tracked with the default index.
+    """
+
+    def __init__(self, workers: int = INGEST_WORKERS, maxsize: int = INGEST_QUEUE_SIZE,
+                 coalesce_ms: int = INGEST_COALESCE_MS,
+                 process: Callable[[str, str, Optional[str]], Tuple[int, List[str], List[int]]] = parse_and_store,
+                 index: Optional[Callable[[List[str], List[int]], int]] = None,
+                 retry_s: float = INGEST_RETRY_S):
+        self.coalesce_s = coalesce_ms / 1000.0
+        self.retry_s = retry_s
+        self._process = process
+        self._track_unindexed = index is None
+        self._index = index or (lambda chunks, ids: index_chunks(chunks, ids, method=INDEX_METHOD))
+        # when a pass should run without new jobs, to retry unindexed files
+        self._retry_at: Optional[float] = None
+        self._queue: "queue.Queue[Job]" = queue.Queue(maxsize=maxsize)
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._cond = threading.Condition()
+        self._to_index: List[Tuple[Job, List[str], List[int]]] = []
+        self._threads = [
+            threading.Thread(target=self._work, name=f"ingest-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        self._threads.append(threading.Thread(target=self._index_loop, name="ingest-indexer", daemon=True))
+        for t in self._threads:
+            t.start()
+
+    def submit(self, filename: str, filepath: str, sha256: Optional[str] = None) -> Job:
+        with self._cond:
+            if sha256 is not None:
+                for pending in self._jobs.values():
+                    if pending.sha256 == sha256 and not pending.finished:
+                        return pending
+            job = Job(filename, filepath, sha256)
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise QueueFullError(f"{self._queue.maxsize} ingestion jobs already pending")
+            self._jobs[job.id] = job
+        return job
+
+    def full(self) -> bool:
+        return self._queue.full()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Job]:
+        """Block until the job is done or failed (or timeout); returns the job."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            job = self._jobs.get(job_id)
+            while job is not None and not job.finished:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return job
+
+    def stats(self) -> dict:
+        with self._cond:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return {"pending": self._queue.qsize(), "capacity": self._queue.maxsize, "jobs": counts}
+
+    def _set(self, job: Job, status: str, error: Optional[str] = None):
+        with self._cond:
+            job.status = status
+            job.error = error
+            if job.finished:
+                job.finished_at = time.time()
+                INGEST_JOBS.inc(status=status)
+                self._forget_old()
+            self._cond.notify_all()
+
+    def _forget_old(self):
+        finished = [j.id for j in self._jobs.values() if j.finished]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            self._set(job, PROCESSING)
+            try:
+                job.file_id, chunks, chunk_ids = self._process(job.filename, job.filepath, job.sha256)
+                job.chunks = len(chunks)
+            except Exception as e:
+                logger.exception("Ingestion job %s (%s) failed", job.id, job.filename)
+                self._set(job, FAILED, error=str(e))
+                continue
+            finally:
+                self._queue.task_done()
+            with self._cond:
+                job.status = INDEXING
+                self._to_index.append((job, chunks, chunk_ids))
+                self._cond.notify_all()
+
+    def _index_loop(self):
+        while True:
+            with self._cond:
+                while not self._to_index and (self._retry_at is None or time.monotonic() < self._retry_at):
+                    self._cond.wait(None if self._retry_at is None else self._retry_at - time.monotonic())
+                if self._to_index:
+                    # give uploads that are still being parsed a moment to join this batch
+                    deadline = time.monotonic() + self.coalesce_s
+                    while (remaining := deadline - time.monotonic()) > 0:
+                        self._cond.wait(remaining)
+                batch, self._to_index = self._to_index, []
+                self._retry_at = None
+            self._index_batch(batch)
+
+    def _index_batch(self, batch: List[Tuple[Job, List[str], List[int]]]):
+        chunks = [c for _, job_chunks, _ in batch for c in job_chunks]
+        chunk_ids = [i for _, _, job_ids in batch for i in job_ids]
+        retried: List[int] = []
+        try:
+            if self._track_unindexed:
+                retried, retry_chunks, retry_ids = claim_unindexed()
+                chunks, chunk_ids = chunks + retry_chunks, chunk_ids + retry_ids
+            generation = self._index(chunks, chunk_ids) if chunk_ids or batch else None
+        except Exception as e:
+            logger.exception("Indexing %d coalesced ingestion jobs failed", len(batch))
+            if self._track_unindexed:
+                self._keep_unindexed(retried + [job.file_id for job, _, ids in batch if ids])
+            for job, _, _ in batch:
+                self._set(job, FAILED, error=f"indexing failed: {e}")
+            return
+        if retried:
+            logger.info("Indexed %d files left unindexed by an earlier failure", len(retried))
+        logger.info("Indexed %d chunks from %d uploads as generation %s", len(chunks), len(batch), generation)
+        for job, _, _ in batch:
+            job.index_generation = generation
+            self._set(job, DONE)
+
+    def _keep_unindexed(self, file_ids: List[int]):
+        try:
+            mark_unindexed(file_ids)
+        except Exception:
+            logger.exception("Could not record unindexed files %s", file_ids)
+        with self._cond:
+            self._retry_at = time.monotonic() + self.retry_s
+
+
+_QUEUE: Optional[JobQueue] = None
+_QUEUE_LOCK = threading.Lock()
+
+
+Gauge("ingest_queue_pending", "Ingestion jobs waiting for a worker.",
+      lambda: _QUEUE.stats()["pending"] if _QUEUE is not None else None)
+
+
+def get_job_queue() -> JobQueue:
+    """Process-wide ingestion queue, started on first use."""
+    global _QUEUE
+    if _QUEUE is None:
+        with _QUEUE_LOCK:
+            if _QUEUE is None:
+                _QUEUE = JobQueue()
+    return _QUEUE
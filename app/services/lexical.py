@@ -0,0 +1,245 @@
+"""
+Vectorized lexical scoring over a precomputed sparse term-document matrix.
+
+For a loaded index snapshot we build one CSR matrix W (terms x docs) whose
+entries are the final per-posting weights:
+
+  bm25  : idf(t) * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl))
+  tfidf : tf * idf(t) / ||doc||   (so a dot product with the normalized query is the cosine)
+
+Scoring a query is then one sparse mat-vec over the query's rows of W, and a
+batch of queries is one sparse mat-mat product. Weights are derived from
+corpus-wide statistics, so they are rebuilt whenever a new generation is
+loaded (a vectorized O(nnz) pass, no Python loop over postings).
+
+Rows of W double as an inverted index (doc-sorted posting lists with final
+weights), which top_k_maxscore uses for exact top-k with dynamic pruning.
+
+Documents with a segment doc_weight (down-weighted near-duplicates) have their
+column of W scaled by it (towards lower scores), so every scoring path ranks
+them lower alike.
+
+Tombstoned (deleted) documents have no postings in W and are never returned;
+they still count towards the corpus statistics until a merge drops them.
+"""
+from collections import Counter
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+from .segments import BM25_B, BM25_K1, CorpusStats, Segment, get_analyzer, term_hash
+
+# queries per sparse mat-mat product in score_batch; bounds the dense B x N block
+BATCH_BLOCK_SIZE = 256
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, without a full sort."""
+    n = scores.shape[0]
+    k = min(k, n)
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(n)
+    # stable sort on the small candidate set: ties keep ascending doc order
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class SparseScorer:
+    """
+    BM25 or TF-IDF scorer backed by a (terms x docs) CSR weight matrix.
+    Term ids are positions in CorpusStats.term_hash; doc ids are positions in
+    the segment-concatenated document order.
+    """
+
+    def __init__(self, method: str, segments: Sequence[Segment], stats: CorpusStats,
+                 deleted: Optional[np.ndarray] = None):
+        if method not in ("bm25", "tfidf", "hybrid"):
+            raise ValueError(f"Unsupported method: {method}")
+        self.method = "tfidf" if method == "tfidf" else "bm25"
+        self.stats = stats
+        self._analyzer = get_analyzer(method)
+        self.idf = stats.bm25_idf() if self.method == "bm25" else stats.tfidf_idf()
+        self.num_docs = stats.num_docs
+        # boolean mask over doc ids of tombstoned documents
+        self.deleted = np.zeros(self.num_docs, dtype=bool) if deleted is None else np.asarray(deleted, dtype=bool)
+        self.num_live = self.num_docs - int(self.deleted.sum())
+        self.weights = self._build(segments)
+        self.weights.sort_indices()  # posting lists must be doc-sorted for MaxScore lookups
+        # per-term upper bound (max weight in the posting list) for dynamic pruning
+        self.upper_bounds = np.zeros(self.weights.shape[0], dtype=np.float64)
+        nonempty = np.diff(self.weights.indptr) > 0
+        if self.weights.nnz:
+            self.upper_bounds[nonempty] = np.maximum.reduceat(self.weights.data, self.weights.indptr[:-1][nonempty])
+        # pruning assumes non-negative contributions; rank_bm25's epsilon floor can
+        # go negative on tiny corpora, in which case we always score exhaustively
+        self._prunable = not self.weights.nnz or float(self.weights.data.min()) >= 0
+
+    def _build(self, segments: Sequence[Segment]) -> sp.csr_matrix:
+        rows, cols, data = [], [], []
+        offset = 0
+        avgdl = self.stats.avgdl
+        for seg in segments:
+            term_ids = np.repeat(self.stats.lookup(seg.term_hash), seg.doc_freqs)
+            docs = np.asarray(seg.postings_docs, dtype=np.int64)
+            tfs = np.asarray(seg.postings_tfs, dtype=np.float64)
+            idf = self.idf[term_ids]
+            if self.method == "bm25":
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * seg.doc_len[docs] / avgdl)
+                weight = idf * (tfs * (BM25_K1 + 1) / (tfs + norm))
+            else:
+                weight = tfs * idf
+                doc_norms = np.sqrt(np.bincount(docs, weights=weight ** 2, minlength=len(seg)))
+                doc_norms[doc_norms == 0] = 1.0
+                weight = weight / doc_norms[docs]
+            if seg.doc_weight is not None:
+                # applied before the per-term upper bounds, so MaxScore stays exact;
+                # negative BM25 weights (terms in over half the docs) are divided
+                # instead, so a weight below 1 always lowers the score
+                doc_weight = np.asarray(seg.doc_weight, dtype=np.float64)[docs]
+                weight = np.where(weight > 0, weight * doc_weight, weight / doc_weight)
+            live = ~self.deleted[docs + offset]
+            rows.append(term_ids[live])
+            cols.append(docs[live] + offset)
+            data.append(weight[live])
+            offset += len(seg)
+        shape = (len(self.stats.term_hash), self.num_docs)
+        if not data:
+            return sp.csr_matrix(shape, dtype=np.float64)
+        return sp.csr_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))), shape=shape)
+
+    def query_vector(self, q: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(term ids, weights) of the query; out-of-vocabulary terms are dropped."""
+        term_ids, weights = [], []
+        for term, tf in Counter(self._analyzer(q)).items():
+            pos = self.stats.find(term_hash(term))
+            if pos < 0:
+                continue
+            term_ids.append(pos)
+            # bm25: each occurrence of a repeated query term adds its weight again, as in rank_bm25
+            weights.append(tf if self.method == "bm25" else tf * self.idf[pos])
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.float64)
+        if self.method == "tfidf" and weights.size:
+            weights /= np.sqrt((weights ** 2).sum())
+        return term_ids, weights
+
+    def score(self, q: str) -> np.ndarray:
+        """Dense scores for every document: a single sparse mat-vec on the query's rows."""
+        term_ids, weights = self.query_vector(q)
+        if term_ids.size == 0:
+            return np.zeros(self.num_docs, dtype=np.float64)
+        return np.asarray(self.weights[term_ids].T @ weights).ravel()
+
+    def score_batch(self, queries: Sequence[str], block_size: int = BATCH_BLOCK_SIZE) -> Iterator[np.ndarray]:
+        """
+        Yield dense (block, num_docs) score blocks for queries, in order.
+        Each block is one sparse (queries x terms) @ (terms x docs) product.
+        """
+        for start in range(0, len(queries), block_size):
+            block = queries[start:start + block_size]
+            rows, cols, data = [], [], []
+            for row, q in enumerate(block):
+                term_ids, weights = self.query_vector(q)
+                rows.append(np.full(term_ids.size, row, dtype=np.int64))
+                cols.append(term_ids)
+                data.append(weights)
+            q_matrix = sp.csr_matrix(
+                (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+                shape=(len(block), self.weights.shape[0]),
+            )
+            yield (q_matrix @ self.weights).toarray()
+
+    def ranked(self, scores: np.ndarray, k: int) -> np.ndarray:
+        """top_k_indices over dense scores, skipping deleted documents."""
+        if self.num_live < self.num_docs:
+            scores = np.where(self.deleted, -np.inf, scores)
+        return top_k_indices(scores, min(k, self.num_live))
+
+    def top_k(self, q: str, k: int) -> List[Tuple[int, float]]:
+        scores = self.score(q)
+        return [(int(i), float(scores[i])) for i in self.ranked(scores, k)]
+
+    def score_docs(self, q: str, docs: Sequence[int]) -> np.ndarray:
+        """Scores of just the given documents (e.g. semantic candidates in hybrid fusion)."""
+        term_ids, weights = self.query_vector(q)
+        docs = np.asarray(docs, dtype=np.int64)
+        if term_ids.size == 0 or docs.size == 0:
+            return np.zeros(docs.size, dtype=np.float64)
+        return np.asarray(self.weights[term_ids][:, docs].T @ weights).ravel()
+
+    def top_k_maxscore(self, q: str, k: int) -> List[Tuple[int, float]]:
+        """
+        Exact top_k via term-at-a-time MaxScore over the posting lists.
+
+        Terms are visited in decreasing order of their upper bound. While the
+        terms not yet visited could still lift an unseen document into the top
+        k (their summed upper bounds exceed the current k-th best partial score
+        theta), a term's whole posting list is merged into the candidate set.
+        After that, no new document can qualify: candidates that cannot reach
+        theta are dropped, and the remaining (long, low-idf) lists are only
+        probed by binary search for the surviving candidates, so most of their
+        postings are never read.
+
+        Returns the same documents and scores as top_k() up to the order of
+        exact ties at the cut-off.
+        """
+        docs, scores, _ = self._maxscore(q, k)
+        return list(zip(docs.tolist(), scores.tolist()))
+
+    def _maxscore(self, q: str, k: int) -> Tuple[np.ndarray, np.ndarray, int]:
+        """(doc ids, scores, postings read) for the top k, best first."""
+        term_ids, q_weights = self.query_vector(q)
+        k = min(k, self.num_live)
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64), 0
+        if not self._prunable:
+            scores = self.score(q)
+            ranked = self.ranked(scores, k)
+            return ranked, scores[ranked], int(np.diff(self.weights.indptr)[term_ids].sum())
+
+        indptr, indices, data = self.weights.indptr, self.weights.indices, self.weights.data
+        bounds = self.upper_bounds[term_ids] * q_weights
+        order = np.argsort(-bounds, kind="stable")
+        remaining = np.cumsum(bounds[order][::-1])[::-1]  # remaining[i] = sum of bounds[order[i:]]
+
+        cand_docs = np.zeros(0, dtype=np.int64)
+        cand_scores = np.zeros(0, dtype=np.float64)
+        theta = -np.inf
+        touched = 0
+        for i, t in enumerate(order):
+            start, end = indptr[term_ids[t]], indptr[term_ids[t] + 1]
+            docs = indices[start:end]
+            if len(cand_docs) < k or remaining[i] > theta:
+                # essential term: unseen docs may still make the top k, merge the whole list
+                all_docs = np.concatenate([cand_docs, docs])
+                all_scores = np.concatenate([cand_scores, data[start:end] * q_weights[t]])
+                cand_docs, inverse = np.unique(all_docs, return_inverse=True)
+                cand_scores = np.bincount(inverse, weights=all_scores)
+                touched += end - start
+            else:
+                # non-essential: only existing candidates that can still reach theta matter
+                keep = cand_scores + remaining[i] >= theta
+                cand_docs, cand_scores = cand_docs[keep], cand_scores[keep]
+                if end == start or not len(cand_docs):
+                    continue
+                pos = np.searchsorted(docs, cand_docs)
+                pos = np.minimum(pos, end - start - 1)
+                hit = docs[pos] == cand_docs
+                cand_scores[hit] += data[start + pos[hit]] * q_weights[t]
+                touched += int(hit.sum())
+            if len(cand_scores) >= k:
+                theta = float(np.partition(cand_scores, len(cand_scores) - k)[len(cand_scores) - k])
+
+        ranked = np.lexsort((cand_docs, -cand_scores))[:k]
+        docs, scores = cand_docs[ranked], cand_scores[ranked]
+        if len(docs) < k:
+            # fewer than k matches: pad with zero-score live docs, lowest ids first (as top_k does)
+            live = np.flatnonzero(~self.deleted[:k + len(cand_docs) + int(self.deleted.sum())])
+            filler = np.setdiff1d(live, cand_docs)[:k - len(docs)]
+            docs = np.concatenate([docs, filler])
+            scores = np.concatenate([scores, np.zeros(len(filler))])
+        return docs, scores, touched
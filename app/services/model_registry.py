@@ -0,0 +1,243 @@
+"""
+Process-wide registry of the models the app loads.
+
+Every model is registered by the module that owns it with a loader that
+imports its library on first use, so importing the app never pulls in
+torch, transformers or sentence-transformers:
+
+  embedder    sentence-transformers query/document encoder (embeddings.py),
+              shared by the Indexer and every Retriever snapshot
+  summarizer  transformers summarization pipeline (summarizer.py)
+  textrank    sumy/nltk sentence tokenizer for TextRank (summarizer.py)
+
+MODELS.get(name) loads a model once per process and returns the shared
+instance; callers fetch it per use instead of keeping a reference, so an
+unloaded model can actually be freed. With MODEL_MEMORY_BUDGET_MB set, the
+least recently used models are unloaded after a load pushes the total past
+the budget (the model just loaded is never the one dropped). A model's size
+is its parameter and buffer bytes when it is a torch model, else the growth
+of the process RSS while it loaded.
+
+Warm-up loads models before the first request needs them: MODEL_WARMUP
+(comma-separated names, or "all") at app startup, or POST
+/admin/models/warmup. A model can define its own warm-up, e.g. the
+summarizer warms the summary pool workers rather than the API process.
+"""
+import os
+import gc
+import sys
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from app.tracing import Counter, Gauge, span
+
+logger = logging.getLogger(__name__)
+
+# 0 = no budget: models stay loaded for the life of the process
+MODEL_MEMORY_BUDGET_MB = int(os.environ.get("MODEL_MEMORY_BUDGET_MB", "0"))
+# models to load at startup: comma-separated names, or "all"
+MODEL_WARMUP = [n.strip() for n in os.environ.get("MODEL_WARMUP", "").split(",") if n.strip()]
+
+MODEL_LOADS = Counter("model_loads_total", "Models loaded, by model and outcome.", ("model", "outcome"))
+MODEL_UNLOADS = Counter("model_unloads_total", "Models unloaded, by model and reason (budget/admin).",
+                        ("model", "reason"))
+
+
+class UnknownModelError(KeyError):
+    """No model is registered under the name."""
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _torch_bytes(model: Any) -> Optional[int]:
+    """Parameter and buffer bytes of a torch module, or of a pipeline's .model; None if neither."""
+    for candidate in (model, getattr(model, "model", None)):
+        if hasattr(candidate, "parameters") and hasattr(candidate, "buffers"):
+            try:
+                tensors = list(candidate.parameters()) + list(candidate.buffers())
+                return sum(t.numel() * t.element_size() for t in tensors)
+            except Exception:
+                return None
+    return None
+
+
+class _Entry:
+    __slots__ = ("model", "bytes", "loaded_at", "last_used", "pinned")
+
+    def __init__(self, model: Any, size: int, pinned: bool = False):
+        self.model = model
+        self.bytes = size
+        self.loaded_at = self.last_used = time.time()
+        self.pinned = pinned
+
+
+class ModelRegistry:
+    """Lazily loaded, shared model instances with LRU unloading under a memory budget."""
+
+    def __init__(self, budget_bytes: int = MODEL_MEMORY_BUDGET_MB << 20):
+        self.budget_bytes = budget_bytes
+        self._lock = threading.Lock()
+        self._loaders: Dict[str, Callable[[], Any]] = {}
+        self._warmers: Dict[str, Callable[[], None]] = {}
+        self._load_locks: Dict[str, threading.Lock] = {}
+        # least recently used first
+        self._loaded: "OrderedDict[str, _Entry]" = OrderedDict()
+
+    def register(self, name: str, loader: Callable[[], Any], warm: Optional[Callable[[], None]] = None):
+        """Declare a model; loader() imports its library and returns the instance. Nothing is loaded yet."""
+        with self._lock:
+            self._loaders[name] = loader
+            self._load_locks.setdefault(name, threading.Lock())
+            if warm is not None:
+                self._warmers[name] = warm
+
+    def names(self) -> List[str]:
+        with self._lock:
+            return list(self._loaders)
+
+    def _touch(self, name: str) -> Optional[Any]:
+        # caller holds the lock
+        entry = self._loaded.get(name)
+        if entry is None:
+            return None
+        entry.last_used = time.time()
+        self._loaded.move_to_end(name)
+        return entry.model
+
+    def get(self, name: str) -> Any:
+        """The shared instance, loaded on first use (concurrent callers wait for one load)."""
+        with self._lock:
+            if name not in self._loaders and name not in self._loaded:
+                raise UnknownModelError(name)
+            model = self._touch(name)
+            if model is not None:
+                return model
+            load_lock = self._load_locks[name]
+        with load_lock:
+            with self._lock:
+                model = self._touch(name)
+                if model is not None:
+                    return model
+                loader = self._loaders[name]
+            rss_before = _rss_bytes()
+            logger.info("Loading model %s", name)
+            try:
+                with span(f"model.load.{name}"):
+                    model = loader()
+            except Exception:
+                MODEL_LOADS.inc(model=name, outcome="error")
+                raise
+            size = _torch_bytes(model)
+            if size is None:
+                size = max(_rss_bytes() - rss_before, 0)
+            MODEL_LOADS.inc(model=name, outcome="ok")
+            with self._lock:
+                self._loaded[name] = _Entry(model, size)
+                evicted = self._over_budget(keep=name)
+        self._release(evicted, "budget")
+        return model
+
+    def put(self, name: str, model: Any):
+        """Install a ready instance (e.g. an offline stub); it is never unloaded to meet the budget."""
+        with self._lock:
+            self._load_locks.setdefault(name, threading.Lock())
+            self._loaded[name] = _Entry(model, _torch_bytes(model) or 0, pinned=True)
+            self._loaded.move_to_end(name)
+
+    def _over_budget(self, keep: str) -> List[str]:
+        # caller holds the lock; pops least recently used entries until the total fits
+        evicted = []
+        if self.budget_bytes <= 0:
+            return evicted
+        total = sum(e.bytes for e in self._loaded.values())
+        for name in list(self._loaded):
+            if total <= self.budget_bytes:
+                break
+            entry = self._loaded[name]
+            if name == keep or entry.pinned:
+                continue
+            del self._loaded[name]
+            total -= entry.bytes
+            evicted.append(name)
+        if total > self.budget_bytes:
+            logger.warning("Loaded models use %d MB, over MODEL_MEMORY_BUDGET_MB=%d",
+                           total >> 20, self.budget_bytes >> 20)
+        return evicted
+
+    def _release(self, names: Iterable[str], reason: str):
+        names = list(names)
+        for name in names:
+            logger.info("Unloaded model %s (%s)", name, reason)
+            MODEL_UNLOADS.inc(model=name, reason=reason)
+        if names:
+            # drop the reference cycles torch modules keep, then hand cached GPU memory back
+            gc.collect()
+            torch = sys.modules.get("torch")
+            if torch is not None and torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+    def unload(self, name: str, reason: str = "admin") -> bool:
+        """Drop the process's instance; the next get() loads it again. False if it was not loaded."""
+        with self._lock:
+            if name not in self._loaders and name not in self._loaded:
+                raise UnknownModelError(name)
+            entry = self._loaded.pop(name, None)
+        if entry is None:
+            return False
+        self._release([name], reason)
+        return True
+
+    def warm_up(self, names: Optional[Iterable[str]] = None) -> Dict[str, str]:
+        """Load the named models (default: all registered) now. Returns {name: "ok" or the error}."""
+        names = self.names() if names is None or "all" in names else list(names)
+        results = {}
+        for name in names:
+            with self._lock:
+                if name not in self._loaders and name not in self._loaded:
+                    raise UnknownModelError(name)
+                warm = self._warmers.get(name)
+            start = time.monotonic()
+            try:
+                warm() if warm is not None else self.get(name)
+            except Exception as e:
+                logger.warning("Warm-up of model %s failed: %s", name, e)
+                results[name] = f"{type(e).__name__}: {e}"
+                continue
+            logger.info("Warmed up model %s in %.1fs", name, time.monotonic() - start)
+            results[name] = "ok"
+        return results
+
+    def loaded_bytes(self) -> int:
+        with self._lock:
+            return sum(e.bytes for e in self._loaded.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            loaded = {name: {"bytes": e.bytes, "loaded_at": e.loaded_at, "last_used": e.last_used,
+                             "pinned": e.pinned} for name, e in self._loaded.items()}
+            registered = sorted(set(self._loaders) | set(self._loaded))
+        return {
+            "budget_bytes": self.budget_bytes or None,
+            "loaded_bytes": sum(e["bytes"] for e in loaded.values()),
+            "models": {name: {"loaded": name in loaded, **loaded.get(name, {})} for name in registered},
+        }
+
+    def clear(self):
+        """Forget every loaded instance, stubs included (tests)."""
+        with self._lock:
+            names, self._loaded = list(self._loaded), OrderedDict()
+        self._release(names, "admin")
+
+
+MODELS = ModelRegistry()
+
+Gauge("model_memory_bytes", "Approximate bytes held by the models loaded in this process.", MODELS.loaded_bytes)
@@ -1,8 +1,89 @@
+"""
+PDF text extraction.
+
+iter_pdf_pages() streams (page number, text) records so callers never hold
+the whole document as one string. Large PDFs are split into page ranges that
+are extracted in a process pool; results are still yielded in page order and
+only a bounded number of ranges is in flight at once.
+"""
+import os
+import threading
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Iterator, List, NamedTuple, Optional
+
 import fitz  # PyMuPDF
 
-def extract_text_from_pdf(filepath: str) -> str:
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", str(os.cpu_count() or 1)))
+# documents shorter than this are extracted in-process; pool start-up is not worth it
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", "64"))
+PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", "32"))
+
+
+class PageText(NamedTuple):
+    number: int  # 1-based page number
+    text: str
+
+
+def _extract_range(filepath: str, start: int, stop: int) -> List[str]:
     doc = fitz.open(filepath)
-    text = ""
-    for page in doc:
-        text += page.get_text("text")
-    return text
\ No newline at end of file
+    try:
+        return [doc[i].get_text("text") for i in range(start, stop)]
+    finally:
+        doc.close()
+
+
+_POOL: Optional[Executor] = None
+_POOL_LOCK = threading.Lock()
+
+
+def _get_pool() -> Executor:
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                # spawn, not fork: the API process runs ingestion threads and FAISS/BLAS pools
+                _POOL = ProcessPoolExecutor(max_workers=PDF_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+    return _POOL
+
+
+def iter_pdf_pages(filepath: str, workers: Optional[int] = None,
+                   pages_per_task: Optional[int] = None,
+                   parallel_min_pages: Optional[int] = None) -> Iterator[PageText]:
+    """
+    Yield the text of every page in order. PDFs with at least
+    parallel_min_pages pages are extracted in page ranges of pages_per_task
+    across a process pool when more than one worker is allowed.
+    """
+    workers = PDF_WORKERS if workers is None else workers
+    pages_per_task = pages_per_task or PDF_PAGES_PER_TASK
+    parallel_min_pages = PDF_PARALLEL_MIN_PAGES if parallel_min_pages is None else parallel_min_pages
+
+    doc = fitz.open(filepath)
+    page_count = doc.page_count
+    if workers <= 1 or page_count < max(parallel_min_pages, 2):
+        try:
+            for i, page in enumerate(doc):
+                yield PageText(i + 1, page.get_text("text"))
+        finally:
+            doc.close()
+        return
+    doc.close()
+
+    pool = _get_pool()
+    ranges = [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+    # keep at most 2 ranges per worker in flight so memory stays bounded
+    window = 2 * workers
+    futures = [pool.submit(_extract_range, filepath, start, stop) for start, stop in ranges[:window]]
+    for n, (start, _) in enumerate(ranges):
+        texts = futures[n].result()
+        futures[n] = None
+        if n + window < len(ranges):
+            futures.append(pool.submit(_extract_range, filepath, *ranges[n + window]))
+        for offset, text in enumerate(texts):
+            yield PageText(start + offset + 1, text)
+
+
+def extract_text_from_pdf(filepath: str) -> str:
+    return "".join(page.text for page in iter_pdf_pages(filepath))
@@ -1,134 +1,376 @@
 import os
-import pickle
+import logging
+import threading
 import numpy as np
-from typing import List, Tuple
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
 
-from .indexer import INDEX_FILE
+from .embeddings import get_encoder
+from . import dedup, fts
+from .indexer import FTS_METHOD, read_index_generation
+from .segments import (
+    CorpusStats,
+    Segment,
+    read_manifest,
+)
+from .lexical import SparseScorer
+from app.tracing import Counter, Gauge, span
 
-# optional heavy deps will be imported only when needed (hybrid mode)
-try:
-    from rank_bm25 import BM25Okapi  # for type checks only
-except Exception:
-    BM25Okapi = None
+logger = logging.getLogger(__name__)
 
-try:
-    from sklearn.feature_extraction.text import TfidfVectorizer  # type check only
-except Exception:
-    TfidfVectorizer = None
+INDEX_RELOADS = Counter("index_reloads_total", "Retriever snapshots loaded, by outcome.", ("outcome",))
+
+# top-k strategy for lexical queries: "maxscore" (exact, dynamic pruning over the
+# posting lists) or "exhaustive" (score every document, then argpartition)
+LEXICAL_TOP_K = os.environ.get("LEXICAL_TOP_K", "maxscore")
+
+# per-shard vector indexes of a shard worker, by (segment name, shard, shards);
+# segments are immutable, so one is built once per segment, not once per snapshot
+_SHARD_VECTOR_INDEXES: Dict[Tuple[str, int, int], Optional[tuple]] = {}
+
+def _load_segments(retries: int = 3) -> Tuple[dict, List[Segment]]:
+    """
+    Load every segment listed in the manifest. A merge or rebuild may delete
+    segments between reading the manifest and loading them; in that case the
+    manifest generation has moved on and we retry against the new one.
+    """
+    for attempt in range(retries):
+        manifest = read_manifest()
+        try:
+            return manifest, [Segment.load(e["name"]) for e in manifest["segments"]]
+        except FileNotFoundError:
+            if attempt == retries - 1 or read_manifest()["generation"] == manifest["generation"]:
+                raise
+    raise FileNotFoundError("Index changed during load")
+
+
+def _shard_vector_indexes(segments: List[Segment], shard: int, num_shards: int) -> List[Optional[tuple]]:
+    """Per-shard vector index of every segment, built on first use and cached while the segment is live."""
+    live = {(s.name, shard, num_shards) for s in segments}
+    for key in [key for key in _SHARD_VECTOR_INDEXES if key[1:] == (shard, num_shards) and key not in live]:
+        del _SHARD_VECTOR_INDEXES[key]
+    for seg in segments:
+        key = (seg.name, shard, num_shards)
+        if key not in _SHARD_VECTOR_INDEXES:
+            with span("index.shard_vectors"):
+                _SHARD_VECTOR_INDEXES[key] = seg.shard_vector_index(shard, num_shards)
+    return [_SHARD_VECTOR_INDEXES[(s.name, shard, num_shards)] for s in segments]
+
+
+class _Documents:
+    """Read-only view of chunk texts across segments; decodes lazily from the mmap."""
+
+    def __init__(self, segments: List[Segment], offsets: np.ndarray):
+        self._segments = segments
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return int(self._offsets[-1])
+
+    def __getitem__(self, i: int) -> str:
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        seg = int(np.searchsorted(self._offsets, i, side="right")) - 1
+        return self._segments[seg].document(i - int(self._offsets[seg]))
+
+    def __iter__(self):
+        for seg in self._segments:
+            for pos in range(len(seg)):
+                yield seg.document(pos)
+
+
+def embed_queries(encoder, queries: List[str]) -> np.ndarray:
+    """L2-normalized float32 query embeddings, as FAISS inner-product search expects."""
+    with span("query.embed"):
+        q_emb = encoder.encode(queries, convert_to_numpy=True, dtype="float32")
+    import faiss  # local import for faiss module (assigns 'faiss', not 'np')
+    faiss.normalize_L2(q_emb)
+    return q_emb
+
+
+def fuse(sem_idxs: List, sem_scores: List[float], lex_top: List[Tuple[object, float]],
+         lex_scores: Callable[[List], np.ndarray], top_k: int,
+         weight: Optional[Callable[[object], float]] = None) -> List[Tuple[object, float]]:
+    """
+    Hybrid fusion of semantic and BM25 candidates, keyed by doc position or
+    chunk id. lex_top is the BM25 top_k as (doc, score); lex_scores(docs)
+    returns BM25 scores for semantic candidates that are not in it; weight(doc)
+    scales fused scores (down-weighted near-duplicates). Returns (doc, fused score).
+    """
+    # Combine candidate set (union of top_k semantics + top_k BM25 highest)
+    top_bm25_idxs = [i for i, _ in lex_top]
+    candidate_idxs = list(dict.fromkeys(list(sem_idxs) + top_bm25_idxs))  # preserve order, unique
+
+    # build score arrays aligned with candidate_idxs
+    sem_map = {i: 0.0 for i in candidate_idxs}
+    for i, s in zip(sem_idxs, sem_scores):
+        sem_map[i] = float(s)
+
+    lex_map = dict(lex_top)
+    missing = [i for i in candidate_idxs if i not in lex_map]
+    lex_map.update(zip(missing, (float(x) for x in lex_scores(missing))))
+
+    # min-max normalize both lists
+    sem_arr = np.array([sem_map[i] for i in candidate_idxs], dtype="float32")
+    lex_arr = np.array([lex_map[i] for i in candidate_idxs], dtype="float32")
+
+    def min_max(x):
+        if x.size == 0:
+            return x
+        minv = float(x.min())
+        maxv = float(x.max())
+        if maxv - minv < 1e-9:
+            return np.ones_like(x)
+        return (x - minv) / (maxv - minv)
+
+    sem_norm = min_max(sem_arr)
+    lex_norm = min_max(lex_arr)
+
+    # fusion weight: default equal weight (0.5 each) — you can change easily later
+    alpha = 0.6
+    fused = []
+    for idx, s_sem, s_lex in zip(candidate_idxs, sem_norm, lex_norm):
+        fused_score = float(alpha * float(s_sem) + (1 - alpha) * float(s_lex))
+        if weight is not None:
+            fused_score *= weight(idx)
+        fused.append((idx, fused_score))
+
+    # sort by fused score
+    fused_sorted = sorted(fused, key=lambda x: x[1], reverse=True)[:top_k]
+    return fused_sorted
 
 
 class Retriever:
     """
-    Backwards-compatible Retriever.
+    Segmented Retriever.
+
+    Memory-maps every segment of the published index and scores them with
+    corpus-wide statistics, so results do not depend on how the index is
+    split into segments.
 
     Methods:
       - query(q: str, top_k: int) -> List[Tuple[str, float]]
+
+    With shard=(k, n) the snapshot serves one shard of a sharded index (see
+    shards.py): BM25/TF-IDF still use statistics over every segment, but only
+    chunks with id % n == k are scored, and searched by vector in per-shard
+    indexes over those chunks' embeddings. No query encoder is loaded;
+    embeddings come from the coordinator.
     """
 
-    def __init__(self):
-        if not os.path.exists(INDEX_FILE):
-            raise FileNotFoundError(f"Index file not found at {INDEX_FILE}")
-
-        with open(INDEX_FILE, "rb") as f:
-            data = pickle.load(f)
-
-        self.method = data["method"]
-        self.documents: List[str] = data["documents"]
-        self.index = data["index"]
-        self.vectorizer = data.get("vectorizer", None)
-        self.faiss_index_path = data.get("faiss_index_path", None)
-
-        # load faiss index only if hybrid mode
-        if self.method == "hybrid":
-            try:
-                import faiss
-            except Exception as e:
-                raise RuntimeError("faiss must be installed to use hybrid retrieval.") from e
-            if not self.faiss_index_path or not os.path.exists(self.faiss_index_path):
-                raise FileNotFoundError("FAISS index file not found for hybrid mode. Rebuild index first.")
-            self._faiss = faiss.read_index(self.faiss_index_path)
-            # we'll need a sentence-transformers model at query time
-            try:
-                from sentence_transformers import SentenceTransformer
-            except Exception as e:
-                raise RuntimeError("sentence-transformers required for hybrid retrieval (query time).") from e
-            self._sbert = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+    def __init__(self, shard: Optional[Tuple[int, int]] = None):
+        # the generation comes from the same manifest the segments were loaded
+        # from, so a snapshot is always tagged with exactly what it contains
+        manifest, self.segments = _load_segments()
+        self.generation = int(manifest["generation"])
+        self.method = manifest["method"]
+
+        self._offsets = np.cumsum([0] + [len(s) for s in self.segments])
+        self.documents = _Documents(self.segments, self._offsets)
+        self.ids = np.concatenate([s.ids for s in self.segments]) if self.segments else np.zeros(0, dtype=np.int64)
+        # tombstoned chunk ids per segment; hidden from results until a merge purges them
+        self._deleted = [np.asarray(e.get("deleted", []), dtype=np.int64) for e in manifest["segments"]]
+        deleted_mask = np.concatenate([np.isin(s.ids, d) for s, d in zip(self.segments, self._deleted)]) \
+            if self.segments else np.zeros(0, dtype=bool)
+        self.shard = shard
+        self._id_order: Optional[np.ndarray] = None
+        # (faiss index, quantization) per segment over this shard's chunks, None to search the segment's own
+        self._shard_indexes: Optional[List[Optional[tuple]]] = None
+        if shard is not None:
+            k, n = shard
+            # other shards' chunks are masked like tombstones: no postings, never ranked
+            deleted_mask = deleted_mask | (self.ids % n != k)
+            if self.method == "hybrid":
+                self._shard_indexes = _shard_vector_indexes(self.segments, k, n)
+        # per-doc ranking weights (down-weighted near-duplicates), None if all are 1
+        self.doc_weight = None
+        if any(s.doc_weight is not None for s in self.segments):
+            self.doc_weight = np.concatenate([
+                np.ones(len(s), dtype=np.float32) if s.doc_weight is None else np.asarray(s.doc_weight)
+                for s in self.segments
+            ])
+
+        # lexical scoring (bm25/tfidf, and the BM25 side of hybrid) is one sparse
+        # mat-vec against weights precomputed from corpus-wide statistics;
+        # fts5 is answered by SQLite and keeps nothing in memory
+        self.lexical = None if self.method == FTS_METHOD else \
+            SparseScorer(self.method, self.segments, CorpusStats(self.segments), deleted=deleted_mask)
+
+        # load the query encoder now rather than on the first query; it is fetched
+        # from the model registry per query so a memory budget can unload it
+        if self.method == "hybrid" and shard is None:
+            get_encoder()
+
+    def _semantic_search(self, queries: List[str], top_k: int) -> List[Tuple[List[int], List[float]]]:
+        """
+        Fan the query embeddings out to every segment's FAISS index and merge
+        top_k per query. FAISS returns chunk ids, mapped back to doc positions.
+        """
+        return self.vector_search(embed_queries(get_encoder(), queries), top_k)
+
+    def vector_search(self, q_emb: np.ndarray, top_k: int) -> List[Tuple[List[int], List[float]]]:
+        """Top_k (doc positions, scores) per normalized query embedding, over this snapshot's vector segments."""
+        hits: List[List[Tuple[float, int]]] = [[] for _ in range(len(q_emb))]
+        for j, seg in enumerate(self.segments):
+            offset, deleted = self._offsets[j], self._deleted[j]
+            shard_index = None if self._shard_indexes is None else self._shard_indexes[j]
+            if self._shard_indexes is not None and shard_index is None:
+                continue  # none of this segment's chunks belong to the shard
+            faiss_index = seg.faiss_index if shard_index is None else shard_index[0]
+            if faiss_index is None:
+                raise RuntimeError("FAISS index not loaded for hybrid mode.")
+            # over-fetch by the tombstone count so deleted chunks cannot crowd out top_k
+            k = min(top_k + len(deleted), faiss_index.ntotal)
+            if k == 0:
+                continue
+            with span("query.vector_search"):
+                D, I = seg.vector_search(q_emb, k, shard_index=shard_index)
+            for row in range(len(q_emb)):
+                found = (I[row] != -1) & ~np.isin(I[row], deleted)
+                positions = offset + seg.positions(I[row][found])
+                hits[row].extend(zip(D[row][found].tolist(), positions.tolist()))
+        results = []
+        for row_hits in hits:
+            # equal scores in document order, as the lexical top_k and the shard merge rank them
+            row_hits.sort(key=lambda h: (-h[0], h[1]))
+            row_hits = row_hits[:top_k]
+            results.append(([i for _, i in row_hits], [s for s, _ in row_hits]))
+        return results
+
+    def positions(self, ids: Sequence[int]) -> np.ndarray:
+        """Doc positions of chunk ids, -1 for ids this snapshot does not hold."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(self.ids) == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        if self._id_order is None:
+            self._id_order = np.argsort(self.ids, kind="stable")
+        sorted_ids = self.ids[self._id_order]
+        at = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        return np.where(sorted_ids[at] == ids, self._id_order[at], -1)
+
+    def _lexical_top_k(self, q: str, top_k: int) -> List[Tuple[int, float]]:
+        with span("query.lexical"):
+            if LEXICAL_TOP_K == "exhaustive":
+                return self.lexical.top_k(q, top_k)
+            return self.lexical.top_k_maxscore(q, top_k)
+
+    def _fuse(self, sem_idxs: List[int], sem_scores: List[float], lex_top: List[Tuple[int, float]],
+              lex_scores: Callable[[List[int]], np.ndarray], top_k: int) -> List[Tuple[str, float]]:
+        weight = None if self.doc_weight is None else (lambda i: float(self.doc_weight[i]))
+        return [(self.documents[i], score)
+                for i, score in fuse(sem_idxs, sem_scores, lex_top, lex_scores, top_k, weight)]
+
+    def _ranked(self, scores: np.ndarray, top_k: int) -> List[Tuple[str, float]]:
+        return [(self.documents[i], float(scores[i])) for i in self.lexical.ranked(scores, top_k)]
 
     def query(self, q: str, top_k: int = 3) -> List[Tuple[str, float]]:
         """
         Returns list of (document_text, score).
-        For bm25/tfidf behavior stays the same as your previous implementation.
+        For bm25/tfidf: exact top_k from the sparse scorer (MaxScore pruning by default).
+        For fts5: top_k from SQLite FTS5, scored with -bm25().
         For hybrid: performs semantic + bm25 fusion and returns fused score.
         """
-        if self.method == "bm25":
-            tokenized_query = q.split()
-            scores = self.index.get_scores(tokenized_query)
-            ranked = np.argsort(scores)[::-1][:top_k]
-            return [(self.documents[i], float(scores[i])) for i in ranked]
-
-        elif self.method == "tfidf":
-            if self.vectorizer is None:
-                raise RuntimeError("Tfidf vectorizer missing in index.")
-            q_vec = self.vectorizer.transform([q])
-            # self.index is a matrix: docs x features
-            scores = (self.index @ q_vec.T).toarray().ravel()
-            ranked = np.argsort(scores)[::-1][:top_k]
-            return [(self.documents[i], float(scores[i])) for i in ranked]
+        if self.method in ("bm25", "tfidf"):
+            return [(self.documents[i], score) for i, score in self._lexical_top_k(q, top_k)]
+
+        elif self.method == FTS_METHOD:
+            weight = dedup.DEDUP_WEIGHT if dedup.DEDUP_MODE == "downweight" else None
+            with span("query.fts"):
+                return [(text, score) for _, text, score in fts.search(q, top_k, duplicate_weight=weight)]
 
         elif self.method == "hybrid":
-            # semantic (FAISS) + lexical (BM25) fusion
-            faiss_index = getattr(self, "_faiss", None)
-            if faiss_index is None:
-                raise RuntimeError("FAISS index not loaded for hybrid mode.")
-            # embed query
-            q_emb = self._sbert.encode([q], convert_to_numpy=True, dtype="float32")
-            import faiss  # local import for faiss module (assigns 'faiss', not 'np')
-            faiss.normalize_L2(q_emb)
-            D, I = faiss_index.search(q_emb, top_k)  # top_k semantic candidates
-            sem_idxs = I[0].tolist()
-            sem_scores = D[0].tolist()  # inner-product on normalized vectors -> cosine
-
-            # BM25 scores for all docs (fast)
-            tokenized_query = q.split()
-            bm25_scores = self.index.get_scores(tokenized_query)  # array of scores
-
-            # Combine candidate set (union of top_k semantics + top_k BM25 highest)
-            top_bm25_idxs = np.argsort(bm25_scores)[::-1][:top_k].tolist()
-            candidate_idxs = list(dict.fromkeys(sem_idxs + top_bm25_idxs))  # preserve order, unique
-
-            # build score arrays aligned with candidate_idxs
-            sem_map = {i: 0.0 for i in candidate_idxs}
-            for i, s in zip(sem_idxs, sem_scores):
-                sem_map[i] = float(s)
-
-            lex_map = {i: float(bm25_scores[i]) for i in candidate_idxs}
-
-            # min-max normalize both lists
-            sem_arr = np.array([sem_map[i] for i in candidate_idxs], dtype="float32")
-            lex_arr = np.array([lex_map[i] for i in candidate_idxs], dtype="float32")
-
-            def min_max(x):
-                if x.size == 0:
-                    return x
-                minv = float(x.min())
-                maxv = float(x.max())
-                if maxv - minv < 1e-9:
-                    return np.ones_like(x)
-                return (x - minv) / (maxv - minv)
-
-            sem_norm = min_max(sem_arr)
-            lex_norm = min_max(lex_arr)
-
-            # fusion weight: default equal weight (0.5 each) — you can change easily later
-            alpha = 0.6
-            fused = []
-            for idx, s_sem, s_lex in zip(candidate_idxs, sem_norm, lex_norm):
-                fused_score = float(alpha * float(s_sem) + (1 - alpha) * float(s_lex))
-                fused.append((self.documents[idx], fused_score))
-
-            # sort by fused score
-            fused_sorted = sorted(fused, key=lambda x: x[1], reverse=True)[:top_k]
-            return fused_sorted
+            # semantic (FAISS) + lexical (BM25) fusion; BM25 only scores its own
+            # top_k (pruned) plus whichever semantic candidates it did not return
+            (sem_idxs, sem_scores), = self._semantic_search([q], top_k)  # top_k semantic candidates
+            lex_top = self._lexical_top_k(q, top_k)
+            with span("query.fuse"):
+                return self._fuse(sem_idxs, sem_scores, lex_top, lambda docs: self.lexical.score_docs(q, docs), top_k)
 
         else:
-            raise ValueError("Unknown method")
\ No newline at end of file
+            raise ValueError("Unknown method")
+
+    def query_batch(self, queries: List[str], top_k: int = 3) -> List[List[Tuple[str, float]]]:
+        """
+        query() for many queries at once. Lexical scores come from one sparse
+        mat-mat product per block of queries; hybrid also embeds and searches
+        FAISS for the whole batch in one call per segment.
+        """
+        if self.method == FTS_METHOD:
+            return [self.query(q, top_k) for q in queries]
+        if self.method not in ("bm25", "tfidf", "hybrid"):
+            raise ValueError("Unknown method")
+        semantic = self._semantic_search(queries, top_k) if self.method == "hybrid" and queries else None
+        results: List[List[Tuple[str, float]]] = []
+        for block in self.lexical.score_batch(queries):
+            for scores in block:
+                if semantic is None:
+                    results.append(self._ranked(scores, top_k))
+                else:
+                    sem_idxs, sem_scores = semantic[len(results)]
+                    lex_top = [(int(i), float(scores[i])) for i in self.lexical.ranked(scores, top_k)]
+                    results.append(self._fuse(sem_idxs, sem_scores, lex_top, lambda docs: scores[docs], top_k))
+        return results
+
+
+def _load_snapshot():
+    """A Retriever, or with INDEX_SHARDS > 1 a ShardedRetriever over the shard workers."""
+    from . import shards
+    if shards.INDEX_SHARDS > 1:
+        manifest = read_manifest()
+        if manifest["method"] != FTS_METHOD:
+            return shards.ShardedRetriever(shards.get_shard_pool(), int(manifest["generation"]), manifest["method"])
+    return Retriever()
+
+
+# Process-wide retriever snapshot, swapped whenever the index generation changes
+_RETRIEVER: Optional[Retriever] = None
+_RETRIEVER_LOCK = threading.Lock()
+
+
+def get_retriever() -> Retriever:
+    """
+    Return the shared Retriever for this process, reloading it only when
+    the Indexer has published a new generation (build, append or merge).
+
+    The swap is a single reference assignment, so in-flight queries keep the
+    snapshot they already hold. If loading the new generation fails (e.g. the
+    index is mid-write), the previous snapshot keeps serving.
+    Raises FileNotFoundError if no index has been built yet.
+    """
+    global _RETRIEVER
+    generation = read_index_generation()
+    current = _RETRIEVER
+    if current is not None and current.generation == generation:
+        return current
+
+    with _RETRIEVER_LOCK:
+        current = _RETRIEVER
+        if current is not None and current.generation == generation:
+            return current
+        try:
+            with span("retriever.reload"):
+                fresh = _load_snapshot()
+        except Exception:
+            INDEX_RELOADS.inc(outcome="failed")
+            if current is None:
+                raise
+            logger.exception("Reloading index generation %s failed, keeping generation %s",
+                             generation, current.generation)
+            return current
+        logger.info("Loaded index generation %s", fresh.generation)
+        INDEX_RELOADS.inc(outcome="loaded")
+        _RETRIEVER = fresh
+        return fresh
+
+
+Gauge("index_generation", "Index generation served by this process's retriever.",
+      lambda: _RETRIEVER.generation if _RETRIEVER is not None else None)
+
+
+def reset_retriever_cache():
+    """Drop the cached snapshot (used by tests and after deleting the index)."""
+    global _RETRIEVER
+    with _RETRIEVER_LOCK:
+        _RETRIEVER = None
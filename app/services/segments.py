@@ -0,0 +1,638 @@
+"""
+Append-only segmented index storage.
+
+An index is a manifest (data/index/manifest.json) listing immutable segments.
+Every build or upload writes a new segment directory and then publishes a new
+manifest with a bumped generation. Readers only ever see fully written
+segments, and small segments are merged in the background so query fan-out
+stays bounded.
+
+Segments keep raw postings (term -> local doc ids, term frequencies) and doc
+lengths instead of fitted BM25/TF-IDF objects. Scoring weights are derived at
+load time from corpus-wide statistics (CorpusStats), so IDF and avgdl are
+consistent no matter how the corpus is split.
+
+On-disk layout of a segment directory (all arrays are plain .npy files and are
+memory-mapped by readers, so worker processes share pages and nothing is
+deserialized up front):
+
+  meta.json            method, num_docs, total_len, format, vector index type and report
+  ids.npy              int64[N]   global doc ids (SQLite chunk ids), ascending
+  doc_len.npy          int32[N]   tokens per doc
+  doc_offsets.npy      int64[N+1] byte offsets into docs.npy
+  docs.npy             uint8[...] utf-8 chunk texts, concatenated
+  term_hash.npy        uint64[V]  64-bit term hashes, ascending (vocab order)
+  vocab_offsets.npy    int64[V+1] byte offsets into vocab.npy
+  vocab.npy            uint8[...] utf-8 terms in vocab order
+  postings_indptr.npy  int64[V+1] CSR row pointers, one row per term
+  postings_docs.npy    int32[nnz] local doc positions
+  postings_tfs.npy     int32[nnz] term frequencies
+  doc_weight.npy       float32[N] ranking weight per doc (optional; only written
+                       when some doc is down-weighted, e.g. a near-duplicate)
+  embeddings.npy       float32[N, d] normalized embeddings (hybrid only); with a
+                       quantized faiss.index only shortlists are read from it
+  faiss.index          IndexIDMap keyed by chunk id (hybrid only, see vector_index)
+
+Deletions are tombstones: the manifest lists deleted ids per segment, readers
+skip them, and the next merge drops them from the merged segment.
+
+Segments are written to a temporary directory and renamed into place, and the
+manifest is replaced atomically, so a reader never observes a partial write.
+"""
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import fcntl  # POSIX only; on other platforms we fall back to an in-process lock
+except ImportError:
+    fcntl = None
+
+try:
+    from sklearn.feature_extraction.text import TfidfVectorizer
+except Exception:
+    TfidfVectorizer = None
+
+from app.tracing import span
+from .vector_index import (
+    add_vectors,
+    build_vector_index,
+    choose_index_type,
+    choose_quantization,
+    configure_search,
+    evaluate_against_flat,
+    index_bytes,
+    remove_vectors,
+    search as vector_search,
+)
+
+logger = logging.getLogger(__name__)
+
+INDEX_DIR = "data/index"
+MANIFEST_FILE = os.path.join(INDEX_DIR, "manifest.json")
+LOCK_FILE = os.path.join(INDEX_DIR, ".lock")
+SEGMENT_FORMAT = 2
+
+# merge policy: once there are more than MAX_SEGMENTS segments, merge the
+# MERGE_FACTOR adjacent segments with the fewest documents into one
+MAX_SEGMENTS = int(os.environ.get("INDEX_MAX_SEGMENTS", "8"))
+MERGE_FACTOR = int(os.environ.get("INDEX_MERGE_FACTOR", "4"))
+
+# BM25 parameters, identical to rank_bm25.BM25Okapi defaults
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_EPSILON = 0.25
+
+METHODS = ("bm25", "tfidf", "hybrid")
+
+_ARRAYS = (
+    "ids", "doc_len", "doc_offsets", "docs", "term_hash", "vocab_offsets", "vocab",
+    "postings_indptr", "postings_docs", "postings_tfs",
+)
+# arrays a segment may lack; readers treat a missing one as its default
+_OPTIONAL_ARRAYS = ("doc_weight",)
+
+
+def get_analyzer(method: str) -> Callable[[str], List[str]]:
+    """
+    Tokenizer used for both indexing and querying.
+    bm25/hybrid keep the historical whitespace split; tfidf uses sklearn's
+    default word analyzer so scores match TfidfVectorizer.
+    """
+    if method in ("bm25", "hybrid"):
+        return str.split
+    if method == "tfidf":
+        if TfidfVectorizer is None:
+            raise RuntimeError("scikit-learn is not installed or TfidfVectorizer unavailable.")
+        return TfidfVectorizer().build_analyzer()
+    raise ValueError(f"Unsupported method: {method}")
+
+
+def term_hash(term: str) -> int:
+    """Stable 64-bit hash used to align vocabularies across segments."""
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _pack_strings(strings: Sequence[bytes]) -> Tuple[np.ndarray, np.ndarray]:
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(s) for s in strings])
+    blob = np.frombuffer(b"".join(strings), dtype=np.uint8)
+    return blob, offsets
+
+
+class Segment:
+    """
+    Immutable slice of the corpus, backed by the arrays listed in the module
+    docstring. Loaded segments hold read-only memory maps; texts and terms are
+    decoded only when asked for.
+    """
+
+    def __init__(self, name: str, method: str, arrays: Dict[str, np.ndarray],
+                 embeddings: Optional[np.ndarray] = None, faiss_index=None,
+                 vector_index: Optional[dict] = None):
+        self.name = name
+        self.method = method
+        self.ids = arrays["ids"]
+        self.doc_len = arrays["doc_len"]
+        self.doc_offsets = arrays["doc_offsets"]
+        self.docs = arrays["docs"]
+        self.term_hash = arrays["term_hash"]
+        self.vocab_offsets = arrays["vocab_offsets"]
+        self.vocab = arrays["vocab"]
+        self.postings_indptr = arrays["postings_indptr"]
+        self.postings_docs = arrays["postings_docs"]
+        self.postings_tfs = arrays["postings_tfs"]
+        # None means every doc has weight 1
+        self.doc_weight = arrays.get("doc_weight")
+        self.embeddings = embeddings
+        self.faiss_index = faiss_index
+        # {"kind": ..., "report": recall/latency vs flat} for hybrid segments
+        self.vector_index = vector_index or {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def path(self) -> str:
+        return os.path.join(INDEX_DIR, self.name)
+
+    @property
+    def total_len(self) -> int:
+        return int(self.doc_len.sum())
+
+    def document(self, pos: int) -> str:
+        start, end = self.doc_offsets[pos], self.doc_offsets[pos + 1]
+        return self.docs[start:end].tobytes().decode("utf-8")
+
+    def term(self, term_id: int) -> str:
+        start, end = self.vocab_offsets[term_id], self.vocab_offsets[term_id + 1]
+        return self.vocab[start:end].tobytes().decode("utf-8")
+
+    def term_id(self, term: str, hashed: Optional[int] = None) -> int:
+        """Local id of term, or -1. The vocab table guards against hash collisions."""
+        hashed = term_hash(term) if hashed is None else hashed
+        pos = int(np.searchsorted(self.term_hash, np.uint64(hashed)))
+        if pos < len(self.term_hash) and int(self.term_hash[pos]) == hashed and self.term(pos) == term:
+            return pos
+        return -1
+
+    def postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, end = self.postings_indptr[term_id], self.postings_indptr[term_id + 1]
+        return self.postings_docs[start:end], self.postings_tfs[start:end]
+
+    @property
+    def doc_freqs(self) -> np.ndarray:
+        return np.diff(self.postings_indptr)
+
+    def positions(self, ids: Sequence[int]) -> np.ndarray:
+        """Local positions of chunk ids (ids are stored ascending)."""
+        return np.searchsorted(self.ids, np.asarray(ids, dtype=np.int64))
+
+    def vector_search(self, queries: np.ndarray, k: int, shard_index=None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (scores, chunk ids) of the k nearest embeddings per query. Quantized
+        indexes are rescored exactly against the memory-mapped float32 vectors.
+        shard_index is a (faiss index, quantization) pair from shard_vector_index()
+        to search instead of the segment's own index.
+        """
+        faiss_index, quantization = shard_index or (self.faiss_index, self.vector_index.get("quantization", "none"))
+        if quantization == "none":
+            return vector_search(faiss_index, queries, k)
+        return vector_search(faiss_index, queries, k, embeddings=self.embeddings, ids=self.ids)
+
+    def shard_vector_index(self, shard: int, num_shards: int):
+        """
+        (faiss index, quantization) over the embeddings of the chunks with
+        id % num_shards == shard, or None if the segment holds none of them.
+        Built like a segment index of that size, in memory; not saved.
+        """
+        owned = np.flatnonzero(np.asarray(self.ids) % num_shards == shard)
+        if not owned.size:
+            return None
+        faiss_index, _, quantization = build_vector_index(self.embeddings[owned], self.ids[owned])
+        return faiss_index, quantization
+
+    @classmethod
+    def build(cls, method: str, chunks: Sequence[str], ids: Sequence[int],
+              embeddings: Optional[np.ndarray] = None,
+              weights: Optional[Sequence[float]] = None) -> "Segment":
+        ids = np.asarray(ids, dtype=np.int64)
+        if weights is not None:
+            weights = np.asarray(weights, dtype=np.float32)
+            if np.all(weights == 1):
+                weights = None
+        if len(ids) > 1 and np.any(np.diff(ids) <= 0):
+            # keep ids ascending so positions() can binary search
+            order = np.argsort(ids, kind="stable")
+            ids, chunks = ids[order], [chunks[i] for i in order]
+            embeddings = None if embeddings is None else np.asarray(embeddings)[order]
+            weights = None if weights is None else weights[order]
+        analyzer = get_analyzer(method)
+        acc: Dict[str, Tuple[List[int], List[int]]] = {}
+        doc_len = np.zeros(len(chunks), dtype=np.int32)
+        for pos, chunk in enumerate(chunks):
+            tokens = analyzer(chunk)
+            doc_len[pos] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                docs, tfs = acc.setdefault(term, ([], []))
+                docs.append(pos)
+                tfs.append(tf)
+
+        terms = sorted(acc, key=term_hash)
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(acc[t][0]) for t in terms])
+        vocab, vocab_offsets = _pack_strings([t.encode("utf-8") for t in terms])
+        docs_blob, doc_offsets = _pack_strings([c.encode("utf-8") for c in chunks])
+        arrays = {
+            "ids": ids,
+            "doc_len": doc_len,
+            "doc_offsets": doc_offsets,
+            "docs": docs_blob,
+            "term_hash": np.array([term_hash(t) for t in terms], dtype=np.uint64),
+            "vocab_offsets": vocab_offsets,
+            "vocab": vocab,
+            "postings_indptr": indptr,
+            "postings_docs": np.fromiter((d for t in terms for d in acc[t][0]), dtype=np.int32, count=int(indptr[-1])),
+            "postings_tfs": np.fromiter((f for t in terms for f in acc[t][1]), dtype=np.int32, count=int(indptr[-1])),
+        }
+        if weights is not None:
+            arrays["doc_weight"] = weights
+        faiss_index = vector_index = None
+        if method == "hybrid":
+            embeddings = _normalized(embeddings)
+            faiss_index, vector_index = _vector_index(embeddings, ids)
+        return cls(_new_segment_name(), method, arrays, embeddings=embeddings,
+                   faiss_index=faiss_index, vector_index=vector_index)
+
+    def save(self):
+        """Write into a temp directory, then rename it into place in one step."""
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        tmp_path = os.path.join(INDEX_DIR, f".tmp-{self.name}-{os.getpid()}")
+        os.makedirs(tmp_path)
+        try:
+            for key in _ARRAYS + _OPTIONAL_ARRAYS:
+                if getattr(self, key) is not None:
+                    np.save(os.path.join(tmp_path, f"{key}.npy"), getattr(self, key))
+            if self.embeddings is not None:
+                np.save(os.path.join(tmp_path, "embeddings.npy"), self.embeddings)
+            if self.faiss_index is not None:
+                import faiss
+                faiss.write_index(self.faiss_index, os.path.join(tmp_path, "faiss.index"))
+            with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+                json.dump({
+                    "format": SEGMENT_FORMAT,
+                    "method": self.method,
+                    "num_docs": len(self),
+                    "total_len": self.total_len,
+                    "vector_index": self.vector_index,
+                }, f)
+            os.rename(tmp_path, self.path)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+    @classmethod
+    def load(cls, name: str) -> "Segment":
+        path = os.path.join(INDEX_DIR, name)
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            meta = json.load(f)
+        if meta.get("format") != SEGMENT_FORMAT:
+            raise RuntimeError(f"Segment {name} has unsupported format {meta.get('format')}; rebuild the index.")
+        arrays = {key: np.load(os.path.join(path, f"{key}.npy"), mmap_mode="r") for key in _ARRAYS}
+        for key in _OPTIONAL_ARRAYS:
+            if os.path.exists(os.path.join(path, f"{key}.npy")):
+                arrays[key] = np.load(os.path.join(path, f"{key}.npy"), mmap_mode="r")
+        embeddings = faiss_index = None
+        if meta["method"] == "hybrid":
+            try:
+                import faiss
+            except Exception as e:
+                raise RuntimeError("faiss must be installed to use hybrid retrieval.") from e
+            faiss_path = os.path.join(path, "faiss.index")
+            if not os.path.exists(faiss_path):
+                raise FileNotFoundError("FAISS index file not found for hybrid mode. Rebuild index first.")
+            embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+            faiss_index = _read_faiss_mmap(faiss_path)
+            configure_search(faiss_index)
+        return cls(name, meta["method"], arrays, embeddings=embeddings, faiss_index=faiss_index,
+                   vector_index=meta.get("vector_index"))
+
+
+def merge_segments(segments: Sequence[Segment], deleted: Optional[Sequence[Sequence[int]]] = None) -> Segment:
+    """
+    Merge segments into one, dropping tombstoned ids (deleted[i] belongs
+    to segments[i]). Documents are re-sorted by id like Segment.build, since
+    appends are not always in id order. Embeddings are copied, never
+    recomputed, and a large HNSW/IVF input index is extended in place
+    instead of being rebuilt.
+    """
+    method = segments[0].method
+    deleted = deleted or [()] * len(segments)
+    live = [~np.isin(s.ids, np.asarray(d, dtype=np.int64)) for s, d in zip(segments, deleted)]
+    # live documents in concatenation order -> merged (id-sorted) order
+    ids = np.concatenate([s.ids[m] for s, m in zip(segments, live)])
+    by_id = np.argsort(ids, kind="stable")
+    rank = np.empty_like(by_id)
+    rank[by_id] = np.arange(len(by_id))
+    # old local position -> new merged position (-1 for dropped docs)
+    remaps, base = [], 0
+    for mask in live:
+        remap = np.full(len(mask), -1, dtype=np.int64)
+        remap[mask] = rank[base:base + int(mask.sum())]
+        remaps.append(remap)
+        base += int(mask.sum())
+
+    # explode every segment's CSR into (term hash, doc, tf) triples and re-sort
+    hashes = np.concatenate([np.repeat(s.term_hash, s.doc_freqs) for s in segments])
+    docs = np.concatenate([remap[np.asarray(s.postings_docs, dtype=np.int64)] for s, remap in zip(segments, remaps)])
+    tfs = np.concatenate([s.postings_tfs for s in segments])
+    kept = docs >= 0
+    hashes, docs, tfs = hashes[kept], docs[kept], tfs[kept]
+    order = np.lexsort((docs, hashes))
+    hashes, docs, tfs = hashes[order], docs[order], tfs[order]
+    unique_hashes, counts = np.unique(hashes, return_counts=True)
+    indptr = np.zeros(len(unique_hashes) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(counts)
+
+    # first spelling seen for each hash wins (all segments agree barring collisions)
+    spelled: Dict[int, bytes] = {}
+    for seg in segments:
+        for tid, h in enumerate(seg.term_hash.tolist()):
+            if h not in spelled:
+                spelled[h] = seg.vocab[seg.vocab_offsets[tid]:seg.vocab_offsets[tid + 1]].tobytes()
+    vocab, vocab_offsets = _pack_strings([spelled[h] for h in unique_hashes.tolist()])
+
+    # keep the bytes of live documents only, then put them in id order
+    blobs, lengths = [], []
+    for seg, mask in zip(segments, live):
+        doc_bytes = np.diff(np.asarray(seg.doc_offsets, dtype=np.int64))
+        blobs.append(np.asarray(seg.docs)[np.repeat(mask, doc_bytes)])
+        lengths.append(doc_bytes[mask])
+    lengths = np.concatenate(lengths)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+    doc_offsets = np.zeros(base + 1, dtype=np.int64)
+    doc_offsets[1:] = np.cumsum(lengths[by_id])
+    gather = np.repeat(starts[by_id] - doc_offsets[:-1], lengths[by_id]) + np.arange(doc_offsets[-1])
+    arrays = {
+        "ids": ids[by_id],
+        "doc_len": np.concatenate([s.doc_len[m] for s, m in zip(segments, live)])[by_id],
+        "doc_offsets": doc_offsets,
+        "docs": np.concatenate(blobs)[gather],
+        "term_hash": unique_hashes.astype(np.uint64),
+        "vocab_offsets": vocab_offsets,
+        "vocab": vocab,
+        "postings_indptr": indptr,
+        "postings_docs": docs.astype(np.int32),
+        "postings_tfs": tfs.astype(np.int32),
+    }
+    if any(s.doc_weight is not None for s in segments):
+        arrays["doc_weight"] = np.concatenate([
+            (np.ones(len(s), dtype=np.float32) if s.doc_weight is None else np.asarray(s.doc_weight))[m]
+            for s, m in zip(segments, live)
+        ])[by_id]
+    embeddings = faiss_index = vector_index = None
+    if method == "hybrid":
+        embeddings = np.vstack([np.asarray(s.embeddings)[m] for s, m in zip(segments, live)])[by_id]
+        faiss_index, vector_index = _merged_vector_index(segments, live, deleted, embeddings, arrays["ids"])
+    return Segment(_new_segment_name(), method, arrays, embeddings=embeddings,
+                   faiss_index=faiss_index, vector_index=vector_index)
+
+
+def _vector_index(embeddings: np.ndarray, ids: np.ndarray):
+    """Build the FAISS index for a segment; ANN types are measured against flat search."""
+    faiss_index, kind, quantization = build_vector_index(embeddings, ids)
+    return faiss_index, _describe(faiss_index, kind, quantization, embeddings, ids)
+
+
+def _describe(faiss_index, kind: str, quantization: str, embeddings: np.ndarray, ids: np.ndarray) -> dict:
+    info = {"kind": kind, "quantization": quantization, "bytes": index_bytes(faiss_index)}
+    if kind != "flat" or quantization != "none":
+        info["report"] = evaluate_against_flat(faiss_index, embeddings, ids, rerank=quantization != "none")
+        logger.info("Vector index %s/%s over %d vectors (%d bytes): recall@%d=%.3f, %.3f ms/query (flat %.3f ms)",
+                    kind, quantization, len(ids), info["bytes"], info["report"]["k"],
+                    info["report"]["recall_at_k"], info["report"]["latency_ms"],
+                    info["report"]["flat_latency_ms"])
+    return info
+
+
+def _merged_vector_index(segments, live, deleted, embeddings, ids):
+    """
+    Reuse the largest input index when it already has the type the merged
+    segment needs (HNSW graph / trained IVF quantizer / codebooks): copy it,
+    drop its tombstones and add the other inputs' vectors. Otherwise build
+    from scratch.
+    """
+    import faiss
+    kind = choose_index_type(len(ids))
+    quantization = choose_quantization(len(ids), kind)
+    largest = max(range(len(segments)), key=lambda i: len(segments[i]))
+    base = segments[largest]
+    reusable = (kind != "flat" and base.faiss_index is not None
+                and base.vector_index.get("kind") == kind
+                and base.vector_index.get("quantization", "none") == quantization)
+    if not reusable:
+        return _vector_index(embeddings, ids)
+    index = faiss.clone_index(base.faiss_index)
+    if len(deleted[largest]) and not remove_vectors(index, deleted[largest]):
+        return _vector_index(embeddings, ids)  # HNSW cannot remove; rebuild
+    for i, (seg, mask) in enumerate(zip(segments, live)):
+        if i != largest:
+            add_vectors(index, np.asarray(seg.embeddings)[mask], seg.ids[mask])
+    configure_search(index)
+    return index, _describe(index, kind, quantization, embeddings, ids)
+
+
+class CorpusStats:
+    """
+    Collection-wide statistics shared by every segment at query time.
+    Vocabularies are aligned by term hash, so this is a handful of vectorized
+    numpy operations rather than a walk over every term string.
+    """
+
+    def __init__(self, segments: Sequence[Segment]):
+        self.num_docs = sum(len(s) for s in segments)
+        self.total_len = sum(s.total_len for s in segments)
+        if segments:
+            hashes = np.concatenate([s.term_hash for s in segments])
+            freqs = np.concatenate([s.doc_freqs for s in segments])
+        else:
+            hashes = np.zeros(0, dtype=np.uint64)
+            freqs = np.zeros(0, dtype=np.int64)
+        self.term_hash, inverse = np.unique(hashes, return_inverse=True)
+        self.df = np.bincount(inverse, weights=freqs, minlength=len(self.term_hash))
+
+    @property
+    def avgdl(self) -> float:
+        return self.total_len / self.num_docs if self.num_docs else 1.0
+
+    def lookup(self, hashes: np.ndarray) -> np.ndarray:
+        """Positions of hashes in the global table (every hash must be present)."""
+        return np.searchsorted(self.term_hash, hashes)
+
+    def find(self, hashed: int) -> int:
+        pos = int(np.searchsorted(self.term_hash, np.uint64(hashed)))
+        if pos < len(self.term_hash) and int(self.term_hash[pos]) == hashed:
+            return pos
+        return -1
+
+    def bm25_idf(self, epsilon: float = BM25_EPSILON) -> np.ndarray:
+        """Okapi IDF with rank_bm25's epsilon floor for very common terms."""
+        idf = np.log(self.num_docs - self.df + 0.5) - np.log(self.df + 0.5)
+        if idf.size:
+            idf[idf < 0] = epsilon * idf.mean()
+        return idf
+
+    def tfidf_idf(self) -> np.ndarray:
+        """Smoothed IDF as computed by TfidfVectorizer(smooth_idf=True)."""
+        return np.log((1 + self.num_docs) / (1 + self.df)) + 1.0
+
+
+def _new_segment_name() -> str:
+    return f"seg_{uuid.uuid4().hex[:12]}"
+
+
+def _normalized(embeddings: np.ndarray) -> np.ndarray:
+    embeddings = np.array(embeddings, dtype="float32")
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms  # normalize for cosine with inner-product
+
+
+def _read_faiss_mmap(path: str):
+    """Memory-map the index where this faiss build supports it, else read it."""
+    import faiss
+    flags = getattr(faiss, "IO_FLAG_MMAP", 0) | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+    try:
+        return faiss.read_index(path, flags)
+    except Exception:
+        return faiss.read_index(path)
+
+
+# --- manifest -----------------------------------------------------------------
+
+_LOCK = threading.RLock()
+
+
+@contextmanager
+def manifest_lock():
+    """Serialize manifest updates across threads and (on POSIX) across processes."""
+    with _LOCK:
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        with open(LOCK_FILE, "a") as fh:
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def read_manifest() -> dict:
+    """Raises FileNotFoundError if no index has been published."""
+    with open(MANIFEST_FILE, "r") as f:
+        return json.load(f)
+
+
+def write_manifest(manifest: dict):
+    """Atomically replace the manifest (tmp file + rename). Caller holds manifest_lock."""
+    tmp_path = f"{MANIFEST_FILE}.tmp.{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, MANIFEST_FILE)
+
+
+def remove_segments(names: Sequence[str]):
+    # readers that still map these files keep their pages until they drop the
+    # snapshot (POSIX unlink semantics), so removing published segments is safe
+    for name in names:
+        shutil.rmtree(os.path.join(INDEX_DIR, name), ignore_errors=True)
+
+
+def _pick_merge_window(sizes: Sequence[int], factor: int) -> Optional[int]:
+    if len(sizes) < 2:
+        return None
+    factor = max(2, min(factor, len(sizes)))
+    totals = [sum(sizes[i:i + factor]) for i in range(len(sizes) - factor + 1)]
+    return int(np.argmin(totals))
+
+
+def merge_once(max_segments: Optional[int] = None, factor: Optional[int] = None) -> bool:
+    """
+    Merge one window of adjacent segments if the index has more than
+    max_segments segments. Returns True if a merge was published.
+    """
+    max_segments = MAX_SEGMENTS if max_segments is None else max_segments
+    factor = MERGE_FACTOR if factor is None else factor
+    try:
+        manifest = read_manifest()
+    except FileNotFoundError:
+        return False
+    entries = manifest["segments"]
+    if len(entries) <= max_segments:
+        return False
+    start = _pick_merge_window([e["docs"] for e in entries], factor)
+    if start is None:
+        return False
+    window = entries[start:start + max(2, min(factor, len(entries)))]
+    names = [e["name"] for e in window]
+    deleted = [e.get("deleted", []) for e in window]
+
+    # the expensive part runs without the lock; appends and deletes can land meanwhile
+    with span("index.merge"):
+        merged = merge_segments([Segment.load(name) for name in names], deleted=deleted)
+        merged.save()
+
+    with manifest_lock():
+        current = read_manifest()
+        current_names = [e["name"] for e in current["segments"]]
+        if current["method"] != merged.method or not all(n in current_names for n in names):
+            # a rebuild or another merge replaced our inputs; drop our output
+            remove_segments([merged.name])
+            return False
+        first = current_names.index(names[0])
+        # tombstones written while we merged still apply to the merged segment
+        purged = {i for d in deleted for i in d}
+        pending = sorted({i for e in current["segments"] if e["name"] in names
+                          for i in e.get("deleted", [])} - purged)
+        entry = {"name": merged.name, "docs": len(merged)}
+        if pending:
+            entry["deleted"] = pending
+        segments = [e for e in current["segments"] if e["name"] not in names]
+        segments.insert(first, entry)
+        current["segments"] = segments
+        current["generation"] += 1
+        write_manifest(current)
+    remove_segments(names)
+    logger.info("Merged %d segments into %s (%d docs)", len(names), merged.name, len(merged))
+    return True
+
+
+_MERGE_THREAD: Optional[threading.Thread] = None
+
+
+def schedule_merge():
+    """Run merges in a daemon thread until the segment count is within budget."""
+    global _MERGE_THREAD
+    with _LOCK:
+        if _MERGE_THREAD is not None and _MERGE_THREAD.is_alive():
+            return
+
+        def _run():
+            try:
+                while merge_once():
+                    pass
+            except Exception:
+                logger.exception("Background segment merge failed")
+
+        _MERGE_THREAD = threading.Thread(target=_run, name="segment-merge", daemon=True)
+        _MERGE_THREAD.start()
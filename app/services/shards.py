@@ -0,0 +1,340 @@
+"""
+Sharded index with scatter-gather query execution.
+
+With INDEX_SHARDS=n > 1 the published index is served by n worker processes.
+Shard k owns the chunks with id % n == k: its worker holds a
+Retriever(shard=(k, n)) snapshot whose BM25/TF-IDF weights cover only those
+chunks but are computed from corpus-wide statistics, and which searches
+FAISS indexes it builds over only those chunks' embeddings, one per segment.
+Scores are therefore the same numbers a single-process Retriever produces,
+and merging per-shard top_k lists gives the same top_k (exactly, for flat
+vector indexes). Segments stay memory-mapped (the page cache holds one
+copy); what is split is the scorer memory, the vector indexes and the
+query CPU.
+
+A query is sent to every shard at once (scatter) and the per-shard top_k
+lists are merged (gather). Hybrid embeds the query once in the coordinator;
+each shard returns its vector and BM25 top_k, and a second round asks the
+owning shards for the BM25 scores of fused candidates that were not in the
+BM25 top_k, before the same fusion the single-process Retriever uses.
+
+Workers talk to the coordinator through a multiprocessing Pipe with plain
+picklable messages (request id, op, generation, payload) -> (request id,
+status, generation, result), so serving shards from other hosts only needs
+another _LocalShard. Replies are matched to requests by id, so concurrent
+queries share the workers without waiting for each other's round trips.
+fts5 indexes live in SQLite and are never sharded.
+"""
+import os
+import time
+import logging
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.tracing import Counter, span
+
+logger = logging.getLogger(__name__)
+
+# number of shard worker processes; 1 serves queries in-process without shards
+INDEX_SHARDS = int(os.environ.get("INDEX_SHARDS", "1"))
+# seconds to wait for a shard's reply before restarting it
+SHARD_TIMEOUT_S = float(os.environ.get("SHARD_TIMEOUT_S", "30"))
+
+SHARD_RESTARTS = Counter("shard_restarts_total", "Shard worker processes restarted after dying or timing out.")
+
+# (chunk id, score, text, ranking weight)
+Hit = Tuple[int, float, str, float]
+
+
+class ShardError(RuntimeError):
+    pass
+
+
+# --- worker side -----------------------------------------------------------------
+
+def _hits(snapshot, positions: Sequence[int], scores: Sequence[float]) -> List[Hit]:
+    weight = snapshot.doc_weight
+    return [(int(snapshot.ids[i]), float(s), snapshot.documents[i], 1.0 if weight is None else float(weight[i]))
+            for i, s in zip(positions, scores)]
+
+
+def _search(snapshot, payload) -> List[Tuple[List[Hit], Optional[List[Hit]]]]:
+    """Per query: this shard's lexical top_k and, given embeddings, its vector top_k."""
+    queries, q_emb, top_k = payload
+    semantic = snapshot.vector_search(q_emb, top_k) if q_emb is not None else [None] * len(queries)
+    results = []
+    for q, sem in zip(queries, semantic):
+        lex = snapshot._lexical_top_k(q, top_k)
+        results.append((_hits(snapshot, [i for i, _ in lex], [s for _, s in lex]),
+                        None if sem is None else _hits(snapshot, *sem)))
+    return results
+
+
+def _score(snapshot, payload) -> List[List[float]]:
+    """Lexical scores of owned chunk ids, per query (0 for ids this shard does not hold)."""
+    queries, ids = payload
+    results = []
+    for q, chunk_ids in zip(queries, ids):
+        positions = snapshot.positions(chunk_ids)
+        scores = snapshot.lexical.score_docs(q, positions.clip(min=0))
+        scores[positions < 0] = 0.0
+        results.append(scores.tolist())
+    return results
+
+
+_HANDLERS = {"load": lambda snapshot, payload: len(snapshot.ids), "search": _search, "score": _score}
+
+
+def _serve(conn, shard: int, num_shards: int):
+    """Worker loop: answer requests from a snapshot at least as new as the requested generation."""
+    from app.services.retriever import Retriever
+    snapshot = None
+    while True:
+        try:
+            request_id, op, generation, payload = conn.recv()
+        except EOFError:
+            return
+        if op == "stop":
+            return
+        try:
+            if snapshot is None or snapshot.generation < generation:
+                snapshot = Retriever(shard=(shard, num_shards))
+            conn.send((request_id, "ok", snapshot.generation, _HANDLERS[op](snapshot, payload)))
+        except Exception as e:
+            logger.exception("Shard %d failed on %s", shard, op)
+            conn.send((request_id, "error", None, f"{type(e).__name__}: {e}"))
+
+
+# --- coordinator side --------------------------------------------------------------
+
+class _LocalShard:
+    """
+    One shard served by a worker process on this host. Any number of queries
+    can be in flight: requests carry an id, and a reader thread hands each
+    reply to the Future of the request it answers.
+    """
+
+    def __init__(self, shard: int, num_shards: int):
+        self.shard = shard
+        self.num_shards = num_shards
+        # guards the connection, the process and _pending; held only to send
+        self.lock = threading.Lock()
+        self._ids = itertools.count()
+        # request id -> (connection it was sent on, Future of its reply)
+        self._pending: Dict[int, Tuple[object, Future]] = {}
+        self._start()
+
+    def _start(self):
+        ctx = multiprocessing.get_context("spawn")
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_serve, args=(child, self.shard, self.num_shards),
+                                   name=f"index-shard-{self.shard}", daemon=True)
+        self.process.start()
+        child.close()
+        threading.Thread(target=self._read, args=(self.conn,), name=f"index-shard-{self.shard}-reader",
+                         daemon=True).start()
+
+    def _read(self, conn):
+        while True:
+            try:
+                request_id, *reply = conn.recv()
+            except (EOFError, OSError):
+                break
+            with self.lock:
+                _, future = self._pending.pop(request_id, (None, None))
+            if future is not None:
+                future.set_result(tuple(reply))
+        # the worker is gone: nothing sent over this connection will be answered
+        conn.close()
+        self._fail(conn, ShardError(f"shard {self.shard} exited"))
+
+    def _fail(self, conn, error: Exception):
+        with self.lock:
+            failed = [rid for rid, (c, _) in self._pending.items() if c is conn]
+            futures = [self._pending.pop(rid)[1] for rid in failed]
+        for future in futures:
+            future.set_exception(error)
+
+    def _restart(self):
+        # caller holds the lock; the old reader sees EOF and fails what was sent to the old worker
+        SHARD_RESTARTS.inc()
+        logger.warning("Restarting index shard %d", self.shard)
+        self.process.kill()
+        self.process.join()
+        self._start()
+
+    def restart(self, process=None):
+        """Restart the worker, unless process is given and has already been replaced."""
+        with self.lock:
+            if process is None or process is self.process:
+                conn = self.conn
+                self._restart()
+            else:
+                return
+        self._fail(conn, ShardError(f"shard {self.shard} was restarted"))
+
+    def submit(self, op: str, generation: int, payload) -> Tuple[object, Future]:
+        """Send a request; returns the worker process it went to and the Future of its (status, generation, result)."""
+        future = Future()
+        with self.lock:
+            # the reader closes the connection once the worker is gone
+            if self.conn.closed or not self.process.is_alive():
+                self._restart()
+            request_id = next(self._ids)
+            self._pending[request_id] = (self.conn, future)
+            try:
+                self.conn.send((request_id, op, generation, payload))
+            except (OSError, ValueError) as e:
+                del self._pending[request_id]
+                raise ShardError(f"shard {self.shard}: {e}") from e
+            return self.process, future
+
+    def close(self):
+        with self.lock:
+            try:
+                self.conn.send((None, "stop", None, None))
+            except (OSError, ValueError):
+                pass
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.kill()
+                self.process.join()
+
+
+class ShardPool:
+    """The shard workers of this process, started once and reused by every snapshot."""
+
+    def __init__(self, num_shards: int = INDEX_SHARDS, timeout: float = SHARD_TIMEOUT_S):
+        if num_shards < 2:
+            raise ValueError("a shard pool needs at least 2 shards")
+        self.num_shards = num_shards
+        self.timeout = timeout
+        self._shards = [_LocalShard(k, num_shards) for k in range(num_shards)]
+
+    def scatter(self, op: str, generation: int, payloads: Dict[int, object]) -> Tuple[Dict[int, object], set]:
+        """
+        Send payloads[k] to shard k, all before waiting on any, and gather the
+        replies. Returns ({shard: result}, generations the shards answered from).
+        Concurrent calls interleave on the workers; none waits for another's
+        round trip. A shard that times out is restarted; then, or if a shard
+        dies or reports an error, the call raises ShardError.
+        """
+        sent = {k: self._shards[k].submit(op, generation, payloads[k]) for k in sorted(payloads)}
+        deadline = time.monotonic() + self.timeout
+        replies = {}
+        for k, (process, future) in sent.items():
+            try:
+                replies[k] = future.result(timeout=max(deadline - time.monotonic(), 0.0))
+            except FutureTimeoutError:
+                # a hung worker would hold up every later request too
+                for j, (p, f) in sent.items():
+                    if not f.done():
+                        self._shards[j].restart(p)
+                raise ShardError(f"shard {k} did not answer within {self.timeout}s")
+        for k, (status, _, result) in replies.items():
+            if status != "ok":
+                raise ShardError(f"shard {k}: {result}")
+        return {k: r[2] for k, r in replies.items()}, {r[1] for r in replies.values()}
+
+    def close(self):
+        for s in self._shards:
+            s.close()
+
+
+_POOL: Optional[ShardPool] = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_shard_pool() -> ShardPool:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ShardPool()
+        return _POOL
+
+
+def _merge(lists: Sequence[Sequence[Hit]], top_k: int) -> List[Hit]:
+    """Global top_k of per-shard top_k lists, ties broken by chunk id."""
+    return sorted((h for hits in lists for h in hits), key=lambda h: (-h[1], h[0]))[:top_k]
+
+
+class ShardedRetriever:
+    """
+    Retriever interface (query, query_batch, generation) over a ShardPool.
+    Constructing one loads the current generation in every shard.
+    """
+
+    def __init__(self, pool: ShardPool, generation: int, method: str):
+        self.pool = pool
+        self.method = method
+        self.generation = generation
+        _, self.generation = self._scatter("load", lambda k: None)
+
+    def _scatter(self, op: str, payload, shards: Optional[Sequence[int]] = None):
+        """Scatter to shards (default all); retried once if shards answered from different generations."""
+        shards = range(self.pool.num_shards) if shards is None else shards
+        payloads = {k: payload(k) for k in shards}
+        results, generations = self.pool.scatter(op, self.generation, payloads)
+        if len(generations) > 1:
+            # a publish landed while the shards were loading; bring all up to the newest
+            results, generations = self.pool.scatter(op, max(generations), payloads)
+            if len(generations) > 1:
+                raise ShardError(f"shards serve different index generations: {sorted(generations)}")
+        return results, max(generations) if generations else self.generation
+
+    def query(self, q: str, top_k: int = 3) -> List[Tuple[str, float]]:
+        return self.query_batch([q], top_k)[0]
+
+    def query_batch(self, queries: List[str], top_k: int = 3) -> List[List[Tuple[str, float]]]:
+        if self.method not in ("bm25", "tfidf", "hybrid"):
+            raise ValueError("Unknown method")
+        if not queries:
+            return []
+        q_emb = None
+        if self.method == "hybrid":
+            from app.services.embeddings import get_encoder
+            from app.services.retriever import embed_queries
+            q_emb = embed_queries(get_encoder(), queries)
+
+        with span("query.scatter"):
+            replies, _ = self._scatter("search", lambda k: (queries, q_emb, top_k))
+        per_shard = [replies[k] for k in range(self.pool.num_shards)]
+        lexical = [_merge([r[row][0] for r in per_shard], top_k) for row in range(len(queries))]
+        if q_emb is None:
+            return [[(text, score) for _, score, text, _ in hits] for hits in lexical]
+
+        semantic = [_merge([r[row][1] for r in per_shard], top_k) for row in range(len(queries))]
+        return self._fuse(queries, semantic, lexical, top_k)
+
+    def _fuse(self, queries: List[str], semantic: List[List[Hit]], lexical: List[List[Hit]],
+              top_k: int) -> List[List[Tuple[str, float]]]:
+        from app.services.retriever import fuse
+        n = self.pool.num_shards
+        # BM25 scores of semantic candidates outside the BM25 top_k, from the shards that own them
+        missing: Dict[int, List[List[int]]] = {}
+        for row, (sem, lex) in enumerate(zip(semantic, lexical)):
+            in_top = {h[0] for h in lex}
+            for chunk_id, *_ in sem:
+                if chunk_id not in in_top:
+                    missing.setdefault(chunk_id % n, [[] for _ in queries])[row].append(chunk_id)
+        lex_scores: List[Dict[int, float]] = [{} for _ in queries]
+        if missing:
+            with span("query.scatter"):
+                replies, _ = self._scatter("score", lambda k: (queries, missing[k]), shards=sorted(missing))
+            for k, rows in replies.items():
+                for row, scores in enumerate(rows):
+                    lex_scores[row].update(zip(missing[k][row], scores))
+
+        results = []
+        with span("query.fuse"):
+            for row, (sem, lex) in enumerate(zip(semantic, lexical)):
+                texts = {h[0]: h[2] for h in sem + lex}
+                weights = {h[0]: h[3] for h in sem + lex}
+                fused = fuse([h[0] for h in sem], [h[1] for h in sem], [(h[0], h[1]) for h in lex],
+                             lambda ids, row=row: [lex_scores[row][i] for i in ids], top_k,
+                             weight=lambda i: weights[i])
+                results.append([(texts[i], score) for i, score in fused])
+        return results
@@ -1,39 +1,75 @@
 # app/services/summarizer.py
-from typing import Optional
+from concurrent.futures import Future
+from typing import Callable, Iterator, List, Optional
 import os
-
-# TextRank via sumy
-from sumy.parsers.plaintext import PlaintextParser
-from sumy.nlp.tokenizers import Tokenizer
-from sumy.summarizers.text_rank import TextRankSummarizer
-
-# Transformer pipeline
-from transformers import pipeline, AutoTokenizer, AutoModelForSeq2SeqLM
+import threading
 import logging
 
+from app.services.model_registry import MODELS
+from app.services.summary_pool import (
+    SUMMARY_TIMEOUT_S,
+    SummaryQueueFullError,
+    SummaryStream,
+    get_summary_pool,
+    run_stream,
+)
+from app.tracing import span
+
 logger = logging.getLogger(__name__)
 
-# Lazy-loaded transformer pipeline (only if requested)
-_TRANSFORMER_PIPELINE = None
+# sumy, nltk and transformers are imported by the loaders below, on first use
 _TRANSFORMER_MODEL = os.environ.get("SUMMARIZER_MODEL", "facebook/bart-large-cnn")
 _TRANSFORMER_DEVICE = int(os.environ.get("SUMMARIZER_DEVICE", "-1"))  # -1 = cpu, >=0 gpu index
+# streamed summaries generated at once in this process when there is no summary pool
+SUMMARY_LOCAL_STREAMS = int(os.environ.get("SUMMARY_LOCAL_STREAMS", "1"))
+
+_LOCAL_STREAMS = threading.BoundedSemaphore(max(SUMMARY_LOCAL_STREAMS, 1))
+
+_WARMUP_TEXT = "The model registry loads models before the first request needs them."
+
+
+def _load_transformer_pipeline():
+    from transformers import pipeline
+    logger.info("Loading transformer summarization pipeline: %s", _TRANSFORMER_MODEL)
+    # Auto download model if not present; in production pre-download on build
+    return pipeline(
+        "summarization",
+        model=_TRANSFORMER_MODEL,
+        device=_TRANSFORMER_DEVICE,
+    )
+
+
+def _warm_transformer():
+    # with a summary pool the model lives in the workers, not in this process
+    pool = get_summary_pool()
+    if pool is not None:
+        pool.summarize(_WARMUP_TEXT, max_length=16, min_length=1)
+    else:
+        MODELS.get("summarizer")
+
+
+def _load_textrank_tokenizer():
+    # loads nltk's punkt sentence model
+    from sumy.nlp.tokenizers import Tokenizer
+    return Tokenizer("english")
+
+
+MODELS.register("summarizer", _load_transformer_pipeline, warm=_warm_transformer)
+MODELS.register("textrank", _load_textrank_tokenizer)
 
 
 def _get_transformer_pipeline():
-    global _TRANSFORMER_PIPELINE
-    if _TRANSFORMER_PIPELINE is None:
-        try:
-            logger.info("Loading transformer summarization pipeline: %s", _TRANSFORMER_MODEL)
-            # Auto download model if not present; in production pre-download on build
-            _TRANSFORMER_PIPELINE = pipeline(
-                "summarization",
-                model=_TRANSFORMER_MODEL,
-                device=_TRANSFORMER_DEVICE,
-            )
-        except Exception as e:
-            logger.exception("Failed to load transformer pipeline: %s", e)
-            raise
-    return _TRANSFORMER_PIPELINE
+    return MODELS.get("summarizer")
+
+
+def _textrank_sentences(text: str, sentences_count: int) -> List[str]:
+    if not text or not text.strip():
+        return []
+    from sumy.parsers.plaintext import PlaintextParser
+    from sumy.summarizers.text_rank import TextRankSummarizer
+    parser = PlaintextParser.from_string(text, MODELS.get("textrank"))
+    summarizer = TextRankSummarizer()
+    return [str(s) for s in summarizer(parser.document, sentences_count)]
 
 
 def textrank_summarize(text: str, sentences_count: int = 3) -> str:
@@ -41,32 +77,144 @@ def textrank_summarize(text: str, sentences_count: int = 3) -> str:
     Extractive summarization using TextRank via sumy.
     Returns the top `sentences_count` sentences concatenated.
     """
-    if not text or not text.strip():
-        return ""
-    parser = PlaintextParser.from_string(text, Tokenizer("english"))
-    summarizer = TextRankSummarizer()
     # sumy returns sentence objects; join them with spaces
-    sentences = summarizer(parser.document, sentences_count)
-    return " ".join(str(s) for s in sentences)
+    return " ".join(_textrank_sentences(text, sentences_count))
+
+
+def _encode(pipe, texts: List[str]):
+    """Tokenize once, truncated to the model's max position embeddings and padded to the longest text."""
+    max_pos = getattr(pipe.model.config, "max_position_embeddings", None) or 1024
+    # reserve some room for decoder/extra tokens
+    return pipe.tokenizer(texts, truncation=True, max_length=max_pos - 10, padding=True,
+                          return_tensors="pt").to(pipe.model.device)
+
+
+def transformer_summarize_batch(texts: List[str], max_length: int = 200, min_length: int = 50) -> List[str]:
+    """Summaries of several texts from one padded generate() call (the summary pool's worker step)."""
+    import torch
+    pipe = _get_transformer_pipeline()
+    with torch.no_grad():
+        output_ids = pipe.model.generate(**_encode(pipe, texts), max_length=max_length, min_length=min_length,
+                                         do_sample=False)
+    return pipe.tokenizer.batch_decode(output_ids, skip_special_tokens=True, clean_up_tokenization_spaces=True)
 
 
 def transformer_summarize(text: str, max_length: int = 200, min_length: int = 50) -> str:
+    """
+    Abstractive summary. Runs in the summary pool (worker processes or the
+    shared service, see summary_pool.py) unless that is disabled.
+    """
     if not text or not text.strip():
         return ""
+    pool = get_summary_pool()
+    if pool is not None:
+        return pool.summarize(text, max_length=max_length, min_length=min_length)
+    return transformer_summarize_batch([text], max_length=max_length, min_length=min_length)[0]
+
+
+def _threaded_stream(generate: Callable[[threading.Event], None], streamer) -> Iterator[str]:
+    """
+    Run generate(cancelled) in a thread and yield the non-empty text pieces it
+    puts on streamer. If generate raises, the error is raised here once the
+    pieces it produced are drained; closing the iterator sets cancelled and
+    waits for the thread.
+    """
+    cancelled = threading.Event()
+    errors: List[Exception] = []
+
+    def run():
+        try:
+            generate(cancelled)
+        except Exception as e:
+            errors.append(e)
+            streamer.end()  # generate() never got to end the stream; unblock the consumer
+
+    thread = threading.Thread(target=run, name="summarize-stream", daemon=True)
+    thread.start()
+    try:
+        for piece in streamer:
+            if piece:
+                yield piece
+    finally:
+        cancelled.set()
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+def transformer_generate_stream(text: str, max_length: int = 200, min_length: int = 50) -> Iterator[str]:
+    """
+    Abstractive summary from this process's model, yielding decoded text
+    pieces as the model generates them (the summary pool's streaming worker
+    step). Streaming decodes greedily (transformers streamers do not support
+    beam search), so the summary can differ slightly from the non-streaming one.
+    Generation stops early if the consumer closes the iterator, and an error in
+    generate() is raised to the consumer after the pieces produced before it.
+    """
+    if not text or not text.strip():
+        return
+    import torch
+    from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
     pipe = _get_transformer_pipeline()
-    # safe truncate to model's max position embeddings
-    tokenizer = pipe.tokenizer
-    model = pipe.model
-    max_pos = getattr(model.config, "max_position_embeddings", None) or 1024
-    # reserve some room for decoder/extra tokens
-    safe_max_tokens = max_pos - 10
-    inputs = tokenizer(text, return_tensors="pt", truncation=False)
-    input_ids = inputs["input_ids"][0]
-    if input_ids.size(0) > safe_max_tokens:
-        input_ids = input_ids[:safe_max_tokens]
-        text = tokenizer.decode(input_ids, skip_special_tokens=True, clean_up_tokenization_spaces=True)
-    summary_list = pipe(text, max_length=max_length, min_length=min_length, do_sample=False)
-    return summary_list[0].get("summary_text", "")
+    tokenizer, model = pipe.tokenizer, pipe.model
+    inputs = _encode(pipe, [text])
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+
+    def generate(cancelled: threading.Event):
+        class _Cancelled(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                return torch.full((input_ids.shape[0],), cancelled.is_set(), dtype=torch.bool,
+                                  device=input_ids.device)
+
+        with torch.no_grad():
+            model.generate(**inputs, streamer=streamer, max_length=max_length, min_length=min_length,
+                           num_beams=1, do_sample=False, stopping_criteria=StoppingCriteriaList([_Cancelled()]))
+
+    yield from _threaded_stream(generate, streamer)
+
+
+def _local_stream(text: str, max_length: int, min_length: int) -> SummaryStream:
+    """transformer_generate_stream in a thread of this process, at most SUMMARY_LOCAL_STREAMS at once."""
+    if not _LOCAL_STREAMS.acquire(blocking=False):
+        raise SummaryQueueFullError(f"{SUMMARY_LOCAL_STREAMS} summaries are already streaming in this process")
+
+    def submit(on_piece) -> Future:
+        future: Future = Future()
+
+        def run():
+            try:
+                outcome = run_stream(transformer_generate_stream, text, max_length, min_length, on_piece,
+                                     future.cancelled)
+            except Exception as e:
+                outcome = e
+            finally:
+                _LOCAL_STREAMS.release()
+            if not future.set_running_or_notify_cancel():
+                return
+            if isinstance(outcome, Exception):
+                future.set_exception(outcome)
+            else:
+                future.set_result(outcome)
+
+        threading.Thread(target=run, name="summarize-stream-local", daemon=True).start()
+        return future
+
+    return SummaryStream(submit, SUMMARY_TIMEOUT_S)
+
+
+def transformer_summarize_stream(text: str, max_length: int = 200, min_length: int = 50) -> SummaryStream:
+    """
+    transformer_summarize as a SummaryStream of decoded pieces. Generated by a
+    summary pool worker (one model copy per worker, queued like any other
+    summary) unless the pool is disabled; then in this process, with at most
+    SUMMARY_LOCAL_STREAMS generations at once. Raises SummaryQueueFullError
+    when the queue or the local slots are full.
+    """
+    pool = get_summary_pool()
+    if pool is not None:
+        return pool.stream(text, max_length=max_length, min_length=min_length)
+    return _local_stream(text, max_length, min_length)
 
 
 def summarize(
@@ -84,7 +232,31 @@ def summarize(
     if method == "transformer":
         _max = max_length or 200
         _min = min_length or 50
-        return transformer_summarize(text, max_length=_max, min_length=_min)
+        with span("summarize.transformer"):
+            return transformer_summarize(text, max_length=_max, min_length=_min)
     else:
         _sent = int(sentences_count or 3)
-        return textrank_summarize(text, sentences_count=_sent)
\ No newline at end of file
+        with span("summarize.textrank"):
+            return textrank_summarize(text, sentences_count=_sent)
+
+
+def summarize_stream(
+    text: str,
+    method: str = "textrank",
+    sentences_count: Optional[int] = None,
+    max_length: Optional[int] = None,
+    min_length: Optional[int] = None,
+) -> Iterator[str]:
+    """
+    summarize() as a stream of text pieces that concatenate to the summary:
+    generated tokens for 'transformer', one sentence at a time for 'textrank'.
+    """
+    method = (method or "textrank").lower()
+    if method == "transformer":
+        with span("summarize.transformer"):
+            yield from transformer_summarize_stream(text, max_length=max_length or 200, min_length=min_length or 50)
+    else:
+        with span("summarize.textrank"):
+            sentences = _textrank_sentences(text, int(sentences_count or 3))
+        for i, sentence in enumerate(sentences):
+            yield sentence if i == 0 else " " + sentence
\ No newline at end of file
@@ -0,0 +1,619 @@
+"""
+Transformer summarization in dedicated worker processes with micro-batching.
+
+SummaryPool starts SUMMARY_WORKERS spawn processes, each holding one copy of
+the summarization model. Requests go through one bounded queue; a worker that
+takes a request keeps collecting more for up to SUMMARY_BATCH_WINDOW_MS (or
+until SUMMARY_MAX_BATCH) and summarizes them as one padded batch, so
+concurrent queries share a generate() call instead of competing for the CPU
+one by one. When SUMMARY_QUEUE_SIZE requests are already waiting, submit()
+raises SummaryQueueFullError and the caller falls back (TextRank) rather than
+queueing unbounded work. A worker that dies fails the requests it was running
+and is replaced.
+
+stream() runs one request on a worker by itself and hands back the decoded
+pieces as the model produces them (SummaryStream), for /query/stream; the
+model stays in the workers and streams share the same bounded queue.
+
+Cancelling a request's Future (e.g. a caller that gave up waiting) marks its
+id in an array shared with the workers, which drop cancelled requests from
+every batch before running it, so abandoned work is not computed; a stream
+being generated stops at its next piece.
+
+With several uvicorn workers, run one shared service instead of a pool per
+API process:
+
+    python -m app.services.summary_pool --listen 127.0.0.1:8790 --workers 2
+
+and point the API at it with SUMMARY_SERVICE_ADDRESS=127.0.0.1:8790 (or a
+Unix socket path); RemoteSummaryPool then forwards requests over a
+multiprocessing connection authenticated with SUMMARY_SERVICE_AUTHKEY.
+SUMMARY_WORKERS=0 and no service address keep the model in the API process.
+"""
+import os
+import time
+import atexit
+import queue
+import logging
+import argparse
+import importlib
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from multiprocessing.connection import Client, Listener, wait
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
+
+from app.services.model_registry import MODEL_WARMUP
+from app.tracing import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_WORKERS = int(os.environ.get("SUMMARY_WORKERS", "1"))
+SUMMARY_MAX_BATCH = int(os.environ.get("SUMMARY_MAX_BATCH", "8"))
+SUMMARY_BATCH_WINDOW_MS = int(os.environ.get("SUMMARY_BATCH_WINDOW_MS", "10"))
+SUMMARY_QUEUE_SIZE = int(os.environ.get("SUMMARY_QUEUE_SIZE", "64"))
+SUMMARY_TIMEOUT_S = float(os.environ.get("SUMMARY_TIMEOUT_S", "120"))
+# torch threads per worker process (0 = torch default)
+SUMMARY_TORCH_THREADS = int(os.environ.get("SUMMARY_TORCH_THREADS", "0"))
+SUMMARY_SERVICE_ADDRESS = os.environ.get("SUMMARY_SERVICE_ADDRESS", "")
+SUMMARY_SERVICE_AUTHKEY = os.environ.get("SUMMARY_SERVICE_AUTHKEY", "summary-pool").encode()
+# workers load the model when they start (and when replaced) rather than on their first batch
+SUMMARY_WARMUP = "summarizer" in MODEL_WARMUP or "all" in MODEL_WARMUP
+
+# "module:function" summarizing a list of texts; run inside the workers
+DEFAULT_BATCH_FN = "app.services.summarizer:transformer_summarize_batch"
+# "module:function" yielding the summary of one text in pieces; run inside the workers
+DEFAULT_STREAM_FN = "app.services.summarizer:transformer_generate_stream"
+
+SUMMARY_BATCHES = Histogram("summary_batch_size", "Requests per summarization batch.", buckets=(1, 2, 4, 8, 16, 32, 64))
+SUMMARY_REJECTED = Counter("summary_rejected_total", "Summarization requests rejected because the queue was full.")
+SUMMARY_WORKER_RESTARTS = Counter("summary_worker_restarts_total", "Summarization worker processes replaced after dying.")
+
+# (request id, text, max_length, min_length, stream)
+Request = Tuple[int, str, int, int, bool]
+
+
+class SummaryQueueFullError(Exception):
+    """Raised by submit when SUMMARY_QUEUE_SIZE requests are already waiting."""
+
+
+class SummaryWorkerError(RuntimeError):
+    """A summarization worker failed or died while running the request."""
+
+
+def _cancelled_slots(queue_size: int, in_flight: int) -> int:
+    # a slot is reused only by an id that many requests later, long after the first has left the queue
+    return max(4 * (queue_size + in_flight), 1024)
+
+
+def _is_cancelled(cancelled, req_id: int) -> bool:
+    return cancelled[req_id % len(cancelled)] == req_id
+
+
+def run_stream(stream_fn: Callable[[str, int, int], Iterator[str]], text: str, max_length: int, min_length: int,
+               on_piece: Callable[[str], None], cancelled: Callable[[], bool]) -> str:
+    """Pass each piece of stream_fn's summary to on_piece until cancelled(); returns the pieces joined."""
+    pieces = []
+    stream = stream_fn(text, max_length, min_length)
+    try:
+        for piece in stream:
+            if cancelled():
+                break
+            pieces.append(piece)
+            on_piece(piece)
+    finally:
+        # stops the generation behind it
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+    return "".join(pieces)
+
+
+_END = object()
+
+
+class SummaryStream:
+    """
+    Pieces of one streamed summary, in order, as the request produces them.
+    Iterating waits up to timeout for each piece and raises the request's
+    error at the end; next() takes its own timeout. close(), or abandoning
+    the iteration, cancels the request.
+    """
+
+    def __init__(self, submit: Callable[[Callable[[str], None]], Future], timeout: Optional[float] = SUMMARY_TIMEOUT_S):
+        self.timeout = timeout
+        self._pieces: "queue.Queue" = queue.Queue()
+        # submit(on_piece) starts the request; every piece is delivered before the Future resolves
+        self.future = submit(self._pieces.put)
+        self.future.add_done_callback(lambda f: self._pieces.put(_END))
+
+    def next(self, timeout: Optional[float] = None) -> Optional[str]:
+        """The next piece, or None once the summary is complete. Raises FutureTimeoutError after timeout."""
+        try:
+            piece = self._pieces.get(timeout=timeout)
+        except queue.Empty:
+            raise FutureTimeoutError(f"no summary output within {timeout}s") from None
+        if piece is _END:
+            self._pieces.put(_END)
+            self.future.result(timeout=0)  # raises the request's error
+            return None
+        return piece
+
+    def __iter__(self) -> Iterator[str]:
+        try:
+            while (piece := self.next(self.timeout)) is not None:
+                yield piece
+        finally:
+            self.close()
+
+    def close(self):
+        self.future.cancel()
+
+
+# --- worker process ----------------------------------------------------------------
+
+def _load_batch_fn(path: str) -> Callable:
+    module, name = path.split(":")
+    return getattr(importlib.import_module(module), name)
+
+
+def _next_batch(requests, max_batch: int, window_s: float, held: List[Request]) -> Tuple[List[Request], bool]:
+    """
+    Block for one request (or take the one held back), then gather more for
+    up to window_s. Returns (batch, stop). A stream is a batch of its own:
+    one that turns up while gathering is put back for an idle worker, or
+    held for this worker's next batch if the queue has filled up meanwhile.
+    """
+    first = held.pop() if held else requests.get()
+    if first is None:
+        return [], True
+    if first[4]:
+        return [first], False
+    batch, deadline = [first], time.monotonic() + window_s
+    while len(batch) < max_batch:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            item = requests.get(timeout=remaining)
+        except queue.Empty:
+            break
+        if item is None:
+            return batch, True
+        if item[4]:
+            try:
+                requests.put_nowait(item)
+            except queue.Full:
+                held.append(item)
+            break
+        batch.append(item)
+    return batch, False
+
+
+def _work(requests, results, cancelled, batch_fn: str, stream_fn: str, max_batch: int, window_s: float,
+          torch_threads: int, warm: bool = False):
+    if torch_threads > 0:
+        try:
+            import torch
+            torch.set_num_threads(torch_threads)
+        except ImportError:
+            pass
+    summarize_batch = _load_batch_fn(batch_fn)
+    summarize_stream = _load_batch_fn(stream_fn)
+    if warm:
+        try:
+            summarize_batch(["Warm-up."], 16, 1)
+        except Exception:
+            logger.exception("Summarization worker warm-up failed")
+    stop, held = False, []
+    while not stop:
+        batch, stop = _next_batch(requests, max_batch, window_s, held)
+        # requests whose callers stopped waiting are dropped unanswered
+        batch = [r for r in batch if not _is_cancelled(cancelled, r[0])]
+        if not batch:
+            continue
+        # Pipe sends are synchronous: if this process dies mid-batch the pool knows what it held
+        results.send(("started", [r[0] for r in batch]))
+        if batch[0][4]:
+            # a stream has the worker to itself, each piece sent as it is decoded
+            results.send(("done", [_stream_reply(summarize_stream, batch[0], results, cancelled)], 1, []))
+            continue
+        # generation settings differ per request only through the length bounds
+        groups: Dict[Tuple[int, int], List[Request]] = {}
+        for r in batch:
+            groups.setdefault((r[2], r[3]), []).append(r)
+        for (max_length, min_length), group in groups.items():
+            # cancelled while an earlier group was generating
+            dropped = [r for r in group if _is_cancelled(cancelled, r[0])]
+            if dropped:
+                group = [r for r in group if r not in dropped]
+                results.send(("done", [], 0, [r[0] for r in dropped]))
+                if not group:
+                    continue
+            try:
+                summaries = summarize_batch([r[1] for r in group], max_length, min_length)
+                replies = [(r[0], True, s) for r, s in zip(group, summaries)]
+            except Exception as e:
+                logger.exception("Summarization batch of %d failed", len(group))
+                replies = [(r[0], False, f"{type(e).__name__}: {e}") for r in group]
+            results.send(("done", replies, len(group), []))
+
+
+def _stream_reply(summarize_stream, request: Request, results, cancelled) -> Tuple[int, bool, str]:
+    req_id = request[0]
+    try:
+        summary = run_stream(summarize_stream, request[1], request[2], request[3],
+                             lambda piece: results.send(("piece", req_id, piece)),
+                             lambda: _is_cancelled(cancelled, req_id))
+    except Exception as e:
+        logger.exception("Streamed summarization failed")
+        return req_id, False, f"{type(e).__name__}: {e}"
+    return req_id, True, summary
+
+
+# --- API process -------------------------------------------------------------------
+
+def _result(future: Future, timeout: Optional[float]) -> str:
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        future.cancel()  # workers drop it unless one is already generating it
+        raise
+
+
+class SummaryPool:
+    """Worker processes fed from one bounded request queue; submit() returns a Future."""
+
+    def __init__(self, workers: int = SUMMARY_WORKERS, max_batch: int = SUMMARY_MAX_BATCH,
+                 window_ms: int = SUMMARY_BATCH_WINDOW_MS, queue_size: int = SUMMARY_QUEUE_SIZE,
+                 batch_fn: str = DEFAULT_BATCH_FN, stream_fn: str = DEFAULT_STREAM_FN,
+                 torch_threads: int = SUMMARY_TORCH_THREADS, warm: bool = SUMMARY_WARMUP):
+        if workers < 1:
+            raise ValueError("a summary pool needs at least one worker")
+        self._ctx = multiprocessing.get_context("spawn")
+        self._requests = self._ctx.Queue(maxsize=queue_size)
+        # slot id % len holds the id of a cancelled request; written here, read by the workers
+        self._cancelled = self._ctx.Array("q", _cancelled_slots(queue_size, workers * max_batch), lock=False)
+        self._cancelled[:] = [-1] * len(self._cancelled)
+        self._args = (batch_fn, stream_fn, max_batch, window_ms / 1000, torch_threads, warm)
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._pending: Dict[int, Future] = {}
+        # request id -> on_piece callback of a streamed request
+        self._streams: Dict[int, Callable[[str], None]] = {}
+        self._closed = False
+        # worker process -> (its result pipe, request ids it is running)
+        self._workers: Dict[object, Tuple[object, Set[int]]] = dict(self._start_worker() for _ in range(workers))
+        self._collector = threading.Thread(target=self._collect, name="summary-pool-results", daemon=True)
+        self._collector.start()
+
+    def _start_worker(self):
+        reader, writer = self._ctx.Pipe(duplex=False)
+        p = self._ctx.Process(target=_work, args=(self._requests, writer, self._cancelled) + self._args,
+                              name="summary-worker", daemon=True)
+        p.start()
+        writer.close()
+        return p, (reader, set())
+
+    def submit(self, text: str, max_length: int = 200, min_length: int = 50,
+               on_piece: Optional[Callable[[str], None]] = None) -> Future:
+        """Queue a summary; with on_piece it is streamed, and on_piece gets every piece before the Future resolves."""
+        if self._closed:
+            raise RuntimeError("summary pool is closed")
+        future: Future = Future()
+        req_id = next(self._ids)
+        with self._lock:
+            self._pending[req_id] = future
+            if on_piece is not None:
+                self._streams[req_id] = on_piece
+        try:
+            self._requests.put_nowait((req_id, text, max_length, min_length, on_piece is not None))
+        except queue.Full:
+            with self._lock:
+                self._pending.pop(req_id, None)
+                self._streams.pop(req_id, None)
+            SUMMARY_REJECTED.inc()
+            raise SummaryQueueFullError("summarization queue is full")
+        future.add_done_callback(lambda f, req_id=req_id: f.cancelled() and self._cancel(req_id))
+        return future
+
+    def _cancel(self, req_id: int):
+        with self._lock:
+            self._streams.pop(req_id, None)
+            if self._pending.pop(req_id, None) is not None:
+                self._cancelled[req_id % len(self._cancelled)] = req_id
+
+    def summarize(self, text: str, max_length: int = 200, min_length: int = 50,
+                  timeout: Optional[float] = SUMMARY_TIMEOUT_S) -> str:
+        return _result(self.submit(text, max_length, min_length), timeout)
+
+    def stream(self, text: str, max_length: int = 200, min_length: int = 50,
+               timeout: Optional[float] = SUMMARY_TIMEOUT_S) -> SummaryStream:
+        return SummaryStream(lambda on_piece: self.submit(text, max_length, min_length, on_piece), timeout)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def _collect(self):
+        while not self._closed:
+            readers = {reader: p for p, (reader, _) in self._workers.items()}
+            for reader in wait(list(readers), timeout=1.0):
+                p = readers[reader]
+                try:
+                    message = reader.recv()
+                except (EOFError, OSError):
+                    self._replace(p)
+                    continue
+                running = self._workers[p][1]
+                if message[0] == "started":
+                    running.update(message[1])
+                    continue
+                if message[0] == "piece":
+                    with self._lock:
+                        on_piece = self._streams.get(message[1])
+                    if on_piece is not None:
+                        on_piece(message[2])
+                    continue
+                replies, batch_size, dropped = message[1], message[2], message[3]
+                running.difference_update(dropped)
+                if batch_size:
+                    SUMMARY_BATCHES.observe(batch_size)
+                for req_id, ok, value in replies:
+                    running.discard(req_id)
+                    self._resolve(req_id, value if ok else SummaryWorkerError(value))
+
+    def _resolve(self, req_id: int, outcome):
+        with self._lock:
+            future = self._pending.pop(req_id, None)
+            self._streams.pop(req_id, None)
+        if future is None or not future.set_running_or_notify_cancel():
+            return
+        if isinstance(outcome, Exception):
+            future.set_exception(outcome)
+        else:
+            future.set_result(outcome)
+
+    def _replace(self, p):
+        reader, running = self._workers.pop(p)
+        reader.close()
+        p.join(timeout=5)
+        if self._closed:
+            return
+        for req_id in running:
+            self._resolve(req_id, SummaryWorkerError(f"summarization worker exited with {p.exitcode}"))
+        logger.warning("Summarization worker %s exited with %s; starting a new one", p.pid, p.exitcode)
+        SUMMARY_WORKER_RESTARTS.inc()
+        worker, state = self._start_worker()
+        self._workers[worker] = state
+
+    def close(self):
+        self._closed = True
+        for _ in self._workers:
+            try:
+                self._requests.put(None, timeout=1)
+            except queue.Full:
+                break
+        for p in list(self._workers):
+            p.join(timeout=5)
+            if p.is_alive():
+                p.kill()
+        with self._lock:
+            pending, self._pending = list(self._pending.values()), {}
+        for future in pending:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(RuntimeError("summary pool closed"))
+
+
+def _parse_address(address: str) -> Union[str, Tuple[str, int]]:
+    host, sep, port = address.rpartition(":")
+    return (host, int(port)) if sep and port.isdigit() else address
+
+
+class SummaryServer:
+    """Serves a SummaryPool to RemoteSummaryPool clients (e.g. every uvicorn worker)."""
+
+    def __init__(self, pool: SummaryPool, address: str, authkey: bytes = SUMMARY_SERVICE_AUTHKEY):
+        self.pool = pool
+        self._listener = Listener(_parse_address(address), authkey=authkey)
+        self.address = self._listener.address
+
+    def serve_forever(self):
+        while True:
+            try:
+                conn = self._listener.accept()
+            except (OSError, EOFError):
+                return  # listener closed
+            except Exception:
+                logger.exception("Rejected summary service connection")
+                continue
+            threading.Thread(target=self._serve, args=(conn,), name="summary-service-conn", daemon=True).start()
+
+    def _serve(self, conn):
+        send_lock = threading.Lock()
+        # this client's requests still running in the pool, so it can cancel them
+        futures: Dict[int, Future] = {}
+
+        def reply(message):
+            with send_lock:
+                try:
+                    conn.send(message)
+                except (OSError, ValueError):
+                    pass  # client went away
+
+        def on_done(req_id, future):
+            futures.pop(req_id, None)
+            if future.cancelled():
+                return
+            error = future.exception()
+            reply((req_id, "ok", future.result()) if error is None else (req_id, "error", str(error)))
+
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                conn.close()
+                # nobody is left to read these answers
+                for future in list(futures.values()):
+                    future.cancel()
+                return
+            if message[0] == "cancel":
+                future = futures.get(message[1])
+                if future is not None:
+                    future.cancel()
+                continue
+            req_id, text, max_length, min_length, stream = message
+            on_piece = (lambda piece, req_id=req_id: reply((req_id, "piece", piece))) if stream else None
+            try:
+                future = self.pool.submit(text, max_length, min_length, on_piece)
+            except SummaryQueueFullError as e:
+                reply((req_id, "full", str(e)))
+                continue
+            futures[req_id] = future
+            future.add_done_callback(lambda f, req_id=req_id: on_done(req_id, f))
+
+    def close(self):
+        self._listener.close()
+
+
+class RemoteSummaryPool:
+    """SummaryPool interface backed by a SummaryServer; reconnects after the connection drops."""
+
+    def __init__(self, address: str = SUMMARY_SERVICE_ADDRESS, authkey: bytes = SUMMARY_SERVICE_AUTHKEY):
+        self._address = _parse_address(address)
+        self._authkey = authkey
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._pending: Dict[int, Future] = {}
+        self._streams: Dict[int, Callable[[str], None]] = {}
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = Client(self._address, authkey=self._authkey)
+            threading.Thread(target=self._read, args=(self._conn,), name="summary-service-client",
+                             daemon=True).start()
+        return self._conn
+
+    def submit(self, text: str, max_length: int = 200, min_length: int = 50,
+               on_piece: Optional[Callable[[str], None]] = None) -> Future:
+        future: Future = Future()
+        req_id = next(self._ids)
+        with self._lock:
+            self._pending[req_id] = future
+            if on_piece is not None:
+                self._streams[req_id] = on_piece
+            try:
+                self._connection().send((req_id, text, max_length, min_length, on_piece is not None))
+            except (OSError, EOFError) as e:
+                self._pending.pop(req_id, None)
+                self._streams.pop(req_id, None)
+                self._conn = None
+                raise SummaryWorkerError(f"summary service unavailable: {e}") from e
+        future.add_done_callback(lambda f, req_id=req_id: f.cancelled() and self._cancel(req_id))
+        return future
+
+    def _cancel(self, req_id: int):
+        with self._lock:
+            self._streams.pop(req_id, None)
+            if self._pending.pop(req_id, None) is None or self._conn is None:
+                return
+            try:
+                self._conn.send(("cancel", req_id))
+            except (OSError, EOFError):
+                pass  # the reader notices the lost connection
+
+    def summarize(self, text: str, max_length: int = 200, min_length: int = 50,
+                  timeout: Optional[float] = SUMMARY_TIMEOUT_S) -> str:
+        return _result(self.submit(text, max_length, min_length), timeout)
+
+    def stream(self, text: str, max_length: int = 200, min_length: int = 50,
+               timeout: Optional[float] = SUMMARY_TIMEOUT_S) -> SummaryStream:
+        return SummaryStream(lambda on_piece: self.submit(text, max_length, min_length, on_piece), timeout)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def _read(self, conn):
+        while True:
+            try:
+                req_id, status, value = conn.recv()
+            except (EOFError, OSError):
+                break
+            if status == "piece":
+                with self._lock:
+                    on_piece = self._streams.get(req_id)
+                if on_piece is not None:
+                    on_piece(value)
+                continue
+            with self._lock:
+                future = self._pending.pop(req_id, None)
+                self._streams.pop(req_id, None)
+            if future is None or not future.set_running_or_notify_cancel():
+                continue
+            if status == "ok":
+                future.set_result(value)
+            elif status == "full":
+                future.set_exception(SummaryQueueFullError(value))
+            else:
+                future.set_exception(SummaryWorkerError(value))
+        with self._lock:
+            if self._conn is conn:
+                self._conn = None
+            lost = [f for f in self._pending.values()]
+            self._pending, self._streams = {}, {}
+        for future in lost:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(SummaryWorkerError("summary service connection lost"))
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_summary_pool() -> Optional[Union[SummaryPool, RemoteSummaryPool]]:
+    """The process-wide pool (started on first use), or None to summarize in-process."""
+    global _POOL
+    if _POOL is None and (SUMMARY_SERVICE_ADDRESS or SUMMARY_WORKERS > 0):
+        with _POOL_LOCK:
+            if _POOL is None:
+                _POOL = RemoteSummaryPool() if SUMMARY_SERVICE_ADDRESS else SummaryPool()
+                # before multiprocessing's own exit hook terminates the workers, which
+                # the pool would otherwise take for crashes and replace
+                atexit.register(_POOL.close)
+    return _POOL
+
+
+Gauge("summary_pending", "Summarization requests submitted and not yet answered.",
+      lambda: _POOL.pending() if _POOL is not None else None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shared summarization service for the API workers.")
+    parser.add_argument("--listen", default=SUMMARY_SERVICE_ADDRESS or "127.0.0.1:8790",
+                        help="host:port or Unix socket path")
+    parser.add_argument("--workers", type=int, default=max(SUMMARY_WORKERS, 1))
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    pool = SummaryPool(workers=args.workers)
+    server = SummaryServer(pool, args.listen)
+    logger.info("Summary service on %s with %d workers", server.address, args.workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+FAISS index construction for hybrid segments.
+
+Every segment's vectors live in an IndexIDMap keyed by SQLite chunk id, so
+search results map straight back to chunks and vectors can be added or removed
+without renumbering. The underlying index type is picked from the segment size:
+
+  flat      exact inner product, fine for small segments
+  hnsw      graph search, good recall/latency for mid-size segments
+  ivf_flat  inverted lists over a trained coarse quantizer
+  ivf_pq    IVF with product-quantized codes for very large segments
+
+VECTOR_INDEX_TYPE forces one type; VECTOR_INDEX_NPROBE and VECTOR_INDEX_EF_SEARCH
+tune the IVF and HNSW search breadth. All indexes use inner product on
+L2-normalized vectors, i.e. cosine similarity, like the original IndexFlatIP.
+
+VECTOR_QUANTIZATION stores the vectors inside the index as compact codes:
+
+  none  float32 (4 bytes/dim)
+  fp16  half precision (2 bytes/dim)
+  sq8   8-bit scalar quantization (1 byte/dim)
+  pq    product quantization (1 byte per 4 dims)
+
+Lossy codes are only used for the first stage: search() over-fetches
+k * VECTOR_RERANK_FACTOR candidates and rescores them exactly against the
+float32 vectors in the segment's memory-mapped embeddings.npy, so returned
+scores are true cosine similarities and only shortlisted rows are paged in.
+"""
+import os
+import math
+import time
+import logging
+from typing import Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+VECTOR_INDEX_TYPE = os.environ.get("VECTOR_INDEX_TYPE", "auto")
+VECTOR_INDEX_NPROBE = int(os.environ.get("VECTOR_INDEX_NPROBE", "16"))
+VECTOR_INDEX_EF_SEARCH = int(os.environ.get("VECTOR_INDEX_EF_SEARCH", "64"))
+VECTOR_QUANTIZATION = os.environ.get("VECTOR_QUANTIZATION", "none")
+VECTOR_RERANK_FACTOR = int(os.environ.get("VECTOR_RERANK_FACTOR", "4"))
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+QUANTIZATIONS = ("none", "fp16", "sq8", "pq")
+
+# auto selection: largest segment size served by each type
+FLAT_MAX_VECTORS = 20_000
+HNSW_MAX_VECTORS = 500_000
+IVF_FLAT_MAX_VECTORS = 5_000_000
+
+HNSW_M = 32
+# training points per IVF centroid, and the minimum for a usable quantizer
+_IVF_POINTS_PER_LIST = 39
+_IVF_MIN_TRAIN = 1_000
+# rows per block when evaluate_against_flat() scans the vectors for exact neighbours
+_EXACT_BLOCK_ROWS = 16_384
+
+
+def _faiss():
+    try:
+        import faiss
+    except Exception as e:
+        raise RuntimeError("faiss (faiss-cpu or faiss-gpu) is required for hybrid mode.") from e
+    return faiss
+
+
+def choose_index_type(num_vectors: int, requested: Optional[str] = None) -> str:
+    """Index type for a segment of num_vectors vectors ("auto" picks by size)."""
+    requested = requested or VECTOR_INDEX_TYPE
+    if requested != "auto":
+        if requested not in INDEX_TYPES:
+            raise ValueError(f"Unsupported vector index type: {requested}")
+        kind = requested
+    elif num_vectors <= FLAT_MAX_VECTORS:
+        kind = "flat"
+    elif num_vectors <= HNSW_MAX_VECTORS:
+        kind = "hnsw"
+    elif num_vectors <= IVF_FLAT_MAX_VECTORS:
+        kind = "ivf_flat"
+    else:
+        kind = "ivf_pq"
+    # IVF needs enough points to train its quantizer
+    if kind.startswith("ivf") and num_vectors < _IVF_MIN_TRAIN:
+        kind = "flat"
+    return kind
+
+
+def choose_quantization(num_vectors: int, kind: str, requested: Optional[str] = None) -> str:
+    """Vector code format for an index of the given type ("none" keeps float32)."""
+    requested = requested or VECTOR_QUANTIZATION
+    if requested not in QUANTIZATIONS:
+        raise ValueError(f"Unsupported vector quantization: {requested}")
+    if kind == "ivf_pq":
+        return "pq"
+    # PQ codebooks need a few hundred points per sub-quantizer to train
+    if requested == "pq" and num_vectors < _IVF_MIN_TRAIN:
+        return "sq8"
+    return requested
+
+
+def _nlist(num_vectors: int) -> int:
+    return max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // _IVF_POINTS_PER_LIST))
+
+
+def _pq_subquantizers(dim: int) -> int:
+    """Largest divisor of dim that gives sub-vectors of at least 4 dimensions."""
+    for m in range(max(1, dim // 4), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def factory_string(kind: str, num_vectors: int, dim: int, quantization: str = "none") -> str:
+    codes = {
+        "none": "Flat",
+        "fp16": "SQfp16",
+        "sq8": "SQ8",
+        "pq": f"PQ{_pq_subquantizers(dim)}",
+    }[quantization]
+    if kind == "flat":
+        return codes
+    if kind == "hnsw":
+        return f"HNSW{HNSW_M},{codes}"
+    if kind == "ivf_flat":
+        return f"IVF{_nlist(num_vectors)},{codes}"
+    if kind == "ivf_pq":
+        return f"IVF{_nlist(num_vectors)},PQ{_pq_subquantizers(dim)}"
+    raise ValueError(f"Unsupported vector index type: {kind}")
+
+
+def build_vector_index(embeddings: np.ndarray, ids: Sequence[int], kind: str = "auto",
+                       quantization: Optional[str] = None):
+    """
+    Build an IndexIDMap over normalized embeddings with ids as the external ids.
+    Returns (index, kind, quantization).
+    """
+    faiss = _faiss()
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    num_vectors, dim = embeddings.shape
+    kind = choose_index_type(num_vectors, None if kind == "auto" else kind)
+    quantization = choose_quantization(num_vectors, kind, quantization)
+    inner = faiss.index_factory(dim, factory_string(kind, num_vectors, dim, quantization),
+                                faiss.METRIC_INNER_PRODUCT)
+    if not inner.is_trained:
+        inner.train(_training_sample(embeddings, kind))
+    index = faiss.IndexIDMap(inner)
+    add_vectors(index, embeddings, ids)
+    configure_search(index)
+    return index, kind, quantization
+
+
+def index_bytes(index) -> int:
+    """Serialized size of an index, i.e. roughly what it keeps resident."""
+    return int(_faiss().serialize_index(index).nbytes)
+
+
+def _training_sample(embeddings: np.ndarray, kind: str, seed: int = 0) -> np.ndarray:
+    num_vectors = embeddings.shape[0]
+    limit = max(256 * _nlist(num_vectors), _IVF_POINTS_PER_LIST * 256)
+    if num_vectors <= limit:
+        return embeddings
+    rows = np.random.default_rng(seed).choice(num_vectors, size=limit, replace=False)
+    return embeddings[np.sort(rows)]
+
+
+def add_vectors(index, embeddings: np.ndarray, ids: Sequence[int]):
+    if len(ids):
+        index.add_with_ids(np.ascontiguousarray(embeddings, dtype="float32"), np.asarray(ids, dtype=np.int64))
+
+
+def remove_vectors(index, ids: Sequence[int]) -> bool:
+    """Remove ids in place. Returns False if the index type cannot remove (HNSW)."""
+    faiss = _faiss()
+    try:
+        index.remove_ids(faiss.IDSelectorBatch(np.asarray(ids, dtype=np.int64)))
+    except RuntimeError:
+        return False
+    return True
+
+
+def configure_search(index, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """Apply search-time knobs to the index wrapped by an IndexIDMap."""
+    faiss = _faiss()
+    inner = faiss.downcast_index(index.index if hasattr(index, "id_map") else index)
+    if hasattr(inner, "nprobe"):
+        inner.nprobe = min(nprobe or VECTOR_INDEX_NPROBE, inner.nlist)
+    if hasattr(inner, "hnsw"):
+        inner.hnsw.efSearch = ef_search or VECTOR_INDEX_EF_SEARCH
+
+
+def search(index, queries: np.ndarray, k: int, embeddings: Optional[np.ndarray] = None,
+           ids: Optional[np.ndarray] = None, rerank_factor: Optional[int] = None):
+    """
+    index.search(queries, k). With embeddings (float32, rows aligned with the
+    ascending ids), over-fetch k * rerank_factor candidates from the index and
+    return the k best by exact inner product instead.
+    """
+    if embeddings is None:
+        return index.search(queries, k)
+    fetch = min(k * (rerank_factor or VECTOR_RERANK_FACTOR), index.ntotal)
+    _, found = index.search(queries, fetch)
+    valid = found != -1
+    rows = np.searchsorted(ids, np.where(valid, found, ids[0]))
+    # one gather for the whole batch; reads only the shortlisted rows of the mmap
+    unique_rows, inverse = np.unique(rows, return_inverse=True)
+    vectors = np.asarray(embeddings[unique_rows], dtype="float32")
+    exact = np.einsum("qkd,qd->qk", vectors[inverse.reshape(rows.shape)], queries)
+    exact[~valid] = -np.inf
+    order = np.argsort(-exact, axis=1, kind="stable")[:, :k]
+    scores = np.take_along_axis(exact, order, axis=1)
+    labels = np.take_along_axis(found, order, axis=1)
+    labels[~np.isfinite(scores)] = -1
+    return scores.astype("float32"), labels
+
+
+def exact_top_k(embeddings: np.ndarray, ids: np.ndarray, queries: np.ndarray, k: int,
+                block_rows: int = _EXACT_BLOCK_ROWS) -> np.ndarray:
+    """
+    Ids of the k largest inner products per query (unordered), scanning
+    embeddings block_rows at a time, so a memory-mapped array is never
+    copied whole.
+    """
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_ids = np.full((len(queries), k), -1, dtype=np.int64)
+    for start in range(0, embeddings.shape[0], block_rows):
+        block = np.asarray(embeddings[start:start + block_rows], dtype=np.float32)
+        scores = np.concatenate([best_scores, queries @ block.T], axis=1)
+        labels = np.concatenate([best_ids, np.broadcast_to(ids[start:start + len(block)], (len(queries), len(block)))],
+                                axis=1)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, top, axis=1)
+        best_ids = np.take_along_axis(labels, top, axis=1)
+    return best_ids
+
+
+def evaluate_against_flat(index, embeddings: np.ndarray, ids: Sequence[int], k: int = 10,
+                          num_queries: int = 100, seed: int = 0, rerank: bool = False) -> dict:
+    """
+    recall@k and mean per-query latency of index versus exact search, using
+    a sample of the indexed vectors as queries. The exact neighbours come
+    from a blocked scan of embeddings (exact_top_k), not a flat index copy.
+    With rerank, the index is searched through search() with exact
+    rescoring of the shortlist.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(embeddings.shape[0], size=min(num_queries, embeddings.shape[0]), replace=False))
+    queries = np.ascontiguousarray(embeddings[rows], dtype="float32")
+    k = min(k, embeddings.shape[0])
+
+    start = time.perf_counter()
+    expected = exact_top_k(embeddings, ids, queries, k)
+    flat_latency = (time.perf_counter() - start) / len(queries)
+
+    start = time.perf_counter()
+    _, got = search(index, queries, k, embeddings if rerank else None, ids)
+    latency = (time.perf_counter() - start) / len(queries)
+
+    hits = sum(len(set(e[e >= 0]) & set(g[g >= 0])) for e, g in zip(expected, got))
+    return {
+        "k": int(k),
+        "queries": int(len(queries)),
+        "recall_at_k": hits / float(expected.size) if expected.size else 1.0,
+        "latency_ms": latency * 1000,
+        "flat_latency_ms": flat_latency * 1000,
+        "reranked": rerank,
+    }
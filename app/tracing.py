@@ -0,0 +1,236 @@
+"""
+Lightweight tracing and Prometheus metrics.
+
+span("stage") times a block of work. Every span is observed in the
+stage_duration_seconds histogram; spans that run while an HTTP request is
+being served are also collected for that request, and with SERVER_TIMING=1
+returned as a Server-Timing header (one entry per stage, durations in ms,
+repeated stages summed), so a slow /query shows where its time went.
+
+Metrics are kept in process (no client library) and rendered in the
+Prometheus text format by render(), which the app serves at /metrics. With
+several uvicorn workers each process reports its own series.
+"""
+import os
+import time
+import threading
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+METRICS_PREFIX = "mka_"
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"
+
+# seconds; covers sub-millisecond index lookups up to multi-second summaries and builds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_REGISTRY: List["_Metric"] = []
+_REGISTRY_LOCK = threading.Lock()
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = METRICS_PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _REGISTRY_LOCK:
+            _REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    """Value read from a callback at scrape time (e.g. queue depth)."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, read: Callable[[], Optional[float]]):
+        super().__init__(name, documentation)
+        self._read = read
+
+    def _samples(self) -> Iterator[str]:
+        try:
+            value = self._read()
+        except Exception:
+            value = None
+        if value is not None:
+            yield f"{self.name} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [count per bucket (last = +Inf)], sum
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        slot = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._series.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[slot] += 1
+            total[0] += value
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return sum(series[0]) if series else 0
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._series.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}"
+
+
+def render() -> str:
+    """Every registered metric in the Prometheus text exposition format."""
+    with _REGISTRY_LOCK:
+        metrics = list(_REGISTRY)
+    return "\n".join(m.render() for m in metrics) + "\n"
+
+
+STAGE_SECONDS = Histogram("stage_duration_seconds", "Time spent per request or ingestion stage.", ("stage",))
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+HTTP_SECONDS = Histogram("http_request_duration_seconds", "HTTP request latency until the response starts.",
+                         ("method", "route"))
+
+
+# --- spans ---------------------------------------------------------------------
+
+class _RequestTrace:
+    """Stage durations of one request; shared by the threads that serve it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages: Dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        with self._lock:
+            return ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in self.stages.items())
+
+
+_current: contextvars.ContextVar[Optional[_RequestTrace]] = contextvars.ContextVar("request_trace", default=None)
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time the enclosed block as `stage` (recorded even if it raises)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        trace = _current.get()
+        if trace is not None:
+            trace.add(stage, elapsed)
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware: per-route request counters and latency histograms, a
+    request trace that span() reports into, and the Server-Timing header.
+    """
+
+    def __init__(self, app, server_timing: Optional[bool] = None):
+        self.app = app
+        self.server_timing = SERVER_TIMING if server_timing is None else server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trace = _RequestTrace()
+        token = _current.set(trace)
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                elapsed = time.perf_counter() - start
+                # the matched route template, so ids in paths do not explode label cardinality
+                route = getattr(scope.get("route"), "path", None) or "unmatched"
+                HTTP_SECONDS.observe(elapsed, method=scope["method"], route=route)
+                if self.server_timing:
+                    trace.add("total", elapsed)
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUESTS.inc(method=scope["method"], route=route, status=str(status[0]))
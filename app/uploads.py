@@ -0,0 +1,175 @@
+"""
+Streaming multipart upload receiver.
+
+receive_upload() parses the request body as it arrives (python-multipart,
+the parser Starlette itself uses) and writes the "file" part straight to a
+temp file, hashing it on the way, instead of letting UploadFile spool the
+whole body first and copying it afterwards. Memory stays at one request
+chunk plus UPLOAD_FLUSH_BYTES of buffered data; writes and hashing run in
+the threadpool.
+
+Bad uploads are rejected as soon as that can be decided, without reading
+the rest of the body:
+
+  413  Content-Length already over UPLOAD_MAX_BYTES, or the file part grows
+       past it
+  415  the first SNIFF_BYTES are neither a PDF nor UTF-8 text (the file name
+       is not consulted), or the body is not multipart/form-data
+  422  no "file" part
+  400  malformed multipart body, or more than one file
+"""
+import os
+import hashlib
+from dataclasses import dataclass
+from typing import List, Optional
+
+from fastapi import HTTPException, Request
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.concurrency import run_in_threadpool
+
+from app.services.ingest import SNIFF_BYTES, sniff_filetype
+
+# largest accepted file, in bytes
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", str(1 << 30)))
+# file data buffered before it is written and hashed
+UPLOAD_FLUSH_BYTES = 1 << 20
+# room for the multipart boundaries and part headers around the file in Content-Length
+MULTIPART_OVERHEAD = 64 << 10
+
+UPLOAD_FIELD = "file"
+
+
+@dataclass
+class ReceivedUpload:
+    filename: str
+    filetype: str
+    sha256: str
+    size: int
+
+
+class _FilePartWriter:
+    """python-multipart callbacks that stream the file part to disk."""
+
+    def __init__(self, tmp_path: str, max_bytes: int):
+        self.tmp_path = tmp_path
+        self.max_bytes = max_bytes
+        self.file = None
+        self.digest = hashlib.sha256()
+        self.filename: Optional[str] = None
+        self.filetype: Optional[str] = None
+        self.size = 0
+        self.finished = False
+        self._head = bytearray()
+        self._pending: List[bytes] = []
+        self._pending_bytes = 0
+        self._in_file = False
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self._part_begin,
+            "on_part_data": self._part_data,
+            "on_part_end": self._part_end,
+            "on_header_field": self._header_field,
+            "on_header_value": self._header_value_data,
+            "on_header_end": self._header_end,
+            "on_headers_finished": self._headers_finished,
+        }
+
+    def _part_begin(self):
+        self._disposition = b""
+        self._in_file = False
+
+    def _header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+
+    def _header_value_data(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _header_end(self):
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = self._header_value = b""
+
+    def _headers_finished(self):
+        _, options = parse_options_header(self._disposition)
+        if options.get(b"name") != UPLOAD_FIELD.encode() or b"filename" not in options:
+            return  # other form fields are skipped, not buffered
+        if self.filename is not None:
+            raise HTTPException(status_code=400, detail="Upload one file per request")
+        self.filename = os.path.basename(options[b"filename"].decode("utf-8", "replace")) or "upload"
+        self._in_file = True
+
+    def _part_data(self, data: bytes, start: int, end: int):
+        if not self._in_file:
+            return
+        block = data[start:end]
+        self.size += len(block)
+        if self.size > self.max_bytes:
+            raise HTTPException(status_code=413, detail=f"File is larger than {self.max_bytes} bytes")
+        if self.filetype is None:
+            self._head += block[:SNIFF_BYTES - len(self._head)]
+            if len(self._head) >= SNIFF_BYTES:
+                self._sniff(complete=False)
+        self._pending.append(block)
+        self._pending_bytes += len(block)
+
+    def _part_end(self):
+        if self._in_file:
+            if self.filetype is None:
+                self._sniff(complete=True)
+            self._in_file = False
+            self.finished = True
+
+    def _sniff(self, complete: bool):
+        self.filetype = sniff_filetype(bytes(self._head), complete=complete)
+        if self.filetype is None:
+            raise HTTPException(status_code=415, detail="Unsupported file type: expected a PDF or UTF-8 text")
+
+    def should_flush(self) -> bool:
+        # only sniffed data reaches the disk
+        return self._pending_bytes >= UPLOAD_FLUSH_BYTES and self.filetype is not None
+
+    def flush(self):
+        if self.file is None:
+            self.file = open(self.tmp_path, "wb")
+        for block in self._pending:
+            self.digest.update(block)
+            self.file.write(block)
+        self._pending, self._pending_bytes = [], 0
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+async def receive_upload(request: Request, tmp_path: str, max_bytes: Optional[int] = None) -> ReceivedUpload:
+    """Stream the request's "file" part to tmp_path; raises HTTPException for rejected uploads."""
+    max_bytes = UPLOAD_MAX_BYTES if max_bytes is None else max_bytes
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=415, detail="Expected a multipart/form-data upload")
+    length = request.headers.get("content-length")
+    if length is not None and length.isdigit() and int(length) > max_bytes + MULTIPART_OVERHEAD:
+        raise HTTPException(status_code=413, detail=f"File is larger than {max_bytes} bytes")
+
+    writer = _FilePartWriter(tmp_path, max_bytes)
+    parser = MultipartParser(params[b"boundary"], writer.callbacks())
+    try:
+        try:
+            async for chunk in request.stream():
+                parser.write(chunk)
+                if writer.should_flush():
+                    await run_in_threadpool(writer.flush)
+            parser.finalize()
+        except MultipartParseError as e:
+            raise HTTPException(status_code=400, detail=f"Malformed multipart body: {e}")
+        if not writer.finished:
+            raise HTTPException(status_code=422, detail=f"Missing file part {UPLOAD_FIELD!r}")
+        await run_in_threadpool(writer.flush)
+    finally:
+        writer.close()
+    return ReceivedUpload(writer.filename, writer.filetype, writer.digest.hexdigest(), writer.size)
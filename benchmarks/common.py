@@ -0,0 +1,51 @@
+"""
+Helpers shared by the benchmark scripts: deterministic synthetic text,
+latency percentiles and on-disk sizes.
+"""
+import os
+import time
+
+import numpy as np
+
+
+def zipf_words(num_words, vocab_size=20000, seed=0):
+    """num_words word ids drawn from a Zipf-like (1/rank) distribution."""
+    rng = np.random.default_rng(seed)
+    weights = 1.0 / np.arange(1, vocab_size + 1)
+    weights /= weights.sum()
+    return rng.choice(vocab_size, size=num_words, p=weights)
+
+
+def zipf_corpus(num_docs, vocab_size=20000, doc_len=(40, 120), seed=0):
+    rng = np.random.default_rng(seed)
+    # varied lengths, so BM25 scores rarely tie and rankings are comparable
+    lengths = rng.integers(doc_len[0], doc_len[1], size=num_docs)
+    words = zipf_words(int(lengths.sum()), vocab_size, seed)
+    bounds = np.concatenate([[0], np.cumsum(lengths)])
+    return [" ".join(f"w{w}" for w in words[a:b]) for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def make_queries(num_queries, vocab_size=20000, terms=3, seed=1):
+    rng = np.random.default_rng(seed)
+    # mid-frequency terms, like real keyword queries
+    return [" ".join(f"w{w}" for w in rng.integers(10, min(vocab_size, 2000), size=terms))
+            for _ in range(num_queries)]
+
+
+def percentiles(samples):
+    ms = np.asarray(samples) * 1000
+    return {"p50_ms": float(np.percentile(ms, 50)), "p95_ms": float(np.percentile(ms, 95)),
+            "p99_ms": float(np.percentile(ms, 99)), "mean_ms": float(ms.mean())}
+
+
+def timed(fn, queries):
+    results, samples = [], []
+    for q in queries:
+        start = time.perf_counter()
+        results.append(fn(q))
+        samples.append(time.perf_counter() - start)
+    return results, percentiles(samples)
+
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
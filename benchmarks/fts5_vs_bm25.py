@@ -0,0 +1,96 @@
+"""
+Compare lexical backends on a synthetic Zipf corpus:
+
+  rank_bm25  the original in-memory path (BM25Okapi.get_scores + full sort)
+  bm25       segmented sparse-matrix scorer (Indexer/Retriever, method="bm25")
+  fts5       SQLite FTS5 over the chunks table (method="fts5")
+
+Reports build time, on-disk index size, query latency percentiles and top-k
+overlap with rank_bm25 as JSON. Runs in a temporary directory, so the
+repository's data/ and ingestion.db are untouched.
+
+    python -m benchmarks.fts5_vs_bm25 --docs 20000 --queries 200
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.common import dir_size, make_queries, timed, zipf_corpus
+
+
+def overlap(results, reference):
+    hits = sum(len(set(r) & set(ref)) for r, ref in zip(results, reference))
+    return hits / max(1, sum(len(ref) for ref in reference))
+
+
+def run(num_docs, num_queries, top_k):
+    from rank_bm25 import BM25Okapi
+    from app.db import bulk_insert, close_connections, init_db, transaction
+    from app.services.indexer import INDEX_DIR, Indexer
+    from app.services.retriever import Retriever
+
+    corpus = zipf_corpus(num_docs)
+    queries = make_queries(num_queries)
+    report = {"docs": num_docs, "queries": num_queries, "top_k": top_k}
+
+    start = time.perf_counter()
+    bm25 = BM25Okapi([doc.split() for doc in corpus])
+    build = time.perf_counter() - start
+    reference, latency = timed(
+        lambda q: [int(i) for i in np.argsort(-bm25.get_scores(q.split()), kind="stable")[:top_k]], queries)
+    report["rank_bm25"] = {"build_s": build, **latency}
+
+    init_db()
+    with transaction() as conn:
+        ids = []
+        bulk_insert(conn, "INSERT INTO chunks (file_id, chunk_index, content) VALUES (1, ?, ?)",
+                    enumerate(corpus), on_batch=lambda first, n: ids.extend(range(first, first + n)))
+    to_pos = {chunk_id: pos for pos, chunk_id in enumerate(ids)}
+    db_before = os.path.getsize("ingestion.db")
+
+    start = time.perf_counter()
+    Indexer("bm25").build_index(corpus, ids=ids)
+    build = time.perf_counter() - start
+    retriever = Retriever()
+    results, latency = timed(lambda q: [i for i, _ in retriever.lexical.top_k_maxscore(q, top_k)], queries)
+    report["bm25"] = {"build_s": build, "index_bytes": dir_size(INDEX_DIR),
+                      "overlap_with_rank_bm25": overlap(results, reference), **latency}
+
+    start = time.perf_counter()
+    Indexer("fts5").build_index(corpus, ids=ids)
+    build = time.perf_counter() - start
+    from app.db import get_connection
+    from app.services import fts
+    get_connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    results, latency = timed(lambda q: [to_pos[i] for i, _, _ in fts.search(q, top_k)], queries)
+    report["fts5"] = {"build_s": build, "index_bytes": os.path.getsize("ingestion.db") - db_before,
+                      "overlap_with_rank_bm25": overlap(results, reference), **latency}
+    close_connections()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    repo = os.getcwd()
+    sys.path.insert(0, repo)
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            report = run(args.docs, args.queries, args.top_k)
+        finally:
+            os.chdir(repo)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Offline stand-ins for the models the app downloads, so benchmarks measure
+retrieval and storage rather than model inference, and run without network
+access or torch.
+
+  HashingEncoder   sentence-transformers-compatible encode(): signed hashed
+                   bag of words, L2-normalized (similar texts -> similar vectors)
+  lead_summarize   first sentences of the text, in place of TextRank / BART
+"""
+import re
+import zlib
+
+import numpy as np
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+class HashingEncoder:
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, texts, convert_to_numpy=True, dtype="float32", **kwargs):
+        if isinstance(texts, str):
+            texts = [texts]
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            hashes = np.fromiter((zlib.crc32(t.encode("utf-8")) for t in text.lower().split()), dtype=np.int64)
+            if hashes.size:
+                signs = np.where(hashes & 1, 1.0, -1.0)
+                out[row] = np.bincount((hashes >> 1) % self.dim, weights=signs, minlength=self.dim)
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (out / norms).astype(dtype)
+
+
+def install_stub_encoder(dim: int = 384) -> HashingEncoder:
+    """
+    Make Indexer (document embeddings) and Retriever (query embeddings) use a
+    HashingEncoder. Both fetch the "embedder" from the model registry, so
+    installing it there is enough; call before the first hybrid build.
+    Embeddings land in the embedding cache under the configured model name,
+    so only do this in a scratch database.
+    """
+    from app.services.model_registry import MODELS
+    encoder = HashingEncoder(dim)
+    MODELS.put("embedder", encoder)
+    return encoder
+
+
+def lead_summarize(text: str, sentences_count: int = 3) -> str:
+    return " ".join(_SENTENCE_END.split(text.strip())[:sentences_count])
@@ -0,0 +1,281 @@
+"""
+Reproducible ingest and query benchmark.
+
+For every corpus size and index method, a fresh process in a scratch
+directory:
+
+  1. generates a synthetic Zipf corpus (fixed seed) of documents with sentences
+  2. chunks it with chunk_text (the word chunker) and iter_chunks (the
+     token-budget chunker uploads go through)
+  3. bulk-inserts the chunks into SQLite and runs Indexer.build_index
+  4. loads a Retriever and times Retriever.query, then the summarizer over
+     the top_k texts
+
+and reports chunking throughput, insert and build time, end-to-end ingest
+chunks/sec, index size on disk, resident memory (current and peak) and
+query / answer latency percentiles. Embeddings and summaries come from the
+offline stubs in benchmarks/stubs.py unless the real models are asked for.
+
+Results are JSON (stdout, and --output) with the commit and settings they
+were produced with; --baseline compares against an earlier run and flags
+regressions beyond --tolerance.
+
+    python -m benchmarks.suite --sizes 1000,100000 --methods bm25,fts5 --output bench.json
+    python -m benchmarks.suite --sizes 1000,100000 --baseline bench.json --fail-on-regression
+
+1M chunks of 100 words needs several GB of RAM; hybrid at that size builds
+an IVF index over 1M x 384 floats.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from benchmarks.common import dir_size, make_queries, percentiles, zipf_words
+
+DEFAULT_SIZES = (1000, 100000, 1000000)
+DEFAULT_METHODS = ("bm25", "tfidf", "fts5", "hybrid")
+
+# metric -> True if higher is better; compared by --baseline
+COMPARED = {
+    "chunk_text_chunks_per_s": True,
+    "ingest_chunks_per_s": True,
+    "build_s": False,
+    "index_bytes": False,
+    "rss_peak_mb": False,
+    "query.p50_ms": False,
+    "query.p95_ms": False,
+    "query.p99_ms": False,
+}
+
+
+def _rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def _peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def documents(num_chunks, chunk_words, chunks_per_doc=50, sentence_words=15, vocab_size=20000, seed=0):
+    """Documents of exactly chunks_per_doc * chunk_words words, with a period every sentence_words words."""
+    vocab = np.array([f"w{i}" for i in range(vocab_size)], dtype=object)
+    dotted = np.array([f"w{i}." for i in range(vocab_size)], dtype=object)
+    docs = []
+    for n, start in enumerate(range(0, num_chunks, chunks_per_doc)):
+        count = min(chunks_per_doc, num_chunks - start) * chunk_words
+        ids = zipf_words(count, vocab_size, seed=seed + n)
+        tokens = vocab[ids]
+        tokens[sentence_words - 1::sentence_words] = dotted[ids[sentence_words - 1::sentence_words]]
+        docs.append(" ".join(tokens.tolist()))
+    return docs
+
+
+def run_case(size, method, chunk_words=100, num_queries=200, top_k=10, summarizer="stub", embedder="stub"):
+    """One (size, method) measurement; run from an empty working directory."""
+    from app.db import bulk_insert, close_connections, get_connection, init_db, transaction
+    from app.services.chunker import chunk_text, iter_chunks
+    from app.services.indexer import FTS_METHOD, INDEX_DIR, Indexer
+    from app.services.ingest import CHUNK_OVERLAP
+    from app.services.retriever import get_retriever, reset_retriever_cache
+    from benchmarks.stubs import install_stub_encoder, lead_summarize
+
+    if method == "hybrid" and embedder == "stub":
+        install_stub_encoder()
+    close_connections()
+    reset_retriever_cache()
+    init_db()
+    report = {"size": size, "method": method, "chunk_words": chunk_words, "rss_start_mb": _rss_mb()}
+
+    start = time.perf_counter()
+    docs = documents(size, chunk_words)
+    report["generate_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    chunks = [chunk for doc in docs for chunk in chunk_text(doc, chunk_words)]
+    chunk_s = time.perf_counter() - start
+    report["chunk_text_chunks_per_s"] = len(chunks) / chunk_s
+
+    start = time.perf_counter()
+    streamed = sum(1 for doc in docs for _ in iter_chunks([(None, doc)], max_tokens=chunk_words,
+                                                          overlap=min(CHUNK_OVERLAP, chunk_words // 2),
+                                                          align_sentences=True))
+    report["iter_chunks_chunks_per_s"] = streamed / (time.perf_counter() - start)
+    del docs
+
+    start = time.perf_counter()
+    ids = []
+    with transaction() as conn:
+        bulk_insert(conn, "INSERT INTO chunks (file_id, chunk_index, content) VALUES (1, ?, ?)",
+                    enumerate(chunks), on_batch=lambda first, n: ids.extend(range(first, first + n)))
+    insert_s = time.perf_counter() - start
+    conn = get_connection()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    db_before = os.path.getsize("ingestion.db")
+
+    start = time.perf_counter()
+    Indexer(method).build_index(chunks, ids=ids)
+    build_s = time.perf_counter() - start
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    report.update({
+        "chunks": len(chunks),
+        "db_insert_s": insert_s,
+        "build_s": build_s,
+        "ingest_chunks_per_s": len(chunks) / (chunk_s + insert_s + build_s),
+        # fts5 lives in the database; segment methods in data/index (the
+        # hybrid embedding cache grows the database but is not the index)
+        "index_bytes": os.path.getsize("ingestion.db") - db_before if method == FTS_METHOD else dir_size(INDEX_DIR),
+        "rss_after_build_mb": _rss_mb(),
+    })
+    del chunks
+
+    start = time.perf_counter()
+    retriever = get_retriever()  # a ShardedRetriever with INDEX_SHARDS > 1
+    report["load_s"] = time.perf_counter() - start
+
+    queries = make_queries(num_queries)
+    retriever.query(queries[0], top_k)  # warm-up (lazy imports, first page faults)
+    samples, answer_samples = [], []
+    for q in queries:
+        start = time.perf_counter()
+        hits = retriever.query(q, top_k)
+        samples.append(time.perf_counter() - start)
+        if summarizer != "none":
+            text = " ".join(t for t, _ in hits)
+            start = time.perf_counter()
+            if summarizer == "stub":
+                lead_summarize(text)
+            else:
+                from app.services.summarizer import summarize
+                summarize(text, method=summarizer)
+            answer_samples.append(time.perf_counter() - start)
+    report["query"] = percentiles(samples)
+    if answer_samples:
+        report["answer"] = percentiles(answer_samples)
+    report["rss_mb"] = _rss_mb()
+    report["rss_peak_mb"] = _peak_rss_mb()
+    close_connections()
+    return report
+
+
+def _isolated_case(repo, kwargs):
+    # each case gets its own process (clean RSS, caches and pools) and directory
+    sys.path.insert(0, repo)
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            return run_case(**kwargs)
+        finally:
+            os.chdir(repo)
+
+
+def _metadata(repo, args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=repo, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "settings": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        "env": {k: v for k, v in os.environ.items()
+                if k.startswith(("VECTOR_", "LEXICAL_", "INDEX_", "CHUNK_", "SQLITE_", "DEDUP_"))},
+    }
+
+
+def _metric(case, name):
+    value = case
+    for part in name.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def compare(results, baseline, tolerance):
+    """Relative change per compared metric for cases present in both runs; regressions beyond tolerance."""
+    previous = {(c["size"], c["method"]): c for c in baseline["results"]}
+    changes, regressions = [], []
+    for case in results:
+        old = previous.get((case["size"], case["method"]))
+        if old is None:
+            continue
+        for name, higher_is_better in COMPARED.items():
+            new_value, old_value = _metric(case, name), _metric(old, name)
+            if not new_value or not old_value:
+                continue
+            change = new_value / old_value - 1
+            entry = {"size": case["size"], "method": case["method"], "metric": name,
+                     "baseline": old_value, "value": new_value, "change": change}
+            changes.append(entry)
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(entry)
+    return {"baseline_commit": baseline.get("meta", {}).get("commit"), "tolerance": tolerance,
+            "changes": changes, "regressions": regressions}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="chunk counts, comma-separated")
+    parser.add_argument("--methods", default=",".join(DEFAULT_METHODS), help="index methods, comma-separated")
+    parser.add_argument("--chunk-words", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--embedder", choices=("stub", "model"), default="stub",
+                        help="hybrid query/document encoder: HashingEncoder or SBERT_MODEL")
+    parser.add_argument("--summarizer", choices=("stub", "textrank", "transformer", "none"), default="stub")
+    parser.add_argument("--output", help="also write the JSON report here")
+    parser.add_argument("--baseline", help="earlier JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="relative change counted as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args(argv)
+
+    repo = os.getcwd()
+    sys.path.insert(0, repo)
+    report = {"meta": _metadata(repo, args), "results": []}
+    spawn = multiprocessing.get_context("spawn")
+    for size in (int(s) for s in args.sizes.split(",")):
+        for method in args.methods.split(","):
+            kwargs = {"size": size, "method": method, "chunk_words": args.chunk_words,
+                      "num_queries": args.queries, "top_k": args.top_k,
+                      "summarizer": args.summarizer, "embedder": args.embedder}
+            with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+                try:
+                    case = pool.submit(_isolated_case, repo, kwargs).result()
+                except Exception as e:  # e.g. a missing optional dependency for one method
+                    case = {"size": size, "method": method, "error": f"{type(e).__name__}: {e}"}
+            report["results"].append(case)
+            print(f"{method:>7} {size:>9} chunks: "
+                  + (case["error"] if "error" in case else
+                     f"ingest {case['ingest_chunks_per_s']:.0f} chunks/s, build {case['build_s']:.2f}s, "
+                     f"query p50 {case['query']['p50_ms']:.2f} ms"), file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["comparison"] = compare(report["results"], json.load(f), args.tolerance)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+    if args.fail_on_regression and report.get("comparison", {}).get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,24 @@
 # tests/conftest.py
-import os
+import shutil
 import pytest
-from app.services.indexer import INDEX_FILE
+from app.services.indexer import INDEX_DIR
+from app.services.cache import ANSWER_CACHE, QUERY_CACHE
+from app.services.model_registry import MODELS
+from app.services.retriever import reset_retriever_cache
+
+
+def _remove_index():
+    shutil.rmtree(INDEX_DIR, ignore_errors=True)
+    reset_retriever_cache()
+    QUERY_CACHE.clear()
+    ANSWER_CACHE.clear()
+    MODELS.clear()
+
 
 @pytest.fixture(autouse=True)
 def cleanup_index():
     # cleanup before each test
-    if os.path.exists(INDEX_FILE):
-        os.remove(INDEX_FILE)
+    _remove_index()
     yield
     # cleanup after each test (just in case)
-    if os.path.exists(INDEX_FILE):
-        os.remove(INDEX_FILE)
\ No newline at end of file
+    _remove_index()
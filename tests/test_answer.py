@@ -0,0 +1,111 @@
+# tests/test_answer.py
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from app.services import answer
+
+TEXT = "Hybrid retrieval fuses BM25 and vectors. It ranks well. It is cheap. Extra sentence."
+
+_executor = ThreadPoolExecutor(max_workers=4)
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    answer.LATENCY.reset()
+    answer.ANSWER_CACHE.clear()
+    monkeypatch.setattr(answer.summary_pool, "get_summary_pool", lambda: None)
+    monkeypatch.setattr(answer, "summarize", lambda text, **kwargs: "textrank answer")
+    yield
+
+
+def _transformer_taking(monkeypatch, seconds):
+    calls = []
+
+    def submit(text):
+        calls.append(text)
+        return _executor.submit(lambda: time.sleep(seconds) or "transformer answer")
+    monkeypatch.setattr(answer, "_submit_transformer", submit)
+    return calls
+
+
+def test_transformer_answer_is_cached(monkeypatch):
+    calls = _transformer_taking(monkeypatch, 0)
+    assert answer.generate_answer(TEXT, time.monotonic() + 5) == ("transformer answer", "transformer")
+    assert answer.generate_answer(TEXT, time.monotonic() + 5) == ("transformer answer", "cache")
+    assert len(calls) == 1
+
+
+def test_slow_transformer_is_abandoned_then_skipped(monkeypatch):
+    calls = _transformer_taking(monkeypatch, 1.0)
+    start = time.monotonic()
+    assert answer.generate_answer(TEXT, start + 0.3) == ("textrank answer", "textrank")
+    assert time.monotonic() - start < 0.6
+    # the overrun raised the estimate above the budget: no second attempt
+    start = time.monotonic()
+    assert answer.generate_answer(TEXT, start + 0.3)[1] == "textrank"
+    assert len(calls) == 1 and time.monotonic() - start < 0.1
+
+
+def test_stuck_local_run_is_not_queued_behind(monkeypatch):
+    calls = []
+
+    def stuck(texts, **kwargs):
+        calls.append(texts)
+        time.sleep(1.5)
+        return ["transformer answer"]
+    monkeypatch.setattr(answer, "transformer_summarize_batch", stuck)
+    assert answer.generate_answer(TEXT, time.monotonic() + 0.3)[1] == "textrank"
+    # the abandoned run still holds the in-process executor: the next request does not wait behind it
+    start = time.monotonic()
+    assert answer.generate_answer(TEXT, start + 0.9)[1] == "textrank"
+    assert time.monotonic() - start < 0.3 and len(calls) == 1
+    answer._EXECUTOR.submit(lambda: None).result()
+    assert answer._queue_wait(1.0) == 0
+
+
+def test_stale_estimates_are_probed_again(monkeypatch):
+    calls = _transformer_taking(monkeypatch, 1.0)
+    monkeypatch.setattr(answer.LATENCY, "stale_s", 0.2)
+    answer.generate_answer(TEXT, time.monotonic() + 0.3)
+    time.sleep(0.3)
+    answer.generate_answer(TEXT, time.monotonic() + 0.3)
+    assert len(calls) == 2
+
+
+def test_stream_uses_the_cache_and_the_latency_model(monkeypatch):
+    calls = []
+
+    def transformer(text, **kwargs):
+        calls.append(text)
+        raise RuntimeError("model unavailable")
+    monkeypatch.setattr(answer, "transformer_summarize_stream", transformer)
+    monkeypatch.setattr(answer, "summarize_stream", lambda text, **kwargs: iter(["It ranks well."]))
+    answer.LATENCY.observe("transformer_stream", len(TEXT), 10.0)
+    stream = answer.AnswerStream(TEXT, time.monotonic() + 0.3)
+    assert list(stream) == ["It ranks well."] and stream.method == "textrank"
+    assert not calls
+    answer.ANSWER_CACHE.put(answer.text_key(TEXT, **answer.TRANSFORMER_ARGS), "cached answer")
+    stream = answer.AnswerStream(TEXT, time.monotonic() + 0.3)
+    assert list(stream) == ["cached answer"] and stream.method == "cache"
+
+
+def test_failures_fall_through_to_lead(monkeypatch):
+    def broken(text):
+        raise RuntimeError("model unavailable")
+
+    def textrank(text, **kwargs):
+        raise LookupError("nltk data missing")
+    monkeypatch.setattr(answer, "_submit_transformer", broken)
+    monkeypatch.setattr(answer, "summarize", textrank)
+    assert answer.generate_answer(TEXT, time.monotonic() + 5) == (
+        "Hybrid retrieval fuses BM25 and vectors. It ranks well. It is cheap.", "lead")
+    assert answer.generate_answer("", time.monotonic() + 5) == ("", None)
+
+
+def test_latency_model_scales_to_unseen_lengths():
+    model = answer.LatencyModel(alpha=0.5)
+    assert model.estimate("transformer", 1000) is None
+    model.observe("transformer", 1000, 1.0)
+    model.observe("transformer", 1000, 2.0)
+    assert model.estimate("transformer", 1200) == pytest.approx(1.5)
+    assert model.estimate("transformer", 5000) == pytest.approx(1.5 * 6000 / 1500)
@@ -0,0 +1,26 @@
+# tests/test_benchmarks.py
+from benchmarks.suite import compare, documents, run_case
+
+
+def test_documents_are_deterministic_and_sized():
+    docs = documents(120, chunk_words=10, chunks_per_doc=50)
+    assert docs == documents(120, chunk_words=10, chunks_per_doc=50)
+    assert [len(d.split()) for d in docs] == [500, 500, 200]
+    assert docs[0].split()[14].endswith(".")
+
+
+def test_run_case_reports_ingest_and_query_metrics(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    case = run_case(200, "bm25", chunk_words=20, num_queries=10, top_k=3)
+    assert case["chunks"] == 200
+    assert case["ingest_chunks_per_s"] > 0 and case["index_bytes"] > 0
+    assert set(case["query"]) >= {"p50_ms", "p95_ms", "p99_ms"} and "answer" in case
+    assert case["rss_peak_mb"] > 0
+
+
+def test_compare_flags_regressions_beyond_tolerance():
+    old = {"size": 10, "method": "bm25", "build_s": 1.0, "ingest_chunks_per_s": 100.0, "query": {"p50_ms": 1.0}}
+    new = {"size": 10, "method": "bm25", "build_s": 1.05, "ingest_chunks_per_s": 80.0, "query": {"p50_ms": 2.0}}
+    result = compare([new], {"meta": {"commit": "abc"}, "results": [old]}, tolerance=0.1)
+    assert result["baseline_commit"] == "abc"
+    assert {r["metric"] for r in result["regressions"]} == {"ingest_chunks_per_s", "query.p50_ms"}
@@ -0,0 +1,112 @@
+# tests/test_bulk_ingest.py
+import io
+import os
+import json
+import pytest
+from app.db import DB_NAME, close_connections, get_connection
+from app.services import bulk_ingest
+from app.services.indexer import read_index_generation
+from app.services.retriever import Retriever
+
+
+def _remove_db():
+    close_connections()
+    for path in (DB_NAME, DB_NAME + "-wal", DB_NAME + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+@pytest.fixture(autouse=True)
+def fresh_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk_ingest, "JOURNAL_DIR", str(tmp_path / "journals"))
+    _remove_db()
+    yield
+    _remove_db()
+
+
+def _write(path, content: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    root = tmp_path / "docs"
+    for i in range(6):
+        _write(str(root / f"part{i % 2}" / f"doc{i}.txt"),
+               f"Document {i} talks about topic{i} and nothing else. It is file number {i}.".encode())
+    _write(str(root / "copy.txt"), b"Document 0 talks about topic0 and nothing else. It is file number 0.")
+    _write(str(root / "broken.txt"), b"\xff\xfe not utf-8")
+    _write(str(root / "ignored.csv"), b"a,b")
+    return str(root)
+
+
+def test_bulk_ingest_stores_everything_and_indexes_once(corpus):
+    progress = io.StringIO()
+    summary = bulk_ingest.bulk_ingest(corpus, workers=2, method="bm25", progress_stream=progress)
+    assert (summary["stored"], summary["duplicate"], summary["failed"], summary["skipped"]) == (6, 1, 1, 0)
+    # one index build for the whole run
+    assert summary["generation"] == read_index_generation()
+    assert Retriever().query("topic4", top_k=1)[0][0].startswith("Document 4")
+    files = get_connection().execute("SELECT filename, filepath FROM files ORDER BY id").fetchall()
+    assert len(files) == 6 and all(os.path.isabs(path) and path.startswith(corpus) for _, path in files)
+    assert "8/8 files (100.0%): 6 stored, 1 duplicate, 1 failed" in progress.getvalue()
+
+
+def test_journal_and_merge_stay_out_of_the_way(corpus, monkeypatch):
+    from app.services.indexer import Indexer
+    from app.services.segments import read_manifest
+    before = sorted(os.listdir(corpus))
+    monkeypatch.setattr("app.services.segments.MAX_SEGMENTS", 1)
+    monkeypatch.setattr("app.services.indexer.schedule_merge", lambda: pytest.fail("background merge"))
+    Indexer(method="bm25").build_index(["an existing chunk"], ids=[10_000])
+    bulk_ingest.bulk_ingest(corpus, workers=1, method="bm25", progress_stream=io.StringIO())
+    # nothing is written into the input tree
+    assert sorted(os.listdir(corpus)) == before
+    assert os.path.exists(bulk_ingest.default_journal_path(corpus + "/part0/.."))
+    # merged before returning, not by a thread the exiting CLI would kill
+    assert len(read_manifest()["segments"]) == 1
+
+
+def test_interrupted_run_resumes(corpus, monkeypatch):
+    def interrupted(*args, **kwargs):
+        raise KeyboardInterrupt
+
+    # stored, then stopped before the index step
+    with monkeypatch.context() as patched, pytest.raises(KeyboardInterrupt):
+        patched.setattr(bulk_ingest, "index_chunks", interrupted)
+        bulk_ingest.bulk_ingest(corpus, workers=1, method="bm25", progress_stream=io.StringIO())
+    _write(os.path.join(corpus, "late.txt"), b"A late file about topiclate and more.")
+
+    summary = bulk_ingest.bulk_ingest(corpus, workers=1, method="bm25", progress_stream=io.StringIO())
+    # done files are skipped, the failed one is retried, and everything stored is indexed
+    assert (summary["stored"], summary["failed"], summary["skipped"]) == (1, 1, 7)
+    retriever = Retriever()
+    assert len(retriever.ids) == 7
+    assert retriever.query("topiclate", top_k=1)[0][0].startswith("A late file")
+
+    again = bulk_ingest.bulk_ingest(corpus, workers=1, method="bm25", progress_stream=io.StringIO())
+    assert again["stored"] == 0 and again["generation"] is None
+    with open(bulk_ingest.default_journal_path(corpus)) as f:
+        assert sum("indexed" in json.loads(line) for line in f) == 1
+
+
+def test_interrupted_between_commit_and_journal(corpus, monkeypatch):
+    record = bulk_ingest.Journal.record
+
+    def interrupted(journal, entry):
+        # the first file's rows are committed, its outcome never journaled
+        if entry.get("status") == bulk_ingest.STORED:
+            raise KeyboardInterrupt
+        record(journal, entry)
+    with monkeypatch.context() as patched, pytest.raises(KeyboardInterrupt):
+        patched.setattr(bulk_ingest.Journal, "record", interrupted)
+        bulk_ingest.bulk_ingest(corpus, workers=1, method="bm25", progress_stream=io.StringIO())
+    assert get_connection().execute("SELECT COUNT(*) FROM files").fetchone()[0] == 1
+
+    summary = bulk_ingest.bulk_ingest(corpus, workers=1, method="bm25", progress_stream=io.StringIO())
+    assert (summary["stored"], summary["duplicate"], summary["failed"]) == (5, 1, 1)
+    retriever = Retriever()
+    assert len(retriever.ids) == 6
+    assert all(retriever.query(f"topic{i}", top_k=1)[0][0].startswith(f"Document {i}") for i in range(6))
@@ -0,0 +1,90 @@
+# tests/test_cache.py
+import time
+from fastapi.testclient import TestClient
+from app.main import app
+from app.services.cache import QUERY_CACHE, LRUCache, normalize_query
+from app.tracing import render
+
+
+def test_lru_entry_and_byte_bounds():
+    cache = LRUCache("test_bounds", max_entries=2, max_bytes=10_000, ttl_s=60)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    assert cache.get("a") == "1"  # a is now most recent
+    cache.put("c", "3")
+    assert cache.get("b") is None and cache.get("a") == "1" and cache.get("c") == "3"
+
+    small = LRUCache("test_bytes", max_entries=100, max_bytes=400, ttl_s=60)
+    for i in range(10):
+        small.put(i, "x" * 100)
+    assert small.stats()["bytes"] <= 400 and small.get(9) is not None and small.get(0) is None
+    small.put("huge", "x" * 1000)  # larger than the whole cache: not stored
+    assert small.get("huge") is None
+
+
+def test_ttl_and_generation_invalidation():
+    cache = LRUCache("test_ttl", max_entries=10, max_bytes=10_000, ttl_s=0.1)
+    cache.put("k", "v", generation=1)
+    assert cache.get("k", generation=1) == "v"
+    time.sleep(0.15)
+    assert cache.get("k", generation=1) is None
+
+    cache.put("k", "v", generation=1)
+    assert cache.get("other", generation=2) is None  # empties the cache
+    cache.put("late", "v", generation=1)  # result of an outdated snapshot
+    assert cache.stats()["entries"] == 0
+    assert cache.get("k", generation=2) is None
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["hit_rate"] == 1 / 4
+
+
+def test_normalize_query():
+    assert normalize_query("  What IS\tBM25? ") == "What IS BM25?"
+    assert normalize_query("  What IS\tBM25? ", "bm25") != normalize_query("what is bm25?", "bm25")
+    assert normalize_query("  What IS\tBM25? ", "tfidf") == normalize_query("what is bm25?", "tfidf")
+
+
+def test_case_sensitive_queries_do_not_share_results(monkeypatch):
+    from app.services.indexer import Indexer
+    from app.services.retriever import get_retriever
+    Indexer(method="bm25").build_index(["Apple pie recipe", "apple orchard trees", "banana"])
+    monkeypatch.setattr("app.routes.qa.generate_answer", lambda text, deadline, generation=None: (text, "lead"))
+    client = TestClient(app)
+    upper = client.post("/query", json={"q": "Apple", "top_k": 1}).json()
+    lower = client.post("/query", json={"q": "apple", "top_k": 1}).json()
+    assert upper["results"][0]["text"] == "Apple pie recipe"
+    assert lower["results"][0]["text"] == "apple orchard trees"
+    assert lower["results"] == [{"text": t, "score": s} for t, s in get_retriever().query("apple", 1)]
+
+
+class CountingRetriever:
+    method = "tfidf"  # lowercases queries, so keys ignore case
+    generation = 1
+    calls = 0
+
+    def query(self, q, top_k=3):
+        CountingRetriever.calls += 1
+        return [(f"passage {self.generation}.", 1.0)]
+
+    def query_batch(self, queries, top_k=3):
+        return [self.query(q, top_k) for q in queries]
+
+
+def test_query_route_uses_cache_until_generation_changes(monkeypatch):
+    retriever = CountingRetriever()
+    monkeypatch.setattr("app.routes.qa.get_retriever", lambda: retriever)
+    monkeypatch.setattr("app.routes.qa.generate_answer", lambda text, deadline, generation=None: (text, "lead"))
+    client = TestClient(app)
+
+    first = client.post("/query", json={"q": "What is BM25?", "top_k": 1}).json()
+    again = client.post("/query", json={"q": "what is  bm25?", "top_k": 1}).json()
+    assert CountingRetriever.calls == 1 and again["results"] == first["results"]
+
+    batch = client.post("/query/batch", json={"queries": ["what is bm25?", "new question"], "top_k": 1}).json()
+    assert CountingRetriever.calls == 2 and len(batch["results"]) == 2
+
+    retriever.generation = 2  # index rebuilt
+    fresh = client.post("/query", json={"q": "what is bm25?", "top_k": 1}).json()
+    assert CountingRetriever.calls == 3 and fresh["results"][0]["text"] == "passage 2."
+    assert QUERY_CACHE.stats()["generation"] == 2
+    assert 'mka_cache_requests_total{cache="query",result="hit"}' in render()
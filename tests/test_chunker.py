@@ -0,0 +1,51 @@
+# tests/test_chunker.py
+import pytest
+from app.services.chunker import chunk_text, iter_chunks
+
+PAGES = [
+    (1, "Retrieval finds passages. BM25 ranks them by term statistics.\n"),
+    (2, "Dense vectors capture meaning. Hybrid search fuses both signals! "),
+    (3, "Summaries cite their sources."),
+]
+
+
+def _source():
+    return "".join(text for _, text in PAGES)
+
+
+def test_chunks_match_chunk_text_without_overlap():
+    chunks = list(iter_chunks(PAGES, max_tokens=4))
+    assert [c.text for c in chunks] == chunk_text(_source(), chunk_size=4)
+    assert [c.index for c in chunks] == list(range(len(chunks)))
+
+
+def test_offsets_and_pages_locate_each_chunk():
+    source = _source()
+    for chunk in iter_chunks(PAGES, max_tokens=5, overlap=2):
+        assert " ".join(source[chunk.start_char:chunk.end_char].split()) == chunk.text
+        assert chunk.num_tokens <= 5
+    chunks = list(iter_chunks(PAGES, max_tokens=10))
+    assert (chunks[0].page_start, chunks[0].page_end) == (1, 2)
+    assert (chunks[1].page_start, chunks[1].page_end) == (2, 3)
+
+
+def test_overlap_and_sentence_alignment():
+    chunks = list(iter_chunks(PAGES, max_tokens=12, overlap=6, align_sentences=True))
+    assert chunks[0].text == "Retrieval finds passages. BM25 ranks them by term statistics."
+    # the overlap starts at a sentence boundary inside the previous chunk
+    assert chunks[1].text.startswith("BM25 ranks them by term statistics. Dense vectors")
+    assert all(c.text.endswith((".", "!")) for c in chunks)
+
+
+def test_words_split_across_pieces_are_joined():
+    chunks = list(iter_chunks([(1, "hel"), (2, "lo wor"), (3, "ld")], max_tokens=10))
+    assert [c.text for c in chunks] == ["hello world"]
+    assert (chunks[0].start_char, chunks[0].end_char) == (0, 11)
+    assert (chunks[0].page_start, chunks[0].page_end) == (1, 2)
+
+
+def test_token_budget_with_custom_counter():
+    chunks = list(iter_chunks([(None, "a bb ccc dddd")], max_tokens=5, count_tokens=len))
+    assert [c.text for c in chunks] == ["a bb", "ccc", "dddd"]
+    with pytest.raises(ValueError):
+        list(iter_chunks([(None, "a")], max_tokens=2, overlap=2))
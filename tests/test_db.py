@@ -0,0 +1,67 @@
+# tests/test_db.py
+import sqlite3
+import threading
+import pytest
+from app.db import SCHEMA_VERSION, bulk_insert, get_connection, migrate, transaction
+
+
+def test_migrates_unversioned_database(tmp_path):
+    path = str(tmp_path / "old.db")
+    old = sqlite3.connect(path)
+    old.execute("CREATE TABLE files (id INTEGER PRIMARY KEY AUTOINCREMENT, filename TEXT, filetype TEXT, filepath TEXT)")
+    old.execute("CREATE TABLE chunks (id INTEGER PRIMARY KEY AUTOINCREMENT, file_id INTEGER, chunk_index INTEGER, content TEXT)")
+    old.execute("INSERT INTO chunks (file_id, chunk_index, content) VALUES (1, 0, 'kept')")
+    old.commit()
+    old.close()
+
+    assert migrate(path) == SCHEMA_VERSION
+    conn = get_connection(path)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(chunks)")}
+    assert {"start_char", "end_char", "page_start", "page_end"} <= columns
+    indexes = {row[1] for row in conn.execute("PRAGMA index_list(chunks)")}
+    assert "idx_chunks_file" in indexes
+    assert conn.execute("SELECT content FROM chunks").fetchall() == [("kept",)]
+    assert migrate(path) == SCHEMA_VERSION  # idempotent
+
+
+def test_bulk_insert_reports_rowids_and_rolls_back(tmp_path):
+    path = str(tmp_path / "bulk.db")
+    migrate(path)
+    ids = []
+    with transaction(path) as conn:
+        n = bulk_insert(conn, "INSERT INTO chunks (file_id, chunk_index, content) VALUES (?, ?, ?)",
+                        ((1, i, f"chunk {i}") for i in range(25)), batch_size=10,
+                        on_batch=lambda first, count: ids.extend(range(first, first + count)))
+    assert n == 25
+    rows = get_connection(path).execute("SELECT id, chunk_index FROM chunks ORDER BY id").fetchall()
+    assert ids == [r[0] for r in rows] and [r[1] for r in rows] == list(range(25))
+
+    with pytest.raises(RuntimeError):
+        with transaction(path) as conn:
+            conn.execute("INSERT INTO files (filename) VALUES ('lost')")
+            raise RuntimeError("abort")
+    assert get_connection(path).execute("SELECT COUNT(*) FROM files").fetchone()[0] == 0
+
+
+def test_readers_do_not_wait_for_writer(tmp_path):
+    path = str(tmp_path / "wal.db")
+    migrate(path)
+    writing, done = threading.Event(), threading.Event()
+
+    def writer():
+        with transaction(path) as conn:
+            conn.execute("INSERT INTO files (filename) VALUES ('pending')")
+            writing.set()
+            done.wait(5)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    writing.wait(5)
+    # the open write transaction is invisible, but reading does not block
+    assert get_connection(path).execute("SELECT COUNT(*) FROM files").fetchone()[0] == 0
+    done.set()
+    thread.join()
+    assert get_connection(path).execute("SELECT COUNT(*) FROM files").fetchone()[0] == 1
+    assert get_connection(path) is get_connection(path)  # pooled per thread
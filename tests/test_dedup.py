@@ -0,0 +1,84 @@
+# tests/test_dedup.py
+import os
+import pytest
+from app.db import DB_NAME, close_connections, get_connection, init_db
+from app.services import dedup
+from app.services.indexer import Indexer
+from app.services.ingest import parse_and_store
+from app.services.retriever import Retriever
+
+BASE = ("retrieval augmented generation grounds answers in documents fetched from an index "
+        "built over uploaded files and their chunks of text")
+NEAR = BASE + " today"
+OTHER = "an entirely different passage about cooking pasta with garlic olive oil and fresh basil leaves"
+
+
+def _remove_db():
+    close_connections()
+    for path in (DB_NAME, DB_NAME + "-wal", DB_NAME + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+@pytest.fixture(autouse=True)
+def fresh_db():
+    _remove_db()
+    init_db()
+    yield
+    _remove_db()
+
+
+def _write(tmp_path, name, *paragraphs):
+    path = tmp_path / name
+    path.write_text("\n\n".join(paragraphs))
+    return str(path)
+
+
+def test_minhash_estimates_jaccard():
+    base, near, other = dedup.minhash(BASE), dedup.minhash(NEAR), dedup.minhash(OTHER)
+    assert dedup.similarity(base, dedup.minhash(BASE)) == 1.0
+    assert dedup.similarity(base, near) > 0.8
+    assert dedup.similarity(base, other) < 0.2
+    assert dedup.minhash("too short") is None
+    # a near-duplicate shares at least one LSH bucket with its original
+    assert set(dedup.band_buckets(base)) & set(dedup.band_buckets(near))
+
+
+def test_drop_mode_skips_near_duplicate_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr("app.services.ingest.CHUNK_MAX_TOKENS", 40)
+    monkeypatch.setattr("app.services.ingest.CHUNK_OVERLAP", 0)
+    _, chunks, ids = parse_and_store("a.txt", _write(tmp_path, "a.txt", BASE), dedup_mode="drop")
+    assert chunks == [BASE]
+
+    # the repeated chunk from another file is dropped, the new one kept
+    _, chunks, _ = parse_and_store("b.txt", _write(tmp_path, "b.txt", BASE), dedup_mode="drop")
+    assert chunks == []
+    conn = get_connection()
+    assert conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0] == 1
+
+
+def test_downweight_mode_keeps_and_demotes_duplicates(tmp_path, monkeypatch):
+    monkeypatch.setattr("app.services.ingest.CHUNK_MAX_TOKENS", 40)
+    monkeypatch.setattr("app.services.ingest.CHUNK_OVERLAP", 0)
+    _, _, (original,) = parse_and_store("a.txt", _write(tmp_path, "a.txt", BASE), dedup_mode="downweight")
+    _, _, (copy,) = parse_and_store("b.txt", _write(tmp_path, "b.txt", BASE), dedup_mode="downweight")
+    conn = get_connection()
+    assert conn.execute("SELECT duplicate_of FROM chunks WHERE id=?", (copy,)).fetchone()[0] == original
+    assert dedup.duplicate_ids(conn, [original, copy]) == {copy}
+
+    # the copy is indexed with weight DEDUP_WEIGHT: identical text, lower score
+    ids = [original, copy, 100, 101, 102]
+    Indexer("bm25").build_index([BASE, BASE, OTHER, "unrelated words", "more filler"], ids=ids,
+                                weights=dedup.weights(ids, {copy}))
+    (_, top_score), (_, second_score) = Retriever().query("retrieval index", top_k=2)
+    assert top_score > 0 and second_score == pytest.approx(top_score * dedup.DEDUP_WEIGHT)
+
+
+def test_doc_weights_survive_merge():
+    indexer = Indexer("bm25")
+    indexer.build_index([BASE, OTHER], ids=[1, 2], weights=[0.5, 1.0])
+    indexer.add([NEAR], ids=[3], background_merge=False)
+    indexer.merge(max_segments=1)
+    retriever = Retriever()
+    assert len(retriever.segments) == 1
+    assert retriever.doc_weight.tolist() == [0.5, 1.0, 1.0]
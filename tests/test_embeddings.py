@@ -0,0 +1,44 @@
+# tests/test_embeddings.py
+import numpy as np
+from app.services.embeddings import EmbeddingCache, embed_texts
+
+
+class CountingEncoder:
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts, **kwargs):
+        self.encoded.extend(texts)
+        return np.array([[len(t), t.count("a"), 1.0] for t in texts], dtype="float32")
+
+
+def test_embed_texts_only_encodes_unseen_chunks(tmp_path):
+    cache = EmbeddingCache(db_path=str(tmp_path / "cache.db"), model_name="stub")
+    encoder = CountingEncoder()
+
+    first = embed_texts(["alpha", "beta", "alpha"], load_model=lambda: encoder, cache=cache)
+    assert encoder.encoded == ["alpha", "beta"]  # duplicate encoded once
+    assert first.shape == (3, 3)
+    np.testing.assert_array_equal(first[0], first[2])
+
+    second = embed_texts(["beta", "gamma"], load_model=lambda: encoder, cache=cache)
+    assert encoder.encoded == ["alpha", "beta", "gamma"]
+    np.testing.assert_array_equal(second[0], first[1])
+
+    stats = cache.stats()
+    assert stats["entries"] == 3
+    assert stats["bytes"] == 3 * 3 * 4
+
+
+def test_embed_texts_skips_model_when_all_cached(tmp_path):
+    cache = EmbeddingCache(db_path=str(tmp_path / "cache.db"), model_name="stub")
+    embed_texts(["alpha"], load_model=CountingEncoder, cache=cache)
+
+    def fail():
+        raise AssertionError("model should not be loaded")
+
+    vectors = embed_texts(["alpha"], load_model=fail, cache=cache)
+    assert vectors.shape == (1, 3)
+    # a different model name does not share entries
+    other = EmbeddingCache(db_path=str(tmp_path / "cache.db"), model_name="other")
+    assert other.stats()["entries"] == 0
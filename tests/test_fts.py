@@ -0,0 +1,72 @@
+# tests/test_fts.py
+import os
+import pytest
+from app.db import DB_NAME, bulk_insert, close_connections, get_connection, init_db, transaction
+from app.services import fts
+from app.services.indexer import Indexer
+from app.services.retriever import Retriever, get_retriever
+
+CORPUS = [
+    "hybrid retrieval combines bm25 and dense vectors",
+    "bm25 is a lexical ranking function",
+    "the quick brown fox jumps over the lazy dog",
+    "tf idf weighs terms by inverse document frequency",
+]
+
+
+def _remove_db():
+    close_connections()
+    for path in (DB_NAME, DB_NAME + "-wal", DB_NAME + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+@pytest.fixture(autouse=True)
+def fresh_db():
+    _remove_db()
+    init_db()
+    yield
+    _remove_db()
+
+
+def _insert(texts):
+    ids = []
+    with transaction() as conn:
+        bulk_insert(conn, "INSERT INTO chunks (file_id, chunk_index, content) VALUES (1, ?, ?)",
+                    enumerate(texts), on_batch=lambda first, n: ids.extend(range(first, first + n)))
+    return ids
+
+
+def test_fts5_index_is_kept_in_sync_by_triggers():
+    ids = _insert(CORPUS)
+    indexer = Indexer(method="fts5")
+    indexer.build_index(CORPUS, ids=ids)
+
+    results = Retriever().query("lazy fox", top_k=2)
+    assert results[0][0] == CORPUS[2]
+    assert results[0][1] > 0
+    assert Retriever().query('NEAR("bm25" AND', top_k=5)  # FTS5 syntax in queries is inert
+
+    # new rows are searchable without a rebuild; add() only publishes a generation
+    generation = get_retriever().generation
+    new_ids = _insert(["a slow green turtle"])
+    indexer.add(["a slow green turtle"], ids=new_ids)
+    retriever = get_retriever()
+    assert retriever.generation == generation + 1
+    assert retriever.query("turtle", top_k=1)[0][0] == "a slow green turtle"
+    assert retriever.query_batch(["turtle", "unknownterm"], top_k=1) == [
+        [("a slow green turtle", pytest.approx(retriever.query("turtle", 1)[0][1]))], []]
+
+    with transaction() as conn:
+        conn.execute("DELETE FROM chunks WHERE id=?", (new_ids[0],))
+    assert Retriever().query("turtle", top_k=1) == []
+
+
+def test_switching_away_from_fts5_drops_triggers():
+    ids = _insert(CORPUS)
+    Indexer(method="fts5").build_index(CORPUS, ids=ids)
+    assert fts.fts_available()
+    Indexer(method="bm25").build_index(CORPUS, ids=ids)
+    assert not fts.fts_available()
+    triggers = get_connection().execute("SELECT name FROM sqlite_master WHERE type='trigger'").fetchall()
+    assert triggers == []
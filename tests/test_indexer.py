@@ -0,0 +1,185 @@
+# tests/test_indexer.py
+import numpy as np
+import pytest
+from app.services.indexer import Indexer
+from app.services.retriever import Retriever
+from app.services.segments import read_manifest
+
+CORPUS = [
+    "hybrid retrieval combines bm25 and dense vectors",
+    "bm25 is a lexical ranking function",
+    "dense vectors come from sentence transformers",
+    "faiss performs fast similarity search over vectors",
+    "the quick brown fox jumps over the lazy dog",
+    "retrieval augmented generation uses retrieved passages",
+    "tf idf weighs terms by inverse document frequency",
+    "lexical and semantic signals can be fused",
+]
+QUERIES = ["bm25 retrieval", "dense vectors", "lazy fox", "document frequency terms", "unknownterm"]
+
+
+def _segmented(method, parts):
+    indexer = Indexer(method=method)
+    indexer.build_index(CORPUS[:parts[0]])
+    start = parts[0]
+    for size in parts[1:]:
+        indexer.add(CORPUS[start:start + size], background_merge=False)
+        start += size
+    return indexer
+
+
+def test_bm25_matches_rank_bm25():
+    rank_bm25 = pytest.importorskip("rank_bm25")
+    reference = rank_bm25.BM25Okapi([doc.split() for doc in CORPUS])
+    _segmented("bm25", [3, 2, 3])
+    retriever = Retriever()
+    assert len(read_manifest()["segments"]) == 3
+    for q in QUERIES:
+        np.testing.assert_allclose(retriever.lexical.score(q), reference.get_scores(q.split()))
+
+
+def test_tfidf_matches_sklearn():
+    text = pytest.importorskip("sklearn.feature_extraction.text")
+    vectorizer = text.TfidfVectorizer()
+    matrix = vectorizer.fit_transform(CORPUS)
+    _segmented("tfidf", [4, 4])
+    retriever = Retriever()
+    for q in QUERIES:
+        expected = (matrix @ vectorizer.transform([q]).T).toarray().ravel()
+        np.testing.assert_allclose(retriever.lexical.score(q), expected, atol=1e-12)
+
+
+def test_batch_scores_match_single_queries():
+    _segmented("bm25", [5, 3])
+    retriever = Retriever()
+    (block,) = list(retriever.lexical.score_batch(QUERIES))
+    for q, row in zip(QUERIES, block):
+        np.testing.assert_allclose(row, retriever.lexical.score(q))
+    assert retriever.query_batch(QUERIES, top_k=2) == [retriever.query(q, top_k=2) for q in QUERIES]
+
+
+def test_top_k_indices_matches_full_sort():
+    from app.services.lexical import top_k_indices
+    scores = np.random.default_rng(0).random(1000)
+    np.testing.assert_array_equal(top_k_indices(scores, 10), np.argsort(-scores)[:10])
+    assert top_k_indices(scores[:3], 10).tolist() == np.argsort(-scores[:3]).tolist()
+
+
+def test_add_assigns_ids_and_merge_preserves_results():
+    indexer = _segmented("bm25", [2, 2, 2, 2])
+    before = Retriever()
+    assert before.ids.tolist() == list(range(len(CORPUS)))
+
+    indexer.merge(max_segments=1)
+    after = Retriever()
+    assert len(read_manifest()["segments"]) == 1
+    assert after.generation > before.generation
+    assert after.ids.tolist() == before.ids.tolist()
+    for q in QUERIES:
+        np.testing.assert_allclose(after.lexical.score(q), before.lexical.score(q))
+
+
+def test_merge_sorts_out_of_order_appends(tmp_path, monkeypatch):
+    from benchmarks.stubs import install_stub_encoder
+    monkeypatch.chdir(tmp_path)  # the embedding cache is keyed by model name
+    install_stub_encoder()
+    texts = {50: "zebra stripes savanna", 21: "apple orchard trees", 10: "banana yellow tropical"}
+    indexer = Indexer(method="hybrid")
+    indexer.build_index([texts[50]], ids=[50])
+    indexer.add([texts[21]], ids=[21], background_merge=False)
+    indexer.add([texts[10]], ids=[10], background_merge=False)
+    indexer.merge(max_segments=1)
+    retriever = Retriever()
+    assert retriever.ids.tolist() == [10, 21, 50]
+    for chunk_id, text in texts.items():
+        assert retriever.query(text, top_k=1)[0][0] == text
+        (positions, _), = retriever._semantic_search([text], 1)
+        assert retriever.ids[positions].tolist() == [chunk_id]
+
+
+def test_concurrent_adds_get_distinct_ids():
+    import threading
+    Indexer(method="bm25").build_index(CORPUS[:2])
+    start = threading.Barrier(4)
+
+    def add(i):
+        start.wait()
+        Indexer(method="bm25").add([f"doc {i} a", f"doc {i} b"], background_merge=False)
+
+    threads = [threading.Thread(target=add, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(Retriever().ids.tolist()) == list(range(10))
+
+
+def test_add_requires_matching_index():
+    with pytest.raises(ValueError):
+        Indexer(method="bm25").add(["no index yet"])
+    Indexer(method="tfidf").build_index(CORPUS)
+    assert not Indexer(method="bm25").can_append()
+
+
+def test_segments_are_memory_mapped():
+    import os
+    from app.services.indexer import INDEX_DIR
+    _segmented("bm25", [4, 4])
+    retriever = Retriever()
+    seg = retriever.segments[0]
+    assert isinstance(seg.postings_docs, np.memmap)
+    assert isinstance(seg.docs, np.memmap)
+    assert retriever.documents[5] == CORPUS[5]
+    assert list(retriever.documents) == CORPUS
+    # nothing half-written is left behind
+    assert not [name for name in os.listdir(INDEX_DIR) if name.startswith(".tmp-")]
+
+
+def _zipf_corpus(num_docs=2000, vocab_size=3000, doc_len=40, seed=0):
+    rng = np.random.default_rng(seed)
+    vocab = np.array([f"t{i}" for i in range(vocab_size)])
+    p = 1.0 / np.arange(1, vocab_size + 1)
+    docs = [" ".join(rng.choice(vocab, size=doc_len, p=p / p.sum())) for _ in range(num_docs)]
+    queries = [" ".join(rng.choice(vocab[:500], size=n)) for n in (1, 2, 3, 4, 6) for _ in range(10)]
+    return docs, queries
+
+
+@pytest.mark.parametrize("method", ["bm25", "tfidf"])
+def test_maxscore_matches_exhaustive(method):
+    docs, queries = _zipf_corpus()
+    Indexer(method=method).build_index(docs)
+    scorer = Retriever().lexical
+    read = total = 0
+    for q in queries + ["t0 t1", "unknownterm", "t2999"]:
+        for k in (1, 10, 50):
+            exhaustive = scorer.top_k(q, k)
+            pruned_docs, pruned_scores, touched = scorer._maxscore(q, k)
+            np.testing.assert_allclose(pruned_scores, [s for _, s in exhaustive], rtol=1e-9, atol=1e-12)
+            # documents agree except possibly among exact ties at the cut-off
+            cutoff = exhaustive[-1][1] if exhaustive else 0.0
+            assert {d for d, s in exhaustive if s > cutoff + 1e-9} <= set(pruned_docs.tolist())
+            term_ids, _ = scorer.query_vector(q)
+            if k == 10 and len(term_ids) > 1:
+                read += touched
+                total += int(np.diff(scorer.weights.indptr)[term_ids].sum())
+    # multi-term queries skip a good share of their postings
+    assert read < 0.75 * total
+
+
+def test_delete_hides_docs_and_merge_purges_them():
+    idx = _segmented("bm25", [3, 5])
+    before = Retriever()
+    victim = before.query(QUERIES[0], 1)[0][0]
+    victim_id = int(before.ids[list(before.documents).index(victim)])
+
+    assert idx.delete([victim_id, 10_000]) == 1
+    assert idx.delete([victim_id]) == 0
+    after = Retriever()
+    texts = [t for q in QUERIES for t, _ in after.query(q, len(CORPUS))]
+    assert victim not in texts
+
+    idx.merge(max_segments=1)
+    merged = Retriever()
+    assert len(merged.segments) == 1 and len(merged.documents) == len(CORPUS) - 1
+    assert victim_id not in merged.ids.tolist()
+    assert "deleted" not in read_manifest()["segments"][0]
@@ -1,34 +1,53 @@
 import os
 import io
+import time
 import sqlite3
+import threading
 import fitz  # PyMuPDF
 import pytest
 from fastapi.testclient import TestClient
 from app.main import app
-from app.db import DB_NAME, init_db
+from app.db import DB_NAME, close_connections, init_db
+from app.services.jobs import JobQueue, QueueFullError
 
 client = TestClient(app)
 
 
+def _wait_for_job(job_id, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get(f"/ingestion/jobs/{job_id}").json()
+        if job["status"] in ("done", "failed") or time.monotonic() > deadline:
+            return job
+        time.sleep(0.02)
+
+
+def _upload(files):
+    response = client.post("/ingestion/upload", files=files)
+    assert response.status_code == 202
+    return _wait_for_job(response.json()["job_id"])
+
+
+def _remove_db():
+    close_connections()
+    for path in (DB_NAME, DB_NAME + "-wal", DB_NAME + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
 @pytest.fixture(autouse=True)
 def setup_and_teardown():
     # Fresh DB for each test
-    if os.path.exists(DB_NAME):
-        os.remove(DB_NAME)
+    _remove_db()
     init_db()
     yield
-    if os.path.exists(DB_NAME):
-        os.remove(DB_NAME)
+    _remove_db()
 
 
 def test_upload_txt():
     content = b"Hello world. This is a test file."
-    response = client.post(
-        "/ingestion/upload",
-        files={"file": ("test.txt", content, "text/plain")},
-    )
-    assert response.status_code == 200
-    data = response.json()
+    data = _upload({"file": ("test.txt", content, "text/plain")})
+    assert data["status"] == "done"
     assert data["filename"] == "test.txt"
     assert data["chunks"] >= 1
 
@@ -43,22 +62,46 @@ def test_upload_pdf():
     doc.close()
     pdf_buffer.seek(0)
 
-    response = client.post(
-        "/ingestion/upload",
-        files={"file": ("test.pdf", pdf_buffer, "application/pdf")},
-    )
-    assert response.status_code == 200
-    data = response.json()
+    data = _upload({"file": ("test.pdf", pdf_buffer, "application/pdf")})
+    assert data["status"] == "done"
     assert data["filename"] == "test.pdf"
     assert data["chunks"] >= 1
 
 
+def test_upload_streams_hashes_and_sniffs_content(monkeypatch):
+    import hashlib
+    monkeypatch.setattr("app.uploads.UPLOAD_FLUSH_BYTES", 1000)
+    content = b"".join(f"Sentence number {i} of a streamed upload.\n".encode() for i in range(2000))
+    # the name says PDF, the bytes are text: the content decides
+    data = _upload({"file": ("notes.pdf", content, "application/pdf")})
+    assert data["status"] == "done" and data["sha256"] == hashlib.sha256(content).hexdigest()
+    conn = sqlite3.connect(DB_NAME)
+    filetype, filepath = conn.execute("SELECT filetype, filepath FROM files WHERE id=?",
+                                      (data["file_id"],)).fetchone()
+    conn.close()
+    assert filetype == "txt" and filepath.endswith(".txt")
+    with open(filepath, "rb") as f:
+        assert f.read() == content
+
+
+def test_bad_uploads_are_rejected(monkeypatch):
+    binary = client.post("/ingestion/upload", files={"file": ("data.txt", b"\x00\x01\x02binary", "text/plain")})
+    assert binary.status_code == 415
+    assert client.post("/ingestion/upload", data={"other": "x"}, files={"x": ("a.txt", b"a")}).status_code == 422
+    assert client.post("/ingestion/upload", json={"file": "x"}).status_code == 415
+
+    monkeypatch.setattr("app.uploads.UPLOAD_MAX_BYTES", 100)
+    # within the Content-Length allowance for multipart overhead: stopped while streaming
+    assert client.post("/ingestion/upload", files={"file": ("big.txt", b"a" * 1000)}).status_code == 413
+    # Content-Length alone is over the limit: rejected before the body is read
+    assert client.post("/ingestion/upload", files={"file": ("big.txt", b"a" * 100_000)}).status_code == 413
+    assert not [name for name in os.listdir("data") if name.startswith(".upload-")]
+    assert client.get("/ingestion/list").json() == []
+
+
 def test_list_files():
     # Upload one file first
-    client.post(
-        "/ingestion/upload",
-        files={"file": ("sample.txt", b"some text here", "text/plain")},
-    )
+    _upload({"file": ("sample.txt", b"some text here", "text/plain")})
     response = client.get("/ingestion/list")
     assert response.status_code == 200
     files = response.json()
@@ -68,14 +111,198 @@ def test_list_files():
 
 def test_download_file():
     # Upload a file first
-    upload_resp = client.post(
-        "/ingestion/upload",
-        files={"file": ("download.txt", b"download me", "text/plain")},
-    )
-    file_id = upload_resp.json()["file_id"]
+    job = _upload({"file": ("download.txt", b"download me", "text/plain")})
+
+    response = client.get(f"/ingestion/download/{job['file_id']}")
+    assert response.status_code == 200
+    assert response.content == b"download me"
+    assert response.headers["content-type"].startswith("text/plain")
+    assert response.headers["etag"] == f'"{job["sha256"]}"'
+    assert response.headers["accept-ranges"] == "bytes"
+    assert 'filename="download.txt"' in response.headers["content-disposition"]
+    assert client.get("/ingestion/download/999999").status_code == 404
+
+
+def test_download_type_comes_from_stored_content():
+    # a text upload named like active content is still served as plain text
+    job = _upload({"file": ("page.html", b"<script>alert(1)</script>", "text/html")})
+    response = client.get(f"/ingestion/download/{job['file_id']}")
+    assert response.headers["content-type"] == "text/plain; charset=utf-8"
+    assert response.headers["x-content-type-options"] == "nosniff"
+    assert 'filename="page.html"' in response.headers["content-disposition"]
+
+
+def test_download_ranges_and_conditional_requests(monkeypatch):
+    monkeypatch.setattr("app.downloads.DOWNLOAD_CHUNK_SIZE", 7)
+    body = b"".join(f"line {i} of the blob.\n".encode() for i in range(400))
+    file_id = _upload({"file": ("blob.txt", body, "text/plain")})["file_id"]
+    url = f"/ingestion/download/{file_id}"
+    full = client.get(url)
+    assert full.content == body
+    etag = full.headers["etag"]
+
+    part = client.get(url, headers={"Range": "bytes=100-199"})
+    assert part.status_code == 206 and part.content == body[100:200]
+    assert part.headers["content-range"] == f"bytes 100-199/{len(body)}"
+    assert client.get(url, headers={"Range": "bytes=-10"}).content == body[-10:]
+    assert client.get(url, headers={"Range": f"bytes={len(body) - 5}-"}).content == body[-5:]
+    unsatisfiable = client.get(url, headers={"Range": f"bytes={len(body)}-"})
+    assert unsatisfiable.status_code == 416
+    assert unsatisfiable.headers["content-range"] == f"bytes */{len(body)}"
+    assert client.get(url, headers={"Range": "bytes=0-1,5-6"}).status_code == 200  # several ranges: whole file
+
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(url, headers={"If-Modified-Since": full.headers["last-modified"]}).status_code == 304
+    assert client.get(url, headers={"If-Match": '"other"'}).status_code == 412
+    resumed = client.get(url, headers={"Range": "bytes=10-", "If-Range": etag})
+    assert resumed.status_code == 206 and resumed.content == body[10:]
+    changed = client.get(url, headers={"Range": "bytes=10-", "If-Range": '"other"'})
+    assert changed.status_code == 200 and changed.content == body
+
+    head = client.head(url)
+    assert head.status_code == 200 and head.content == b""
+    assert head.headers["content-length"] == str(len(body))
+
+
+def test_unknown_job_is_404():
+    assert client.get("/ingestion/jobs/nope").status_code == 404
+
+
+def test_job_queue_coalesces_index_updates():
+    indexed = []
+
+    def process(filename, filepath, sha256):
+        return 1, [filename], [len(filename)]
+
+    def index(chunks, ids):
+        indexed.append(list(chunks))
+        return len(indexed)
 
-    response = client.get(f"/ingestion/download/{file_id}")
+    jobs = JobQueue(workers=2, maxsize=8, coalesce_ms=300, process=process, index=index)
+    submitted = [jobs.submit(f"f{i}.txt", "unused") for i in range(3)]
+    finished = [jobs.wait(job.id, timeout=5) for job in submitted]
+    assert all(job.status == "done" for job in finished)
+    # one index update (one segment, one generation) for all three uploads
+    assert len(indexed) == 1 and sorted(indexed[0]) == ["f0.txt", "f1.txt", "f2.txt"]
+    assert {job.index_generation for job in finished} == {1}
+
+
+def test_job_queue_backpressure_and_failures():
+    release = threading.Event()
+
+    def process(filename, filepath, sha256):
+        release.wait(5)
+        if filename == "bad.txt":
+            raise ValueError("cannot parse")
+        return 1, ["text"], [1]
+
+    jobs = JobQueue(workers=1, maxsize=1, coalesce_ms=0, process=process, index=lambda chunks, ids: 1)
+    bad = jobs.submit("bad.txt", "unused")
+    deadline = time.monotonic() + 5
+    while jobs.get(bad.id).status == "queued" and time.monotonic() < deadline:
+        time.sleep(0.01)
+    jobs.submit("queued.txt", "unused")  # fills the single slot while the worker is busy
+    with pytest.raises(QueueFullError):
+        jobs.submit("rejected.txt", "unused")
+
+    release.set()
+    failed = jobs.wait(bad.id, timeout=5)
+    assert failed.status == "failed" and "cannot parse" in failed.error
+
+
+def test_chunks_record_provenance():
+    pdf_buffer = io.BytesIO()
+    doc = fitz.open()
+    for text in ("First page text.", "Second page text."):
+        doc.new_page().insert_text((72, 72), text)
+    doc.save(pdf_buffer)
+    doc.close()
+    pdf_buffer.seek(0)
+    file_id = _upload({"file": ("pages.pdf", pdf_buffer, "application/pdf")})["file_id"]
+
+    conn = sqlite3.connect(DB_NAME)
+    chunk_id = conn.execute("SELECT id FROM chunks WHERE file_id=? ORDER BY chunk_index", (file_id,)).fetchone()[0]
+    conn.close()
+    chunk = client.get(f"/ingestion/chunks/{chunk_id}").json()
+    assert chunk["filename"] == "pages.pdf"
+    assert (chunk["page_start"], chunk["page_end"]) == (1, 2)
+    assert chunk["start_char"] == 0 and chunk["end_char"] > chunk["start_char"]
+    assert client.get("/ingestion/chunks/999999").status_code == 404
+
+
+def test_identical_content_is_ingested_once():
+    first = _upload({"file": ("a.txt", b"the same bytes twice", "text/plain")})
+    response = client.post("/ingestion/upload", files={"file": ("b.txt", b"the same bytes twice", "text/plain")})
     assert response.status_code == 200
-    data = response.json()
-    assert "filepath" in data
-    assert os.path.exists(data["filepath"])
\ No newline at end of file
+    assert response.json()["status"] == "duplicate" and response.json()["file_id"] == first["file_id"]
+
+    # same name, different content: stored side by side instead of overwritten
+    second = _upload({"file": ("a.txt", b"different bytes", "text/plain")})
+    conn = sqlite3.connect(DB_NAME)
+    paths = [conn.execute("SELECT filepath FROM files WHERE id=?", (job["file_id"],)).fetchone()[0]
+             for job in (first, second)]
+    conn.close()
+    assert paths[0] != paths[1]
+    assert client.get(f"/ingestion/download/{first['file_id']}").content == b"the same bytes twice"
+
+
+def test_job_queue_joins_in_flight_duplicates():
+    release = threading.Event()
+
+    def process(filename, filepath, sha256):
+        release.wait(5)
+        return 1, ["text"], [1]
+
+    jobs = JobQueue(workers=1, maxsize=4, coalesce_ms=0, process=process, index=lambda chunks, ids: 1)
+    first = jobs.submit("one.txt", "unused", sha256="abc")
+    assert jobs.submit("two.txt", "unused", sha256="abc") is first
+    assert jobs.submit("three.txt", "unused", sha256="def") is not first
+    release.set()
+    assert jobs.wait(first.id, timeout=5).status == "done"
+
+
+def _fail_indexing_once(monkeypatch):
+    from app.services import jobs
+    calls = []
+
+    def index_chunks(chunks, ids, method):
+        calls.append(list(ids))
+        if len(calls) == 1:
+            raise OSError("disk full")
+        return real(chunks, ids, method=method)
+    real = jobs.index_chunks
+    monkeypatch.setattr(jobs, "index_chunks", index_chunks)
+    return calls
+
+
+def test_reupload_indexes_content_left_unindexed(monkeypatch):
+    from app.services.retriever import Retriever
+    _fail_indexing_once(monkeypatch)
+    content = b"Quokkas are small marsupials. They live on Rottnest Island."
+    failed = _upload({"file": ("quokka.txt", content, "text/plain")})
+    assert failed["status"] == "failed" and "disk full" in failed["error"]
+
+    # stored but not indexed: not a duplicate, the new job indexes the stored chunks
+    again = _upload({"file": ("quokka.txt", content, "text/plain")})
+    assert again["status"] == "done" and again["file_id"] == failed["file_id"]
+    assert Retriever().query("Quokkas", top_k=1)[0][0].startswith("Quokkas are small")
+    response = client.post("/ingestion/upload", files={"file": ("quokka.txt", content, "text/plain")})
+    assert response.status_code == 200 and response.json()["status"] == "duplicate"
+
+
+def test_failed_index_pass_is_retried(monkeypatch, tmp_path):
+    from app.services.segments import MANIFEST_FILE
+    from app.services.retriever import Retriever
+    calls = _fail_indexing_once(monkeypatch)
+    path = tmp_path / "wombat.txt"
+    path.write_bytes(b"Wombats dig burrows with their strong claws.")
+    jobs = JobQueue(workers=1, maxsize=4, coalesce_ms=0, retry_s=0.1)
+    job = jobs.wait(jobs.submit("wombat.txt", str(path), sha256="wombat").id, timeout=10)
+    assert job.status == "failed"
+    # retried without another upload
+    deadline = time.monotonic() + 10
+    while not os.path.exists(MANIFEST_FILE) and time.monotonic() < deadline:
+        time.sleep(0.02)
+    retriever = Retriever()
+    assert calls[1] == calls[0] and len(retriever.ids) == len(calls[0])
+    assert retriever.query("Wombats", top_k=1)[0][0].startswith("Wombats dig")
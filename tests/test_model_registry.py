@@ -0,0 +1,112 @@
+# tests/test_model_registry.py
+import threading
+import time
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.services.model_registry import ModelRegistry, UnknownModelError
+
+
+class Model:
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+
+    # torch-module-like, so the registry counts its "parameters"
+    def parameters(self):
+        return [Tensor(self.size)]
+
+    def buffers(self):
+        return []
+
+
+class Tensor:
+    def __init__(self, size):
+        self.size = size
+
+    def numel(self):
+        return self.size
+
+    def element_size(self):
+        return 1
+
+
+def _registry(budget_bytes=0, **sizes):
+    registry = ModelRegistry(budget_bytes=budget_bytes)
+    loads = {name: 0 for name in sizes}
+
+    def loader(name):
+        def load():
+            loads[name] += 1
+            time.sleep(0.01)
+            return Model(name, sizes[name])
+        return load
+
+    for name in sizes:
+        registry.register(name, loader(name))
+    return registry, loads
+
+
+def test_models_load_lazily_and_once():
+    registry, loads = _registry(a=10)
+    assert loads["a"] == 0 and not registry.stats()["models"]["a"]["loaded"]
+    got = []
+    threads = [threading.Thread(target=lambda: got.append(registry.get("a"))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert loads["a"] == 1 and all(m is got[0] for m in got)
+    assert registry.stats()["models"]["a"]["bytes"] == 10
+    with pytest.raises(UnknownModelError):
+        registry.get("missing")
+
+
+def test_least_recently_used_models_are_unloaded_over_budget():
+    registry, loads = _registry(budget_bytes=25, a=10, b=10, c=10)
+    registry.get("a")
+    registry.get("b")
+    registry.get("a")  # b is now the least recently used
+    registry.get("c")
+    models = registry.stats()["models"]
+    assert models["a"]["loaded"] and models["c"]["loaded"] and not models["b"]["loaded"]
+    assert registry.loaded_bytes() == 20
+
+    registry.get("b")  # loaded again, a goes
+    assert loads == {"a": 1, "b": 2, "c": 1}
+    assert not registry.stats()["models"]["a"]["loaded"]
+
+    big, _ = _registry(budget_bytes=5, a=10)
+    big.put("stub", Model("stub", 3))
+    big.get("a")  # over budget on its own: kept, and the pinned stub is never dropped
+    assert big.stats()["models"]["a"]["loaded"] and big.stats()["models"]["stub"]["loaded"]
+
+
+def test_warm_up_and_unload():
+    registry, loads = _registry(a=1, b=1)
+    registry.register("broken", lambda: 1 / 0)
+    warmed = []
+    registry.register("custom", lambda: Model("custom", 1), warm=lambda: warmed.append(True))
+    results = registry.warm_up()
+    assert results["a"] == results["b"] == "ok" and results["broken"].startswith("ZeroDivisionError")
+    assert warmed and not registry.stats()["models"]["custom"]["loaded"]
+    assert registry.unload("a") and not registry.unload("a")
+    registry.get("a")
+    assert loads["a"] == 2
+
+
+def test_admin_model_endpoints(monkeypatch):
+    registry = ModelRegistry()
+    registry.register("test_model", lambda: Model("test_model", 7))
+    monkeypatch.setattr("app.routes.admin.MODELS", registry)
+    client = TestClient(app)
+    assert client.get("/admin/models").json()["models"]["test_model"] == {"loaded": False}
+
+    r = client.post("/admin/models/warmup", json={"models": ["test_model"]})
+    assert r.status_code == 200
+    body = r.json()
+    assert body["results"] == {"test_model": "ok"} and body["models"]["test_model"]["bytes"] == 7
+
+    assert client.delete("/admin/models/test_model").json() == {"model": "test_model", "unloaded": True}
+    assert client.post("/admin/models/warmup", json={"models": ["nope"]}).status_code == 404
+    assert client.delete("/admin/models/nope").status_code == 404
@@ -0,0 +1,37 @@
+# tests/test_pdf_parser.py
+import fitz  # PyMuPDF
+import pytest
+from app.services.chunker import chunk_text, iter_word_chunks
+from app.services.pdf_parser import extract_text_from_pdf, iter_pdf_pages
+
+
+@pytest.fixture
+def manual(tmp_path):
+    path = str(tmp_path / "manual.pdf")
+    doc = fitz.open()
+    for i in range(12):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"page {i + 1} says hello")
+    doc.save(path)
+    doc.close()
+    return path
+
+
+def test_iter_pdf_pages_yields_numbered_pages(manual):
+    pages = list(iter_pdf_pages(manual, workers=1))
+    assert [p.number for p in pages] == list(range(1, 13))
+    assert "page 3 says hello" in pages[2].text
+    assert extract_text_from_pdf(manual) == "".join(p.text for p in pages)
+
+
+def test_parallel_extraction_matches_serial(manual):
+    serial = list(iter_pdf_pages(manual, workers=1))
+    parallel = list(iter_pdf_pages(manual, workers=2, pages_per_task=5, parallel_min_pages=2))
+    assert parallel == serial
+
+
+def test_streaming_chunks_match_chunk_text():
+    pieces = ["alpha be", "ta gamma\n", "", "delta ", "epsilon zeta eta"]
+    text = "".join(pieces)
+    assert list(iter_word_chunks(pieces, chunk_size=2)) == chunk_text(text, chunk_size=2)
+    assert chunk_text("one two three", chunk_size=2) == ["one two", "three"]
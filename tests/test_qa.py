@@ -1,15 +1,26 @@
 # tests/test_qa.py
 # This test avoids requiring faiss/sentence-transformers in CI by monkeypatching the Retriever
 import json
+import time
+from concurrent.futures import Future
 from fastapi.testclient import TestClient
 import pytest
 from app.main import app
+from app.services.answer import LATENCY
+from app.services.summary_pool import SummaryStream
 
-RETRIEVER_IMPORT_PATH = "app.routes.qa.Retriever"
+RETRIEVER_IMPORT_PATH = "app.routes.qa.get_retriever"
 
 client = TestClient(app)
 
 
+@pytest.fixture(autouse=True)
+def reset_latency():
+    LATENCY.reset()
+    yield
+    LATENCY.reset()
+
+
 class DummyRetriever:
     def __init__(self, *args, **kwargs):
         pass
@@ -18,10 +29,13 @@ class DummyRetriever:
         # return deterministic sample matching (text, score) tuples
         return [("This is a sample passage about hybrid retrieval.", 0.95)]
 
+    def query_batch(self, queries, top_k=3):
+        return [self.query(q, top_k) for q in queries]
+
 
 @pytest.fixture(autouse=True)
 def patch_retriever(monkeypatch):
-    # Monkeypatch the Retriever used by the route to be DummyRetriever.
+    # Monkeypatch the retriever factory used by the route to return a DummyRetriever.
     from importlib import import_module
     module_path, class_name = RETRIEVER_IMPORT_PATH.rsplit(".", 1)
     module = import_module(module_path)
@@ -49,4 +63,121 @@ def test_query_endpoint_basic():
 
 def test_query_missing_q():
     resp = client.post("/query", json={})
-    assert resp.status_code in (400, 422)
\ No newline at end of file
+    assert resp.status_code in (400, 422)
+
+
+def test_query_batch_endpoint():
+    payload = {"queries": ["what is hybrid retrieval", "what is bm25"], "top_k": 1}
+    resp = client.post("/query/batch", json=payload)
+    assert resp.status_code == 200
+    body = resp.json()
+    assert [r["query"] for r in body["results"]] == payload["queries"]
+    assert all(len(r["results"]) == 1 for r in body["results"])
+
+
+def test_query_batch_empty():
+    resp = client.post("/query/batch", json={"queries": []})
+    assert resp.status_code == 422
+
+
+def _transformer(*pieces, error=None, stall=False):
+    """transformer_summarize_stream stand-in: a SummaryStream of these pieces."""
+    def start(text, **kwargs):
+        def submit(on_piece):
+            future = Future()
+            for piece in pieces:
+                on_piece(piece)
+            if error is not None:
+                future.set_exception(error)
+            elif not stall:
+                future.set_result("".join(pieces))
+            return future
+        return SummaryStream(submit, timeout=5)
+    return start
+
+
+def _unavailable(text, **kwargs):
+    raise RuntimeError("model unavailable")
+
+
+def _textrank(text, method="textrank", **kwargs):
+    yield "Hybrid retrieval"
+    yield " combines signals."
+
+
+def test_query_stream_ndjson(monkeypatch):
+    monkeypatch.setattr("app.services.answer.transformer_summarize_stream", _unavailable)
+    monkeypatch.setattr("app.services.answer.summarize_stream", _textrank)
+    with client.stream("POST", "/query/stream", json={"q": "what is hybrid retrieval", "top_k": 1}) as resp:
+        assert resp.status_code == 200
+        assert resp.headers["content-type"].startswith("application/x-ndjson")
+        events = [json.loads(line) for line in resp.iter_lines() if line]
+    assert [e["event"] for e in events] == ["results", "answer", "answer", "done"]
+    assert events[0]["results"][0]["text"] == "This is a sample passage about hybrid retrieval."
+    # transformer failed before producing anything -> TextRank pieces
+    assert events[-1]["answer"] == "Hybrid retrieval combines signals."
+    assert events[-1]["answer_method"] == "textrank"
+
+
+def test_query_stream_sse(monkeypatch):
+    monkeypatch.setattr("app.services.answer.transformer_summarize_stream", _transformer("Short answer."))
+    resp = client.post("/query/stream", json={"q": "hybrid", "top_k": 1}, headers={"Accept": "text/event-stream"})
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/event-stream")
+    blocks = [b.split("\n") for b in resp.text.strip().split("\n\n")]
+    assert [b[0] for b in blocks] == ["event: results", "event: answer", "event: done"]
+    assert json.loads(blocks[-1][1][len("data: "):]) == {"answer": "Short answer.", "answer_method": "transformer"}
+
+
+def test_query_stream_error_midway(monkeypatch):
+    monkeypatch.setattr("app.services.answer.transformer_summarize_stream",
+                        _transformer("partial", error=RuntimeError("out of memory")))
+    resp = client.post("/query/stream", json={"q": "hybrid", "top_k": 1})
+    events = [json.loads(line) for line in resp.text.splitlines() if line]
+    assert [e["event"] for e in events] == ["results", "answer", "error"]
+    assert "out of memory" in events[-1]["detail"]
+
+
+def test_query_stream_budget_falls_back_before_streaming(monkeypatch):
+    # the transformer never produces a piece: TextRank answers within the budget
+    monkeypatch.setattr("app.services.answer.transformer_summarize_stream", _transformer(stall=True))
+    monkeypatch.setattr("app.services.answer.summarize_stream", _textrank)
+    start = time.monotonic()
+    resp = client.post("/query/stream", json={"q": "hybrid", "top_k": 1, "budget_ms": 300})
+    assert time.monotonic() - start < 2
+    done = json.loads(resp.text.splitlines()[-1])
+    assert done["answer_method"] == "textrank" and done["answer"] == "Hybrid retrieval combines signals."
+    # the overrun was recorded for the next requests
+    assert LATENCY.estimate("transformer_stream", len(done["answer"])) is not None
+
+
+def test_query_stream_truncated_at_deadline(monkeypatch):
+    monkeypatch.setattr("app.services.answer.transformer_summarize_stream", _transformer("Hybrid", stall=True))
+    resp = client.post("/query/stream", json={"q": "hybrid", "top_k": 1, "budget_ms": 300})
+    events = [json.loads(line) for line in resp.text.splitlines() if line]
+    assert [e["event"] for e in events] == ["results", "answer", "done"]
+    assert events[-1] == {"event": "done", "answer": "Hybrid", "answer_method": "transformer", "truncated": True}
+
+
+def test_query_stream_no_time_for_models(monkeypatch):
+    monkeypatch.setattr("app.services.answer.transformer_summarize_stream", _unavailable)
+    monkeypatch.setattr("app.services.answer.summarize_stream", _unavailable)
+    LATENCY.observe("textrank", 50, 10.0)
+    resp = client.post("/query/stream", json={"q": "hybrid", "top_k": 1, "budget_ms": 300})
+    done = json.loads(resp.text.splitlines()[-1])
+    assert done["answer_method"] == "lead"
+    assert done["answer"] == "This is a sample passage about hybrid retrieval."
+
+
+def test_query_budget_is_passed_to_answer(monkeypatch):
+    seen = {}
+
+    def fake_answer(text, deadline, generation=None):
+        seen["remaining"] = deadline - time.monotonic()
+        return "short", "lead"
+    monkeypatch.setattr("app.routes.qa.generate_answer", fake_answer)
+    resp = client.post("/query", json={"q": "hybrid", "top_k": 1, "budget_ms": 250})
+    assert resp.status_code == 200
+    assert resp.json()["answer"] == "short" and resp.json()["answer_method"] == "lead"
+    assert 0 < seen["remaining"] <= 0.25
+    assert client.post("/query", json={"q": "hybrid", "budget_ms": 0}).status_code == 422
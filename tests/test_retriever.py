@@ -0,0 +1,29 @@
+# tests/test_retriever.py
+import pytest
+from app.services.indexer import Indexer, read_index_generation
+from app.services.retriever import get_retriever
+
+
+def test_get_retriever_without_index():
+    with pytest.raises(FileNotFoundError):
+        get_retriever()
+
+
+def test_get_retriever_is_cached_per_generation():
+    Indexer(method="bm25").build_index(["alpha beta", "gamma delta", "epsilon zeta"])
+    first = get_retriever()
+    assert get_retriever() is first
+    assert first.generation == read_index_generation()
+
+
+def test_get_retriever_reloads_after_rebuild():
+    Indexer(method="bm25").build_index(["alpha beta", "gamma delta", "epsilon zeta"])
+    old = get_retriever()
+
+    Indexer(method="bm25").build_index(["alpha beta", "gamma delta", "epsilon zeta", "omega omega"])
+    new = get_retriever()
+    assert new is not old
+    assert new.generation > old.generation
+    assert new.query("omega", top_k=1)[0][0] == "omega omega"
+    # the old snapshot is untouched for queries still holding it
+    assert len(old.documents) == 3
@@ -0,0 +1,113 @@
+# tests/test_shards.py
+import pytest
+from app.services import shards
+from app.services.indexer import Indexer
+from app.services.retriever import Retriever, get_retriever
+from benchmarks.suite import documents
+
+
+def _corpus():
+    return [chunk for doc in documents(300, chunk_words=20, vocab_size=500) for chunk in
+            (" ".join(doc.split()[i:i + 20]) for i in range(0, len(doc.split()), 20))]
+
+
+# frequent and rare terms of the corpus vocabulary, so every query has more than top_k hits
+QUERIES = [f"w{i} w{i * 7 % 300}" for i in range(1, 40, 2)]
+
+
+def _build(method, chunks):
+    indexer = Indexer(method=method)
+    ids = list(range(1, len(chunks) + 1))
+    # several segments and a tombstone, so shards own parts of each
+    indexer.build_index(chunks[:200], ids=ids[:200])
+    indexer.add(chunks[200:], ids=ids[200:])
+    indexer.delete([3, 250])
+
+
+def _assert_same_results(sharded, single, queries, top_k=5):
+    for got, want in zip(sharded.query_batch(queries, top_k), (single.query(q, top_k) for q in queries)):
+        assert [t for t, _ in got] == [t for t, _ in want]
+        assert [s for _, s in got] == pytest.approx([s for _, s in want], rel=1e-5)
+
+
+@pytest.fixture
+def pool():
+    pool = shards.ShardPool(num_shards=3)
+    yield pool
+    pool.close()
+
+
+@pytest.mark.parametrize("method", ["bm25", "tfidf"])
+def test_sharded_lexical_matches_single_retriever(pool, method):
+    _build(method, _corpus())
+    single = Retriever()
+    sharded = shards.ShardedRetriever(pool, single.generation, method)
+    assert sharded.generation == single.generation
+    _assert_same_results(sharded, single, QUERIES)
+    assert sharded.query("w1 w2", 3) == sharded.query_batch(["w1 w2"], 3)[0]
+
+
+def test_sharded_hybrid_matches_single_retriever(tmp_path, monkeypatch):
+    from benchmarks.stubs import install_stub_encoder
+    # scratch directory: the embedding cache is keyed by the configured model name
+    monkeypatch.chdir(tmp_path)
+    install_stub_encoder()
+    _build("hybrid", _corpus())
+    single = Retriever()
+    pool = shards.ShardPool(num_shards=3)
+    try:
+        _assert_same_results(shards.ShardedRetriever(pool, single.generation, "hybrid"), single, QUERIES)
+    finally:
+        pool.close()
+
+
+def test_single_segment_hybrid_spreads_vectors_over_shards(tmp_path, monkeypatch):
+    from benchmarks.stubs import install_stub_encoder
+    from app.services.retriever import embed_queries
+    from app.services.embeddings import get_encoder
+    monkeypatch.chdir(tmp_path)
+    install_stub_encoder()
+    chunks = _corpus()
+    Indexer(method="hybrid").build_index(chunks, ids=list(range(1, len(chunks) + 1)))
+    q_emb = embed_queries(get_encoder(), QUERIES[:3])
+    for k in range(3):
+        snapshot = Retriever(shard=(k, 3))
+        # each shard searches vectors of its own chunks only, whatever segment they are in
+        (index, _), = snapshot._shard_indexes
+        assert index.ntotal == sum(1 for i in range(1, len(chunks) + 1) if i % 3 == k)
+        for positions, _ in snapshot.vector_search(q_emb, 5):
+            assert positions and all(int(snapshot.ids[p]) % 3 == k for p in positions)
+
+
+def test_concurrent_queries_share_the_pool(pool):
+    from concurrent.futures import ThreadPoolExecutor
+    _build("bm25", _corpus())
+    sharded = shards.ShardedRetriever(pool, Retriever().generation, "bm25")
+    expected = [sharded.query(q, 5) for q in QUERIES]
+    with ThreadPoolExecutor(8) as executor:
+        # replies are matched to their own requests while many are in flight on each worker
+        assert list(executor.map(lambda q: sharded.query(q, 5), QUERIES * 3)) == expected * 3
+    assert all(not s._pending for s in pool._shards)
+
+
+def test_get_retriever_uses_shards_and_follows_generations(pool, monkeypatch):
+    monkeypatch.setattr(shards, "INDEX_SHARDS", 3)
+    monkeypatch.setattr(shards, "get_shard_pool", lambda: pool)
+    chunks = _corpus()
+    Indexer(method="bm25").build_index(chunks[:100], ids=list(range(1, 101)))
+    first = get_retriever()
+    assert isinstance(first, shards.ShardedRetriever)
+
+    Indexer(method="bm25").add(["omega omega"], ids=[1000])
+    second = get_retriever()
+    assert second.generation > first.generation
+    assert second.query("omega", top_k=1)[0][0] == "omega omega"
+
+
+def test_dead_shard_is_restarted(pool):
+    _build("bm25", _corpus())
+    sharded = shards.ShardedRetriever(pool, Retriever().generation, "bm25")
+    expected = sharded.query("w1 w2", 3)
+    pool._shards[1].process.kill()
+    pool._shards[1].process.join()
+    assert sharded.query("w1 w2", 3) == expected
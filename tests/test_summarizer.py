@@ -0,0 +1,74 @@
+# tests/test_summarizer.py
+import queue
+import time
+import pytest
+from app.services import summarizer
+from app.services.summarizer import _threaded_stream
+from app.services.summary_pool import SummaryQueueFullError
+
+_END = object()
+
+
+class FakeStreamer:
+    """The part of transformers' TextIteratorStreamer that generate() and the consumer use."""
+
+    def __init__(self):
+        self.pieces = queue.Queue()
+
+    def put(self, text):
+        self.pieces.put(text)
+
+    def end(self):
+        self.pieces.put(_END)
+
+    def __iter__(self):
+        while (piece := self.pieces.get(timeout=10)) is not _END:
+            yield piece
+
+
+def test_generate_failure_reaches_the_consumer():
+    streamer = FakeStreamer()
+
+    def generate(cancelled):
+        streamer.put("Hybrid retrieval")
+        raise RuntimeError("CUDA out of memory")
+
+    pieces = []
+    with pytest.raises(RuntimeError, match="out of memory"):
+        for piece in _threaded_stream(generate, streamer):
+            pieces.append(piece)
+    assert pieces == ["Hybrid retrieval"]
+
+
+def test_closing_the_stream_cancels_generation():
+    streamer = FakeStreamer()
+    seen = {}
+
+    def generate(cancelled):
+        for word in ("one", "", " two"):
+            streamer.put(word)
+        seen["cancelled"] = cancelled.wait(timeout=10)
+        streamer.end()
+
+    stream = _threaded_stream(generate, streamer)
+    assert next(stream) == "one"
+    assert next(stream) == " two"  # empty pieces are skipped
+    stream.close()
+    assert seen["cancelled"]
+
+
+def test_in_process_streams_are_bounded(monkeypatch):
+    def slow_stream(text, max_length, min_length):
+        for word in text.split():
+            time.sleep(0.05)
+            yield word + " "
+    monkeypatch.setattr(summarizer, "get_summary_pool", lambda: None)
+    monkeypatch.setattr(summarizer, "transformer_generate_stream", slow_stream)
+    first = summarizer.transformer_summarize_stream("a b c d")
+    # the only local slot is taken: rejected rather than queued
+    with pytest.raises(SummaryQueueFullError):
+        summarizer.transformer_summarize_stream("x y")
+    assert "".join(first) == "a b c d "
+    second = summarizer.transformer_summarize_stream("x y")
+    assert second.next(timeout=10) == "x "
+    second.close()
@@ -0,0 +1,192 @@
+# tests/test_summary_pool.py
+import os
+import time
+import threading
+import pytest
+from app.services.summary_pool import (
+    RemoteSummaryPool,
+    SummaryStream,
+    SummaryPool,
+    SummaryQueueFullError,
+    SummaryServer,
+    SummaryWorkerError,
+)
+
+BATCH_FN = "tests.test_summary_pool:"
+
+
+# batch functions run inside the spawned workers
+def sized_batch(texts, max_length, min_length):
+    return [f"{len(texts)}:{t[:max_length]}" for t in texts]
+
+
+def slow_batch(texts, max_length, min_length):
+    time.sleep(1.0)
+    return [t.upper() for t in texts]
+
+
+def logging_batch(texts, max_length, min_length):
+    # texts are "<log path>|<text>"; records what was actually computed
+    for t in texts:
+        path, text = t.split("|")
+        with open(path, "a") as f:
+            f.write(text + "\n")
+    time.sleep(0.5)
+    return [t.split("|")[1] for t in texts]
+
+
+def word_stream(text, max_length, min_length):
+    if text == "endless":
+        while True:
+            time.sleep(0.05)
+            yield "more "
+    if text == "fail":
+        yield "partial "
+        raise ValueError("generation failed")
+    for word in text.split()[:max_length]:
+        yield word + " "
+
+
+def crashing_batch(texts, max_length, min_length):
+    if "crash" in texts:
+        os._exit(3)
+    if "fail" in texts:
+        raise ValueError("bad input")
+    return texts
+
+
+@pytest.fixture
+def make_pool():
+    pools = []
+
+    def make(batch_fn, **kwargs):
+        pools.append(SummaryPool(batch_fn=BATCH_FN + batch_fn, **kwargs))
+        return pools[-1]
+    yield make
+    for pool in pools:
+        pool.close()
+
+
+def test_concurrent_requests_are_batched(make_pool):
+    pool = make_pool("sized_batch", workers=1, window_ms=500, max_batch=8)
+    pool.summarize("warm up", timeout=60)
+    futures = [pool.submit(f"text {i}", max_length=6) for i in range(4)]
+    assert [f.result(timeout=30) for f in futures] == [f"4:text {i}" for i in range(4)]
+    # different length bounds are generated separately
+    a, b = pool.submit("abcdef", max_length=2), pool.submit("abcdef", max_length=3)
+    assert (a.result(timeout=30), b.result(timeout=30)) == ("1:ab", "1:abc")
+
+
+def test_full_queue_pushes_back(make_pool):
+    pool = make_pool("slow_batch", workers=1, queue_size=1, window_ms=0)
+    first = pool.submit("first")
+    time.sleep(0.5)  # let the worker take it, so the queue has room for one more
+    deadline = time.monotonic() + 30
+    while pool.pending() and time.monotonic() < deadline:
+        try:
+            pool.submit("more")
+        except SummaryQueueFullError:
+            break
+    else:
+        pytest.fail("queue never filled")
+    assert first.result(timeout=30) == "FIRST"
+
+
+def test_worker_errors_and_crashes(make_pool):
+    pool = make_pool("crashing_batch", workers=1, window_ms=0)
+    with pytest.raises(SummaryWorkerError, match="bad input"):
+        pool.summarize("fail", timeout=60)
+    with pytest.raises(SummaryWorkerError, match="exited"):
+        pool.summarize("crash", timeout=60)
+    # the worker was replaced
+    assert pool.summarize("fine", timeout=60) == "fine"
+
+
+def test_timed_out_request_is_not_computed(make_pool, tmp_path):
+    from concurrent.futures import TimeoutError as FutureTimeoutError
+    log = tmp_path / "computed.txt"
+    pool = make_pool("logging_batch", workers=1, window_ms=0, max_batch=1)
+    first = pool.submit(f"{log}|first")
+    time.sleep(0.2)  # the worker is busy with it
+    with pytest.raises(FutureTimeoutError):
+        pool.summarize(f"{log}|abandoned", timeout=0.1)
+    assert pool.pending() == 1
+    assert first.result(timeout=30) == "first"
+    assert pool.summarize(f"{log}|next", timeout=30) == "next"
+    assert log.read_text().split() == ["first", "next"]
+
+
+def test_remote_cancel_reaches_the_pool(make_pool, tmp_path):
+    log = tmp_path / "computed.txt"
+    pool = make_pool("logging_batch", workers=1, window_ms=0, max_batch=1)
+    server = SummaryServer(pool, "127.0.0.1:0", authkey=b"test")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.address
+    remote = RemoteSummaryPool(f"{host}:{port}", authkey=b"test")
+    try:
+        first = remote.submit(f"{log}|first")
+        abandoned = remote.submit(f"{log}|abandoned")
+        time.sleep(0.2)
+        assert abandoned.cancel()
+        assert first.result(timeout=30) == "first"
+        assert remote.summarize(f"{log}|next", timeout=30) == "next"
+        assert log.read_text().split() == ["first", "next"]
+    finally:
+        remote.close()
+        server.close()
+
+
+def test_streams_come_from_the_workers(make_pool):
+    pool = make_pool("sized_batch", stream_fn=BATCH_FN + "word_stream", workers=1, window_ms=0)
+    stream = pool.stream("one two three", max_length=2, timeout=60)
+    assert isinstance(stream, SummaryStream)
+    assert list(stream) == ["one ", "two "]
+    assert stream.future.result() == "one two "
+    failing = pool.stream("fail", timeout=60)
+    assert failing.next(timeout=60) == "partial "
+    with pytest.raises(SummaryWorkerError, match="generation failed"):
+        failing.next(timeout=60)
+
+
+def test_closing_a_stream_stops_its_worker(make_pool):
+    pool = make_pool("sized_batch", stream_fn=BATCH_FN + "word_stream", workers=1, window_ms=0, max_batch=1)
+    stream = pool.stream("endless", timeout=60)
+    assert stream.next(timeout=60) == "more "
+    stream.close()
+    # the only worker is free again
+    assert pool.summarize("after", timeout=10) == "1:after"
+    assert pool.pending() == 0
+
+
+def test_streams_are_not_batched(make_pool):
+    pool = make_pool("slow_batch", stream_fn=BATCH_FN + "word_stream", workers=2, window_ms=300, max_batch=8)
+    # two streams at once run on a worker each, not one after the other
+    first, second = pool.stream("endless", timeout=60), pool.stream("endless", timeout=60)
+    assert first.next(timeout=60) == "more " and second.next(timeout=60) == "more "
+    first.close()
+    second.close()
+    deadline = time.monotonic() + 10
+    while pool.pending() and time.monotonic() < deadline:
+        time.sleep(0.02)
+
+    # a stream arriving while a worker gathers a batch goes to the idle worker
+    batched = pool.submit("batched")
+    time.sleep(0.05)
+    stream = pool.stream("quick", timeout=60)
+    assert stream.next(timeout=0.9) == "quick "
+    assert batched.result(timeout=10) == "BATCHED"
+
+
+def test_remote_pool_through_service(make_pool):
+    pool = make_pool("sized_batch", stream_fn=BATCH_FN + "word_stream", workers=1, window_ms=0)
+    server = SummaryServer(pool, "127.0.0.1:0", authkey=b"test")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.address
+    remote = RemoteSummaryPool(f"{host}:{port}", authkey=b"test")
+    try:
+        assert remote.summarize("hello world", max_length=5, timeout=60) == "1:hello"
+        assert list(remote.stream("hello streaming world", timeout=60)) == ["hello ", "streaming ", "world "]
+        assert remote.pending() == 0
+    finally:
+        remote.close()
+        server.close()
@@ -0,0 +1,56 @@
+# tests/test_tracing.py
+import time
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app import tracing
+from app.main import app
+from app.tracing import Counter, Histogram, TimingMiddleware, span
+
+
+def test_histogram_renders_cumulative_buckets():
+    hist = Histogram("test_latency_seconds", "Test latency.", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        hist.observe(value, stage="a")
+    text = hist.render()
+    assert '# TYPE mka_test_latency_seconds histogram' in text
+    assert 'mka_test_latency_seconds_bucket{stage="a",le="0.1"} 1' in text
+    assert 'mka_test_latency_seconds_bucket{stage="a",le="1"} 3' in text
+    assert 'mka_test_latency_seconds_bucket{stage="a",le="+Inf"} 4' in text
+    assert 'mka_test_latency_seconds_count{stage="a"} 4' in text
+    assert hist.count(stage="a") == 4
+
+    counter = Counter("test_events_total", "Test events.", ("kind",))
+    counter.inc(kind='say "hi"')
+    assert 'mka_test_events_total{kind="say \\"hi\\""} 1' in counter.render()
+
+
+def test_server_timing_header_lists_request_spans():
+    demo = FastAPI()
+    demo.add_middleware(TimingMiddleware, server_timing=True)
+
+    @demo.get("/slow/{item}")
+    def slow(item: int):  # sync endpoint: runs in the threadpool
+        for _ in range(2):
+            with span("demo.work"):
+                time.sleep(0.01)
+        return {"item": item}
+
+    response = TestClient(demo).get("/slow/7")
+    assert response.status_code == 200
+    entries = dict(e.split(";dur=") for e in response.headers["server-timing"].split(", "))
+    assert float(entries["demo.work"]) >= 20  # both spans, summed
+    assert float(entries["total"]) >= float(entries["demo.work"])
+    assert tracing.STAGE_SECONDS.count(stage="demo.work") >= 2
+    # routes are labelled by template, not by concrete path
+    assert tracing.HTTP_REQUESTS.value(method="GET", route="/slow/{item}", status="200") == 1
+
+
+def test_metrics_endpoint_exposes_prometheus_text():
+    client = TestClient(app)
+    client.get("/health")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'mka_http_requests_total{method="GET",route="/health",status="200"}' in response.text
+    assert "# TYPE mka_stage_duration_seconds histogram" in response.text
+    assert "server-timing" not in response.headers  # off unless SERVER_TIMING=1
@@ -0,0 +1,86 @@
+# tests/test_vector_index.py
+import numpy as np
+import pytest
+from app.services.vector_index import (
+    build_vector_index,
+    choose_index_type,
+    choose_quantization,
+    evaluate_against_flat,
+    exact_top_k,
+    index_bytes,
+    remove_vectors,
+    search,
+)
+
+
+def _vectors(n=2000, dim=32, seed=0):
+    x = np.random.default_rng(seed).standard_normal((n, dim)).astype("float32")
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def test_choose_index_type_by_size():
+    assert choose_index_type(1_000, "auto") == "flat"
+    assert choose_index_type(100_000, "auto") == "hnsw"
+    assert choose_index_type(1_000_000, "auto") == "ivf_flat"
+    assert choose_index_type(10_000_000, "auto") == "ivf_pq"
+    assert choose_index_type(500, "ivf_pq") == "flat"  # too few points to train
+    with pytest.raises(ValueError):
+        choose_index_type(10, "annoy")
+
+
+@pytest.mark.parametrize("kind", ["flat", "hnsw", "ivf_flat", "ivf_pq"])
+def test_index_returns_chunk_ids(kind):
+    x = _vectors()
+    ids = np.arange(len(x), dtype=np.int64) * 7 + 100  # sparse, non-positional ids
+    index, built, _ = build_vector_index(x, ids, kind=kind, quantization="none")
+    assert built == kind
+
+    _, found = index.search(x[:5], 1)
+    assert set(found[:, 0]) <= set(ids.tolist())
+    report = evaluate_against_flat(index, x, ids, k=10)
+    assert report["recall_at_k"] >= (0.99 if kind in ("flat", "hnsw") else 0.3)
+
+
+def test_exact_top_k_scans_in_blocks(tmp_path):
+    x = _vectors()
+    ids = np.arange(len(x), dtype=np.int64) * 3 + 1
+    np.save(tmp_path / "embeddings.npy", x)
+    mapped = np.load(tmp_path / "embeddings.npy", mmap_mode="r")
+    queries = x[:7]
+    found = exact_top_k(mapped, ids, queries, 10, block_rows=300)  # blocks do not divide n
+    expected = ids[np.argsort(-(queries @ x.T), axis=1)[:, :10]]
+    assert [sorted(row) for row in found.tolist()] == [sorted(row) for row in expected.tolist()]
+
+
+def test_remove_vectors():
+    x = _vectors()
+    ids = np.arange(len(x), dtype=np.int64)
+    index, _, _ = build_vector_index(x, ids, kind="ivf_flat", quantization="none")
+    assert remove_vectors(index, [0, 1, 2])
+    assert index.ntotal == len(x) - 3
+    _, found = index.search(x[:3], 5)
+    assert not set(found.ravel()) & {0, 1, 2}
+
+
+def test_choose_quantization():
+    assert choose_quantization(5_000, "flat", "sq8") == "sq8"
+    assert choose_quantization(5_000, "ivf_pq", "none") == "pq"
+    assert choose_quantization(100, "flat", "pq") == "sq8"  # too few points for codebooks
+    with pytest.raises(ValueError):
+        choose_quantization(100, "flat", "int4")
+
+
+@pytest.mark.parametrize("quantization", ["fp16", "sq8", "pq"])
+def test_quantized_index_with_exact_rescoring(quantization):
+    x = _vectors()
+    ids = np.arange(len(x), dtype=np.int64) * 3
+    full, _, _ = build_vector_index(x, ids, kind="flat", quantization="none")
+    index, _, built = build_vector_index(x, ids, kind="flat", quantization=quantization)
+    assert built == quantization
+    assert index_bytes(index) < index_bytes(full)
+
+    # rescored scores are exact inner products against the float32 vectors
+    scores, found = search(index, x[:20], 10, embeddings=x, ids=ids)
+    np.testing.assert_allclose(scores, np.einsum("qkd,qd->qk", x[found // 3], x[:20]), rtol=1e-5)
+    report = evaluate_against_flat(index, x, ids, k=10, rerank=True)
+    assert report["recall_at_k"] >= (0.9 if quantization == "pq" else 0.99)